@@ -10,7 +10,7 @@ from feedback_survey_insights.feedback_survey_api_stack import FeedbackSurveyApi
 
 
 app = cdk.App()
-FeedbackSurveyInsightsStack(app, "FeedbackSurveyInsightsStack",)
+insights_stack = FeedbackSurveyInsightsStack(app, "FeedbackSurveyInsightsStack",)
 # FeedbackSurveyProcessingStack(app, "FeedbackSurveyProcessingStack")
 project_name = app.node.try_get_context("project_name") or "FeedbackSurveyProject"
 bucket_name = app.node.try_get_context("bucket_name")
@@ -20,6 +20,7 @@ state_machine_stack = FeedbackSurveyStateMachineStack(
     app, "FeedbackSurveyStateMachineStack",
     project_name=project_name,
     bucket_name=bucket_name,
+    common_layer=insights_stack.common_layer,
 )
 
 # Instantiate the API Stack
@@ -28,9 +29,12 @@ api_stack = FeedbackSurveyApiStack(
     project_name=project_name,
     state_machine_arn=state_machine_stack.state_machine_arn,
     bucket_name=bucket_name,
+    job_registry_table_name=state_machine_stack.job_registry_table_name,
+    common_layer=insights_stack.common_layer,
 )
 
 # Add dependency
+state_machine_stack.add_dependency(insights_stack)
 api_stack.add_dependency(state_machine_stack)
 
 app.synth()
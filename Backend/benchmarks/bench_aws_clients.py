@@ -0,0 +1,111 @@
+"""Warm-invocation latency: a client per call versus the shared pooled client.
+
+Runs against a local HTTP stand-in for S3, so it needs boto3 but no AWS
+account or network access:
+
+    python benchmarks/bench_aws_clients.py --iterations 500
+
+Each iteration is what a warm Lambda invocation does against S3: one
+GetObject. The "per call" case builds a client first, as check_status,
+generate_insights and athena_query used to; the "shared" case uses
+aws_clients.get_client, which keeps the client and its keep-alive
+connections for the life of the process.
+"""
+import argparse
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda_layers", "common", "python"))
+
+import boto3
+import aws_clients
+
+BODY = b"id,market\n1,West\n"
+
+
+class StandInS3(BaseHTTPRequestHandler):
+    # HTTP/1.1 so connections stay open between requests
+    protocol_version = "HTTP/1.1"
+    # Simulated service time; the benchmark measures what the client adds
+    latency_seconds = 0.0
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out in separate writes; without this, Nagle
+        # plus delayed ACKs add ~40 ms to every reused connection
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        StandInS3.connections += 1
+
+    def do_GET(self):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(BODY)))
+        self.send_header("ETag", '"stand-in"')
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+def run(label, get_object, iterations):
+    StandInS3.connections = 0
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        get_object()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    print(
+        f"{label:<10} p50 {statistics.median(timings):7.2f} ms   "
+        f"p95 {timings[int(len(timings) * 0.95) - 1]:7.2f} ms   "
+        f"connections opened {StandInS3.connections}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated service time per request")
+    args = parser.parse_args()
+
+    StandInS3.latency_seconds = args.latency_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInS3)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_port}"
+
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "stand-in")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "stand-in")
+
+    def new_client():
+        return boto3.client("s3", region_name="us-east-1", endpoint_url=endpoint)
+
+    def per_call():
+        new_client().get_object(Bucket="bucket", Key="survey.csv")["Body"].read()
+
+    aws_clients.set_client_factory(
+        lambda service, region: boto3.client(
+            service, region_name="us-east-1", endpoint_url=endpoint,
+            config=aws_clients.client_config(service)
+        )
+    )
+
+    def shared():
+        aws_clients.get_client("s3").get_object(Bucket="bucket", Key="survey.csv")["Body"].read()
+
+    # First shared call pays client creation, like a cold start
+    shared()
+    run("per call", per_call, args.iterations)
+    run("shared", shared, args.iterations)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""How stable the clusters of sampled clustering are against a full run.
+
+Embeds the comments of a survey CSV once (raw headers or the Glue column
+names), clusters every document, then clusters stratified samples of each
+--sample-sizes size with the rest assigned to the nearest centroid, as the
+processing script does above its --sample-size:
+
+    python benchmarks/bench_cluster_sampling.py --data survey.csv --sample-sizes 1000,5000,20000
+    python benchmarks/bench_cluster_sampling.py --data survey.csv --repeat 50 --fake-embeddings
+
+Agreement with the full run is over rows: the adjusted Rand index and
+normalized mutual information of the two labelings (1.0 is identical), and
+the share of rows that are noise (is_unique) in each. --repeat copies the
+rows with their comments reworded slightly, to try sizes beyond the file.
+Needs the processing script's dependencies.
+"""
+import argparse
+import contextlib
+import os
+import sys
+import time
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BACKEND)
+# Ahead of BACKEND, where processing_script is the directory
+sys.path.insert(0, os.path.join(BACKEND, "processing_script"))
+
+
+class _NoSpans:
+    # processing_script's StageSpans, without the bookkeeping
+    def span(self, name, **attributes):
+        return contextlib.nullcontext(attributes)
+
+
+def load_documents(path, repeat):
+    import pandas as pd
+    data = pd.read_csv(path, dtype=str, keep_default_na=False)
+    # Same normalisation as the Glue schema
+    data.columns = [column.lower().replace(" ", "_").replace(":", "_") for column in data.columns]
+    if repeat > 1:
+        comment_columns = [column for column in data.columns if column.startswith("comment_")]
+        copies = []
+        for copy in range(repeat):
+            frame = data.copy()
+            if copy:
+                frame[comment_columns] = frame[comment_columns].apply(lambda values: values + f" ({copy})")
+            copies.append(frame)
+        data = pd.concat(copies, ignore_index=True)
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", required=True, help="survey or filtered CSV")
+    parser.add_argument("--sample-sizes", default="1000,5000,20000", help="comma-separated sample sizes")
+    parser.add_argument("--repeat", type=int, default=1, help="use the rows this many times")
+    parser.add_argument("--fake-embeddings", action="store_true",
+                        help="hashing stand-in for the embedding model, as in local_pipeline")
+    args = parser.parse_args()
+
+    if args.fake_embeddings:
+        from local_pipeline.pipeline import fake_sentence_transformers
+        sys.modules["sentence_transformers"] = fake_sentence_transformers()
+    import numpy as np
+    from sklearn.metrics import adjusted_rand_score, normalized_mutual_info_score
+    import processing_script
+
+    spans = _NoSpans()
+    data = load_documents(args.data, args.repeat)
+    groups, documents = processing_script.deduplicate(data, processing_script.comment_documents(data), spans)
+    start = time.perf_counter()
+    embeddings = processing_script.embed(documents, spans)
+    print(f"{len(data)} rows, {len(documents)} documents after deduplication, "
+          f"embedded in {time.perf_counter() - start:.1f}s")
+
+    weights = np.bincount(groups, minlength=len(embeddings))
+    strata = processing_script.group_strata(data, groups)
+    start = time.perf_counter()
+    full, _ = processing_script.cluster_labels(embeddings, weights)
+    full_seconds = time.perf_counter() - start
+    full = full[groups]
+
+    print(f"{'sample':>8}{'clustered':>11}{'clusters':>10}{'noise %':>9}{'ARI':>8}{'NMI':>8}{'seconds':>9}")
+    print(f"{'full':>8}{len(embeddings):>11}{len(set(full) - {-1}):>10}{100 * (full == -1).mean():>9.1f}"
+          f"{1.0:>8.3f}{1.0:>8.3f}{full_seconds:>9.2f}")
+    for size in (int(value) for value in args.sample_sizes.split(",")):
+        start = time.perf_counter()
+        labels, sampled = processing_script.cluster_labels(embeddings, weights, strata, size)
+        seconds = time.perf_counter() - start
+        labels = labels[groups]
+        clustered = len(embeddings) if sampled is None else len(sampled)
+        print(f"{size:>8}{clustered:>11}{len(set(labels) - {-1}):>10}{100 * (labels == -1).mean():>9.1f}"
+              f"{adjusted_rand_score(full, labels):>8.3f}{normalized_mutual_info_score(full, labels):>8.3f}"
+              f"{seconds:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
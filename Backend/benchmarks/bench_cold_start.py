@@ -0,0 +1,109 @@
+"""Import time and cold-start time for every Lambda under lambda_functions/.
+
+Each function is imported in a fresh interpreter, laid out as Lambda sees it
+(the function directory plus the common layer on sys.path), with placeholder
+environment variables and credentials. Module-level clients are created as in
+a real cold start; no AWS call is made.
+
+    python benchmarks/bench_cold_start.py --runs 5
+    python benchmarks/bench_cold_start.py --only generate_insights --top 15
+
+"import" is the time spent importing the handler module; "process" adds
+interpreter start-up, i.e. what an init phase pays before the handler runs.
+--top lists the slowest modules from python -X importtime for each function.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+FUNCTIONS = os.path.join(BACKEND, "lambda_functions")
+LAYERS = [os.path.join(BACKEND, "lambda_layers", "common", "python")]
+
+PLACEHOLDER_ENV = {
+    "AWS_DEFAULT_REGION": "us-west-2",
+    "AWS_ACCESS_KEY_ID": "placeholder",
+    "AWS_SECRET_ACCESS_KEY": "placeholder",
+    "BUCKET_NAME": "placeholder-bucket",
+    "STEP_FUNCTION_ARN": "arn:aws:states:us-west-2:123456789012:stateMachine:placeholder",
+    "INFLIGHT_JOBS_TABLE": "placeholder",
+    "JOB_REGISTRY_TABLE": "placeholder",
+    "ATHENA_DATABASE": "placeholder",
+    "ATHENA_TABLE": "placeholder",
+    "COMMENT_COLUMNS": "[]",
+    "EXPECTED_HEADERS": "[]",
+    "PROFILE_FUNCTION_NAME": "placeholder",
+    "DOCKER_IMAGE_URI": "placeholder",
+    "SAGEMAKER_ROLE_ARN": "placeholder",
+}
+
+IMPORT_SNIPPET = (
+    "import time, importlib; start = time.perf_counter(); "
+    "importlib.import_module({module!r}); print(time.perf_counter() - start)"
+)
+
+
+def lambda_modules(only=None):
+    for name in sorted(os.listdir(FUNCTIONS)):
+        if only and name not in only:
+            continue
+        if os.path.isfile(os.path.join(FUNCTIONS, name, f"{name}.py")):
+            yield name
+
+
+def run_import(name, extra_args=()):
+    env = dict(os.environ, **PLACEHOLDER_ENV)
+    env["PYTHONPATH"] = os.pathsep.join([os.path.join(FUNCTIONS, name)] + LAYERS + [env.get("PYTHONPATH", "")])
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, *extra_args, "-c", IMPORT_SNIPPET.format(module=name)],
+        env=env, capture_output=True, text=True
+    )
+    return time.perf_counter() - start, result
+
+
+def slowest_imports(stderr, top):
+    # python -X importtime: "import time: self [us] | cumulative | package"
+    timings = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, package = line[len("import time:"):].split("|")
+        timings.append((int(cumulative), package.rstrip()))
+    return sorted(timings, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--only", nargs="*", help="function names to measure")
+    parser.add_argument("--top", type=int, default=0, help="also list the N slowest imports")
+    args = parser.parse_args()
+
+    print(f"{'function':<28}{'import p50':>12}{'process p50':>13}")
+    for name in lambda_modules(args.only):
+        imports, processes = [], []
+        error = None
+        for _ in range(args.runs):
+            elapsed, result = run_import(name)
+            if result.returncode != 0:
+                error = result.stderr.strip().splitlines()[-1]
+                break
+            imports.append(float(result.stdout.strip().splitlines()[-1]))
+            processes.append(elapsed)
+        if error:
+            print(f"{name:<28}  failed: {error}")
+            continue
+        print(f"{name:<28}{statistics.median(imports) * 1000:>10.1f}ms{statistics.median(processes) * 1000:>11.1f}ms")
+
+        if args.top:
+            _, result = run_import(name, ("-X", "importtime"))
+            for cumulative, package in slowest_imports(result.stderr, args.top):
+                print(f"{'':<4}{cumulative / 1000:>8.1f}ms  {package.strip()}")
+
+
+if __name__ == "__main__":
+    main()
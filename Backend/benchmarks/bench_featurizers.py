@@ -0,0 +1,140 @@
+"""Speed and cluster quality of the transformer and lexical featurizers.
+
+Builds --documents comments (default 1M) by recombining the comment answers
+of a survey CSV (raw headers or the Glue column names), then times the
+lexical featurizer (hashed TF-IDF + randomized SVD) over all of them and the
+sentence-transformer encode over --transformer-documents of them, which is
+extrapolated to the full count:
+
+    python benchmarks/bench_featurizers.py --data survey.csv
+    python benchmarks/bench_featurizers.py --data survey.csv --documents 200000 --fake-embeddings
+
+Quality is compared on the file's own comments, up to --quality-documents
+rows of them (recombined answers share too many words to cluster): each
+featurizer's clusters as the processing script makes them, their share of noise, the
+cosine silhouette of the clustered documents in the featurizer's own space
+and in the transformer's, and the adjusted Rand index and normalized mutual
+information of the lexical clusters against the transformer's.
+--fake-embeddings swaps the model for local_pipeline's hashing stand-in, so
+only the lexical timings mean anything. Needs the processing script's
+dependencies.
+"""
+import argparse
+import contextlib
+import os
+import sys
+import time
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BACKEND)
+# Ahead of BACKEND, where processing_script is the directory
+sys.path.insert(0, os.path.join(BACKEND, "processing_script"))
+
+SILHOUETTE_SAMPLE = 10000
+
+
+class _NoSpans:
+    # processing_script's StageSpans, without the bookkeeping
+    def span(self, name, **attributes):
+        return contextlib.nullcontext(attributes)
+
+
+def load_rows(path):
+    import pandas as pd
+    data = pd.read_csv(path, dtype=str, keep_default_na=False)
+    # Same normalisation as the Glue schema
+    data.columns = [column.lower().replace(" ", "_").replace(":", "_") for column in data.columns]
+    return data
+
+
+def synthesize_documents(data, count, seed=0):
+    """count comments, each one to three answers drawn from the rows'."""
+    import numpy as np
+    comment_columns = [column for column in data.columns if column.startswith("comment_")]
+    answers = np.array(sorted({answer for answer in data[comment_columns].to_numpy().ravel() if answer.strip()}),
+                       dtype=object)
+    rng = np.random.RandomState(seed)
+    lengths = rng.randint(1, 4, count)
+    picks = rng.randint(0, len(answers), (count, 3))
+    return [" ".join(answers[picks[i, :lengths[i]]]) for i in range(count)]
+
+
+def cluster_report(name, vectors, labels, transformer_vectors):
+    from sklearn.metrics import silhouette_score
+    clustered = labels >= 0
+    row = {"featurizer": name, "clusters": len(set(labels) - {-1}), "noise": 100 * (~clustered).mean()}
+    for space, points in (("own", vectors), ("transformer", transformer_vectors)):
+        if len(set(labels[clustered])) > 1:
+            row[space] = silhouette_score(points[clustered], labels[clustered], metric="cosine",
+                                          sample_size=min(SILHOUETTE_SAMPLE, int(clustered.sum())), random_state=0)
+        else:
+            row[space] = float("nan")
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", required=True, help="survey or filtered CSV")
+    parser.add_argument("--documents", type=int, default=1000000, help="comments to featurize")
+    parser.add_argument("--transformer-documents", type=int, default=20000,
+                        help="comments to encode with the transformer; its time is extrapolated from these")
+    parser.add_argument("--quality-documents", type=int, default=20000,
+                        help="rows of the file whose comments are clustered with each featurizer")
+    parser.add_argument("--fake-embeddings", action="store_true",
+                        help="hashing stand-in for the embedding model, as in local_pipeline")
+    args = parser.parse_args()
+
+    if args.fake_embeddings:
+        from local_pipeline.pipeline import fake_sentence_transformers
+        sys.modules["sentence_transformers"] = fake_sentence_transformers()
+    import numpy as np
+    from sklearn.metrics import adjusted_rand_score, normalized_mutual_info_score
+    import processing_script
+
+    spans = _NoSpans()
+    data = load_rows(args.data)
+    documents = synthesize_documents(data, args.documents)
+    print(f"{len(documents)} documents")
+
+    start = time.perf_counter()
+    counts = processing_script.hashed_counts(documents)
+    hash_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    processing_script.lexical_vectors(counts, spans)
+    reduce_seconds = time.perf_counter() - start
+    lexical_seconds = hash_seconds + reduce_seconds
+    del counts
+
+    # The model load is left out, as a warm worker has it loaded already
+    processing_script.load_model()
+    subset = documents[:args.transformer_documents]
+    start = time.perf_counter()
+    processing_script.load_model().encode(subset, show_progress_bar=False)
+    transformer_seconds = (time.perf_counter() - start) * len(documents) / len(subset)
+
+    print(f"{'featurizer':<13}{'seconds':>10}{'docs/s':>11}")
+    print(f"{'lexical':<13}{lexical_seconds:>10.1f}{len(documents) / lexical_seconds:>11.0f}"
+          f"   (hash {hash_seconds:.1f}s, TF-IDF + SVD {reduce_seconds:.1f}s)")
+    print(f"{'transformer':<13}{transformer_seconds:>10.1f}{len(documents) / transformer_seconds:>11.0f}"
+          f"   (extrapolated from {len(subset)} documents)")
+    print(f"lexical is {transformer_seconds / lexical_seconds:.1f}x faster")
+
+    quality = processing_script.comment_documents(data.iloc[:args.quality_documents].copy())
+    weights = np.ones(len(quality), dtype=np.int64)
+    transformer_vectors = processing_script.load_model().encode(quality, show_progress_bar=False)
+    lexical_vectors = processing_script.lexical_vectors(processing_script.hashed_counts(quality), spans)
+    transformer_labels, _ = processing_script.cluster_labels(transformer_vectors, weights)
+    lexical_labels, _ = processing_script.cluster_labels(lexical_vectors, weights, standardize=False)
+
+    print(f"\n{len(quality)} documents clustered; silhouette is cosine, over the clustered documents")
+    print(f"{'featurizer':<13}{'clusters':>9}{'noise %':>9}{'sil own':>9}{'sil trf':>9}{'ARI':>8}{'NMI':>8}")
+    for name, vectors, labels in (("transformer", transformer_vectors, transformer_labels),
+                                  ("lexical", lexical_vectors, lexical_labels)):
+        row = cluster_report(name, vectors, labels, transformer_vectors)
+        print(f"{name:<13}{row['clusters']:>9}{row['noise']:>9.1f}{row['own']:>9.3f}{row['transformer']:>9.3f}"
+              f"{adjusted_rand_score(transformer_labels, labels):>8.3f}"
+              f"{normalized_mutual_info_score(transformer_labels, labels):>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""p50/p95 latency per pipeline stage from the jobs' trace spans.
+
+Reads spans as the Lambdas export them: JSON lines from TRACE_EXPORTER=file,
+or CloudWatch Logs output containing the {"trace_span": ...} lines of the
+stdout exporter:
+
+    python benchmarks/trace_report.py spans.jsonl
+    aws logs filter-log-events --log-group-name /aws/lambda/<function> \\
+        --filter-pattern trace_span --output text | python benchmarks/trace_report.py -
+
+It can also be the local collector itself: with --listen it accepts OTLP/HTTP
+JSON (TRACE_EXPORTER=otlp, OTEL_EXPORTER_OTLP_ENDPOINT=http://localhost:4318),
+appends what it receives to --out and reports when stopped with Ctrl-C:
+
+    python benchmarks/trace_report.py --listen 4318 --out spans.jsonl
+
+"end_to_end" is the first span start to the last span end of each trace.
+"""
+import argparse
+import json
+import math
+import sys
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+SPAN_MARKER = '{"trace_span":'
+
+
+def parse_spans(lines):
+    for line in lines:
+        start = line.find(SPAN_MARKER)
+        if start >= 0:
+            try:
+                yield json.loads(line[start:])['trace_span']
+            except ValueError:
+                continue
+        elif line.lstrip().startswith('{'):
+            try:
+                span = json.loads(line)
+            except ValueError:
+                continue
+            if 'span_id' in span:
+                yield span
+
+
+def from_otlp(request):
+    """Span dicts, in the exporters' format, from an OTLP/HTTP JSON request."""
+    for resource_spans in request.get('resourceSpans', []):
+        service = next(
+            (a['value'].get('stringValue') for a in resource_spans.get('resource', {}).get('attributes', [])
+             if a['key'] == 'service.name'),
+            'unknown'
+        )
+        for scope_spans in resource_spans.get('scopeSpans', []):
+            for span in scope_spans.get('spans', []):
+                start, end = int(span['startTimeUnixNano']), int(span['endTimeUnixNano'])
+                yield {
+                    'trace_id': span['traceId'],
+                    'span_id': span['spanId'],
+                    'parent_span_id': span.get('parentSpanId') or None,
+                    'name': span['name'],
+                    'service': service,
+                    'start_time_unix_nano': start,
+                    'end_time_unix_nano': end,
+                    'duration_ms': (end - start) / 1e6,
+                    'status': 'ERROR' if span.get('status', {}).get('code') == 2 else 'OK',
+                    'attributes': {a['key']: next(iter(a['value'].values())) for a in span.get('attributes', [])}
+                }
+
+
+def percentile(values, fraction):
+    # Nearest rank
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def stage_name(span):
+    # A handler's own span is named after its service
+    if span['name'] == span['service']:
+        return span['name']
+    return f"{span['service']}/{span['name']}"
+
+
+def report(spans):
+    """Rows of stage, count, p50, p95, max (ms) and errors, in pipeline order."""
+    stages = {}
+    traces = {}
+    for span in spans:
+        stage = stage_name(span)
+        entry = stages.setdefault(stage, {'durations': [], 'offsets': [], 'errors': 0})
+        entry['durations'].append(span['duration_ms'])
+        entry['errors'] += span['status'] == 'ERROR'
+        traces.setdefault(span['trace_id'], []).append(span)
+
+    for trace_spans in traces.values():
+        trace_start = min(s['start_time_unix_nano'] for s in trace_spans)
+        trace_end = max(s['end_time_unix_nano'] for s in trace_spans)
+        for span in trace_spans:
+            stage = stage_name(span)
+            stages[stage]['offsets'].append(span['start_time_unix_nano'] - trace_start)
+        stages.setdefault('end_to_end', {'durations': [], 'offsets': [], 'errors': 0})['durations'].append(
+            (trace_end - trace_start) / 1e6
+        )
+
+    rows = []
+    for stage, entry in stages.items():
+        durations = entry['durations']
+        rows.append({
+            'stage': stage,
+            'count': len(durations),
+            'p50_ms': percentile(durations, 0.5),
+            'p95_ms': percentile(durations, 0.95),
+            'max_ms': max(durations),
+            'errors': entry['errors'],
+            'offset': percentile(entry['offsets'], 0.5) if entry['offsets'] else float('inf')
+        })
+    return sorted(rows, key=lambda row: (row['offset'], row['stage']))
+
+
+def print_report(spans):
+    rows = report(spans)
+    print(f"{'stage':<44}{'count':>7}{'p50 ms':>11}{'p95 ms':>11}{'max ms':>11}{'errors':>8}")
+    for row in rows:
+        print(f"{row['stage']:<44}{row['count']:>7}{row['p50_ms']:>11.1f}{row['p95_ms']:>11.1f}"
+              f"{row['max_ms']:>11.1f}{row['errors']:>8}")
+
+
+def listen(port, out):
+    received = []
+
+    class Collector(BaseHTTPRequestHandler):
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            try:
+                spans = list(from_otlp(json.loads(body)))
+            except (ValueError, KeyError):
+                self.send_response(400)
+                self.end_headers()
+                return
+            received.extend(spans)
+            if out:
+                with open(out, 'a') as f:
+                    for span in spans:
+                        f.write(json.dumps(span) + '\n')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'{}')
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', port), Collector)
+    print(f"Collecting OTLP/HTTP JSON spans on http://127.0.0.1:{port}/v1/traces; Ctrl-C to report")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return received
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('files', nargs='*', help="span files, or - for stdin")
+    parser.add_argument('--listen', type=int, help="collect OTLP/HTTP JSON spans on this port")
+    parser.add_argument('--out', help="with --listen, append the received spans to this file")
+    args = parser.parse_args()
+
+    if args.listen:
+        spans = listen(args.listen, args.out)
+    else:
+        spans = []
+        for name in args.files or ['-']:
+            if name == '-':
+                spans.extend(parse_spans(sys.stdin))
+            else:
+                with open(name) as f:
+                    spans.extend(parse_spans(f))
+
+    if not spans:
+        print("No spans found")
+        return
+    print_report(spans)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,17 +5,29 @@ from aws_cdk import (
     aws_lambda as _lambda,
     aws_iam as iam,
     aws_apigateway as apigateway,
+    aws_dynamodb as dynamodb,
     CfnOutput,
-    Duration
+    Duration,
+    RemovalPolicy
 )
 from constructs import Construct
 
 
 class FeedbackSurveyApiStack(Stack):
 
-    def __init__(self, scope: Construct, construct_id: str, *, project_name: str, state_machine_arn: str, bucket_name: str, **kwargs):
+    def __init__(self, scope: Construct, construct_id: str, *, project_name: str, state_machine_arn: str, bucket_name: str, job_registry_table_name: str, common_layer: _lambda.ILayerVersion, **kwargs):
         super().__init__(scope, construct_id, **kwargs)
 
+        # Request key -> job id of the execution currently serving that request,
+        # so identical queries submitted close together share one execution
+        inflight_jobs_table = dynamodb.Table(
+            self, "InflightJobsTable",
+            partition_key=dynamodb.Attribute(name="request_key", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+            removal_policy=RemovalPolicy.DESTROY
+        )
+
         # IAM Roles and Policies
         lambda_role = iam.Role(
             self, "LambdaExecutionRoleApi",
@@ -31,12 +43,21 @@ class FeedbackSurveyApiStack(Stack):
                 "logs:*",
                 "states:StartExecution",
                 "states:DescribeExecution",
+                "states:StopExecution",
+                "athena:GetQueryExecution",
+                "athena:StopQueryExecution",
+                "sagemaker:ListProcessingJobs",
+                "sagemaker:StopProcessingJob",
                 "s3:GetObject",
                 "s3:PutObject",
                 "s3:ListBucket",
                 "s3:*",
                 "bedrock:*",
-                "StepFunctions:*"
+                "StepFunctions:*",
+                "dynamodb:GetItem",
+                "dynamodb:PutItem",
+                "dynamodb:UpdateItem",
+                "dynamodb:DeleteItem"
 
             ],
             resources=["*"]
@@ -54,10 +75,14 @@ class FeedbackSurveyApiStack(Stack):
             environment={
                 'STEP_FUNCTION_ARN': state_machine_arn,
                 'BEDROCK_MODEL_ID': 'your-bedrock-model-id',
+                'INFLIGHT_JOBS_TABLE': inflight_jobs_table.table_name,
+                'JOB_REGISTRY_TABLE': job_registry_table_name,
+                'BUCKET_NAME': bucket_name,
                 'REGION': self.region
             },
             function_name=f"{project_name}-StartQueryFunction",
-            timeout = lambda_timeout
+            timeout = lambda_timeout,
+            layers=[common_layer]
         )
 
         check_status_lambda = _lambda.Function(
@@ -68,17 +93,57 @@ class FeedbackSurveyApiStack(Stack):
             role=lambda_role,
             environment={
                 'STEP_FUNCTION_ARN': state_machine_arn,
+                'JOB_REGISTRY_TABLE': job_registry_table_name,
+                'BUCKET_NAME': bucket_name,
                 'REGION': self.region
             },
             function_name=f"{project_name}-CheckStatusFunction",
-            timeout = lambda_timeout
+            timeout = lambda_timeout,
+            layers=[common_layer]
+        )
+
+        # Stops a job's execution, Athena query, SageMaker jobs and pool worker
+        cancel_query_lambda = _lambda.Function(
+            self, "CancelQueryFunction",
+            runtime=_lambda.Runtime.PYTHON_3_9,
+            handler="cancel_query.lambda_handler",
+            code=_lambda.Code.from_asset("lambda_functions/cancel_query"),
+            role=lambda_role,
+            environment={
+                'STEP_FUNCTION_ARN': state_machine_arn,
+                'BUCKET_NAME': bucket_name,
+                'INFLIGHT_JOBS_TABLE': inflight_jobs_table.table_name,
+                'JOB_REGISTRY_TABLE': job_registry_table_name,
+                'REGION': self.region
+            },
+            function_name=f"{project_name}-CancelQueryFunction",
+            timeout=Duration.seconds(30),
+            layers=[common_layer]
+        )
+
+        # Serves the per-version filter value index written by the profile stage
+        filter_values_lambda = _lambda.Function(
+            self, "FilterValuesFunction",
+            runtime=_lambda.Runtime.PYTHON_3_9,
+            handler="filter_values.lambda_handler",
+            code=_lambda.Code.from_asset("lambda_functions/filter_values"),
+            role=lambda_role,
+            environment={
+                'BUCKET_NAME': bucket_name,
+                'REGION': self.region
+            },
+            function_name=f"{project_name}-FilterValuesFunction",
+            timeout=Duration.seconds(30),
+            layers=[common_layer]
         )
 
         # Define API Gateway
         api = apigateway.RestApi(
             self, "FeedbackSurveyProcessingApi",
             rest_api_name=f"{project_name} Processing API",
-            description="API for processing feedback survey queries."
+            description="API for processing feedback survey queries.",
+            # check-status can return gzip-compressed results
+            binary_media_types=["application/gzip"]
         )
 
         # /process-query Endpoint
@@ -91,5 +156,15 @@ class FeedbackSurveyApiStack(Stack):
         check_status_integration = apigateway.LambdaIntegration(check_status_lambda, proxy=True)
         check_status_resource.add_method("GET", check_status_integration)
 
+        # /cancel-query Endpoint
+        cancel_query_resource = api.root.add_resource("cancel-query")
+        cancel_query_integration = apigateway.LambdaIntegration(cancel_query_lambda, proxy=True)
+        cancel_query_resource.add_method("POST", cancel_query_integration)
+
+        # /filter-values Endpoint
+        filter_values_resource = api.root.add_resource("filter-values")
+        filter_values_integration = apigateway.LambdaIntegration(filter_values_lambda, proxy=True)
+        filter_values_resource.add_method("GET", filter_values_integration)
+
         # Outputs
         CfnOutput(self, "APIEndpoint", value=api.url)
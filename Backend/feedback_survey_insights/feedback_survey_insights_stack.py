@@ -6,9 +6,13 @@ from aws_cdk import (
     aws_lambda as _lambda,
     aws_iam as iam,
     aws_apigateway as apigateway,
+    custom_resources as cr,
     CfnOutput,
+    Duration,
+    BundlingOptions,
 )
 from constructs import Construct
+import json
 import os
 
 class FeedbackSurveyInsightsStack(Stack):
@@ -22,6 +26,7 @@ class FeedbackSurveyInsightsStack(Stack):
         athena_table_name = self.node.try_get_context("athena_table_name")
         file_name = self.node.try_get_context("file_name")
         file_type = self.node.try_get_context("file_type")
+        headers = self.node.try_get_context("headers") or []
 
         # Create S3 bucket
         data_bucket = s3.Bucket(
@@ -68,7 +73,7 @@ class FeedbackSurveyInsightsStack(Stack):
             self, "CreateScriptsFolder",
             destination_bucket=data_bucket,
             destination_key_prefix="scripts/",
-            sources=[s3_deployment.Source.asset(script_directory, exclude=["**", "!processing_script.py"])],
+            sources=[s3_deployment.Source.asset(script_directory, exclude=["**", "!processing_script.py", "!dedup.py", "!processing_worker.py", "!job_queue.py"])],
             retain_on_delete=False
         )
         
@@ -94,7 +99,9 @@ class FeedbackSurveyInsightsStack(Stack):
                 "s3:ListMultipartUploads",
                 "s3:ListParts",
                 "s3:GetObject",
-                "s3:PutObject"
+                "s3:PutObject",
+                # Missing keys read as NoSuchKey rather than AccessDenied
+                "s3:ListBucket"
             ],
             resources=[
                 data_bucket.bucket_arn,
@@ -109,6 +116,17 @@ class FeedbackSurveyInsightsStack(Stack):
             "FILE_TYPE": file_type
         }
 
+        # Modules shared by the Lambdas of every stack (AWS clients, job
+        # registry, multipart upload planning, dataset versions). Published
+        # once, here, and passed to the state machine and API stacks
+        common_layer = _lambda.LayerVersion(
+            self, "CommonLayer",
+            code=_lambda.Code.from_asset("lambda_layers/common"),
+            compatible_runtimes=[_lambda.Runtime.PYTHON_3_9, _lambda.Runtime.PYTHON_3_12],
+            description="Shared modules for the feedback survey Lambdas"
+        )
+        self.common_layer = common_layer
+
         # Define Lambda functions
         initiate_upload_lambda = _lambda.Function(
             self, "InitiateUploadFunction",
@@ -117,7 +135,8 @@ class FeedbackSurveyInsightsStack(Stack):
             code=_lambda.Code.from_asset("lambda_functions/initiate_upload"),
             role=lambda_role,
             environment=lambda_env,
-            function_name=f"{project_name}-InitiateUploadFunction"
+            function_name=f"{project_name}-InitiateUploadFunction",
+            layers=[common_layer]
         )
 
         generate_presigned_urls_lambda = _lambda.Function(
@@ -127,7 +146,61 @@ class FeedbackSurveyInsightsStack(Stack):
             code=_lambda.Code.from_asset("lambda_functions/process_upload"),
             role=lambda_role,
             environment=lambda_env,
-            function_name=f"{project_name}-ProcessUploadFunction"
+            function_name=f"{project_name}-ProcessUploadFunction",
+            layers=[common_layer]
+        )
+
+        # zstandard is not in the Lambda runtime; pip-installed at synth time
+        # so the profile stage can read zstd-compressed uploads
+        zstd_layer = _lambda.LayerVersion(
+            self, "ZstdLayer",
+            code=_lambda.Code.from_asset(
+                "lambda_layers/zstd",
+                bundling=BundlingOptions(
+                    image=_lambda.Runtime.PYTHON_3_9.bundling_image,
+                    command=["bash", "-c", "pip install -r requirements.txt -t /asset-output/python"]
+                )
+            ),
+            compatible_runtimes=[_lambda.Runtime.PYTHON_3_9],
+            description="zstandard for reading zstd-compressed uploads"
+        )
+
+        # Streams each completed upload once to check it against the Glue
+        # schema, write its dataset manifest and, if valid, activate it
+        profile_dataset_lambda = _lambda.Function(
+            self, "ProfileDatasetFunction",
+            runtime=_lambda.Runtime.PYTHON_3_9,
+            handler="profile_dataset.lambda_handler",
+            code=_lambda.Code.from_asset("lambda_functions/profile_dataset"),
+            role=lambda_role,
+            environment={
+                "BUCKET_NAME": data_bucket.bucket_name,
+                "FILE_NAME": file_name,
+                "EXPECTED_HEADERS": json.dumps(headers)
+            },
+            function_name=f"{project_name}-ProfileDatasetFunction",
+            timeout=Duration.seconds(900),
+            memory_size=512,
+            layers=[common_layer, zstd_layer]
+        )
+
+        # Deployments from before dataset versions have their data at
+        # raw/{file_name} and no active version; registered once on deploy
+        cr.AwsCustomResource(
+            self, "BootstrapLegacyDataset",
+            on_create=cr.AwsSdkCall(
+                service="Lambda",
+                action="invoke",
+                parameters={
+                    "FunctionName": profile_dataset_lambda.function_name,
+                    "InvocationType": "Event",
+                    "Payload": json.dumps({"bootstrap": True})
+                },
+                physical_resource_id=cr.PhysicalResourceId.of("BootstrapLegacyDataset")
+            ),
+            policy=cr.AwsCustomResourcePolicy.from_statements([
+                iam.PolicyStatement(actions=["lambda:InvokeFunction"], resources=[profile_dataset_lambda.function_arn])
+            ])
         )
 
         complete_upload_lambda = _lambda.Function(
@@ -136,10 +209,18 @@ class FeedbackSurveyInsightsStack(Stack):
             handler="complete_upload.lambda_handler",
             code=_lambda.Code.from_asset("lambda_functions/complete_upload"),
             role=lambda_role,
-            environment=lambda_env,
-            function_name=f"{project_name}-CompleteUploadFunction"
+            environment=dict(lambda_env, PROFILE_FUNCTION_NAME=profile_dataset_lambda.function_name),
+            function_name=f"{project_name}-CompleteUploadFunction",
+            layers=[common_layer]
         )
 
+        # Built from the fixed function name: the profile function runs as
+        # lambda_role too, so referencing its ARN would make a dependency cycle
+        lambda_role.add_to_policy(iam.PolicyStatement(
+            actions=["lambda:InvokeFunction"],
+            resources=[f"arn:aws:lambda:{self.region}:{self.account}:function:{project_name}-ProfileDatasetFunction"]
+        ))
+
         # Create API Gateway and define endpoints
         api = apigateway.RestApi(
             self, "FeedbackSurveyApi",
@@ -6,22 +6,109 @@ from aws_cdk import (
     aws_stepfunctions as sfn,
     aws_stepfunctions_tasks as tasks,
     aws_glue as glue,
+    aws_dynamodb as dynamodb,
+    aws_sqs as sqs,
+    aws_ecs as ecs,
+    aws_ec2 as ec2,
     Duration,
     CfnOutput,
+    RemovalPolicy,
 )
 from constructs import Construct
 import json
 from aws_cdk.aws_stepfunctions import DefinitionBody
 
+# Each SageMaker processing step runs for at most MaxRuntimeInSeconds and is
+# retried PROCESSING_MAX_ATTEMPTS times, resuming from its checkpoints
+PROCESSING_MAX_RUNTIME_SECONDS = 3600
+PROCESSING_RETRY_INTERVAL_SECONDS = 60
+PROCESSING_MAX_ATTEMPTS = 2
+PROCESSING_BACKOFF_RATE = 2
+
+
+def processing_step_seconds():
+    # Every attempt running to its limit, plus the waits between them
+    waits = sum(PROCESSING_RETRY_INTERVAL_SECONDS * PROCESSING_BACKOFF_RATE ** attempt
+                for attempt in range(PROCESSING_MAX_ATTEMPTS))
+    return (PROCESSING_MAX_ATTEMPTS + 1) * PROCESSING_MAX_RUNTIME_SECONDS + waits
+
+
+# Added to ChooseProcessing and the states when processing_backend is "worker"
+WORKER_CHOICE = """,
+                {
+                  "Variable": "$.processing_job.plan.backend",
+                  "StringEquals": "worker",
+                  "Next": "SubmitToWorkerPool"
+                }"""
+
+# A worker heartbeats the task token as soon as it takes the job; if none
+# does within HeartbeatSeconds the job falls back to SageMaker
+WORKER_STATE = """
+            "SubmitToWorkerPool": {
+              "Type": "Task",
+              "Resource": "arn:aws:states:::sqs:sendMessage.waitForTaskToken",
+              "Parameters": {
+                "QueueUrl": "QUEUE_URL",
+                "MessageBody": {
+                  "task_token.$": "$$.Task.Token",
+                  "job_id.$": "$.processing_job.job_id",
+                  "bucket": "BUCKET_NAME",
+                  "input_prefix.$": "States.Format('shards/{}/', $.processing_job.job_id)",
+                  "output_prefix.$": "States.Format('processed/{}/', $.processing_job.job_id)",
+                  "submitted_at.$": "$$.State.EnteredTime",
+                  "cluster_sample_size.$": "$.processing_job.plan.cluster_sample_size",
+                  "featurizer.$": "$.processing_job.plan.featurizer",
+                  "cluster_by.$": "$.processing_job.plan.cluster_by",
+                  "traceparent.$": "$.traceparent"
+                }
+              },
+              "HeartbeatSeconds": 60,
+              "TimeoutSeconds": 3600,
+              "ResultPath": "$.worker_job",
+              "Next": "InvokeLambda2",
+              "Catch": [
+                {
+                  "ErrorEquals": [
+                    "States.Timeout"
+                  ],
+                  "ResultPath": "$.worker_error",
+                  "Next": "SageMakerCreateProcessingJob"
+                },
+                {
+                  "ErrorEquals": [
+                    "States.ALL"
+                  ],
+                  "ResultPath": "$.error_info",
+                  "Next": "HandleGeneralError"
+                }
+              ]
+            },"""
+
+# Fetches the worker and the processing script from the scripts/ prefix and
+# runs the worker, in the processing image
+WORKER_BOOTSTRAP = (
+    "import boto3, os, runpy, sys; "
+    "os.makedirs('/opt/worker', exist_ok=True); "
+    "[boto3.client('s3').download_file(os.environ['BUCKET_NAME'], 'scripts/' + name, '/opt/worker/' + name) "
+    "for name in ('processing_script.py', 'dedup.py', 'processing_worker.py', 'job_queue.py')]; "
+    "sys.path.insert(0, '/opt/worker'); "
+    "runpy.run_path('/opt/worker/processing_worker.py', run_name='__main__')"
+)
+
+
 class FeedbackSurveyStateMachineStack(Stack):
 
-    def __init__(self, scope: Construct, construct_id: str, *, project_name: str, bucket_name: str, **kwargs):
+    def __init__(self, scope: Construct, construct_id: str, *, project_name: str, bucket_name: str, common_layer: _lambda.ILayerVersion, **kwargs):
         super().__init__(scope, construct_id, **kwargs)
 
         # Context variables
         athena_database_name = self.node.try_get_context("athena_database_name") or "employee_surveydata"
         athena_table_name = self.node.try_get_context("athena_table_name") or "survey_data"
         docker_image_uri = self.node.try_get_context("docker_image_uri")
+        # "worker" sends unsharded jobs to a warm worker pool instead of a
+        # SageMaker processing job per query
+        processing_backend = self.node.try_get_context("processing_backend") or "sagemaker"
+        processing_worker_count = int(self.node.try_get_context("processing_worker_count") or 1)
         headers = self.node.try_get_context("headers") or []
 
         # Process headers: lowercase and replace spaces with underscores
@@ -51,11 +138,18 @@ class FeedbackSurveyStateMachineStack(Stack):
                 description="Table for survey data",
                 table_type="EXTERNAL_TABLE",
                 parameters={
+                    # No compressionType: Athena picks the codec per object from
+                    # its extension, so plain, .gz and .zst uploads all scan
                     "classification": "csv",
                     "skip.header.line.count": "1",
-                    "compressionType": "none",
-                    "typeOfData": "file"
+                    "typeOfData": "file",
+                    # Every upload is its own dataset_version prefix; queries
+                    # must name the version, so Athena only lists that prefix
+                    "projection.enabled": "true",
+                    "projection.dataset_version.type": "injected",
+                    "storage.location.template": f"s3://{bucket_name}/raw/dataset_version=${{dataset_version}}/"
                 },
+                partition_keys=[glue.CfnTable.ColumnProperty(name="dataset_version", type="string")],
                 storage_descriptor=glue.CfnTable.StorageDescriptorProperty(
                     columns=[glue.CfnTable.ColumnProperty(name=col_name, type="string") for col_name in processed_headers],
                     location=f"s3://{bucket_name}/raw/",
@@ -74,6 +168,16 @@ class FeedbackSurveyStateMachineStack(Stack):
 
         glue_table.add_dependency(glue_database)
 
+        # Job registry: pipeline stages record state transitions and results
+        # here, and check_status serves status polls from it
+        job_registry_table = dynamodb.Table(
+            self, "JobRegistryTable",
+            partition_key=dynamodb.Attribute(name="job_id", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+            removal_policy=RemovalPolicy.DESTROY
+        )
+
         # IAM Roles and Policies
         lambda_role = iam.Role(
             self, "LambdaExecutionRoleStateMachine",
@@ -94,7 +198,10 @@ class FeedbackSurveyStateMachineStack(Stack):
                 "sagemaker:CreateProcessingJob",
                 "sagemaker:DescribeProcessingJob",
                 "sagemaker:*",
-                "ecs:*"
+                "ecs:*",
+                "states:DescribeExecution",
+                "dynamodb:GetItem",
+                "dynamodb:UpdateItem"
             ],
             resources=["*"]
         ))
@@ -121,12 +228,6 @@ class FeedbackSurveyStateMachineStack(Stack):
 
         # Define Lambda Functions used in the state machine
 
-        # Define the AWS Built-in Pandas Layer
-        pandas_layer = _lambda.LayerVersion.from_layer_version_arn(
-            self, "AWSSDKPandasLayer",
-            layer_version_arn="arn:aws:lambda:us-west-2:336392948345:layer:AWSSDKPandas-Python312:13"
-        )
-
         # Common timeout configuration
         lambda_timeout = Duration.seconds(600)  # Adjust the timeout as needed
 
@@ -141,10 +242,27 @@ class FeedbackSurveyStateMachineStack(Stack):
                 'ATHENA_DATABASE': athena_database_name,
                 'ATHENA_TABLE': athena_table_name,
                 'COMMENT_COLUMNS': json.dumps(comment_columns),
+                'JOB_REGISTRY_TABLE': job_registry_table.table_name,
+                'PROCESSING_BACKEND': processing_backend,
                 'REGION': self.region
             },
             function_name=f"{project_name}-ProcessQueryFunction",
-            timeout=lambda_timeout  # Increased timeout
+            timeout=lambda_timeout,  # Increased timeout
+            layers=[common_layer]
+        )
+
+        validate_query_lambda = _lambda.Function(
+            self, "ValidateQueryFunction",
+            runtime=_lambda.Runtime.PYTHON_3_12,
+            handler="validate_query.lambda_handler",
+            code=_lambda.Code.from_asset("lambda_functions/validate_query"),
+            role=lambda_role,
+            environment={
+                'REGION': self.region
+            },
+            function_name=f"{project_name}-ValidateQueryFunction",
+            timeout=lambda_timeout,
+            layers=[common_layer]
         )
 
         generate_insights_lambda = _lambda.Function(
@@ -155,11 +273,12 @@ class FeedbackSurveyStateMachineStack(Stack):
             role=lambda_role,
             environment={
                 'BUCKET_NAME': data_bucket.bucket_name,
+                'JOB_REGISTRY_TABLE': job_registry_table.table_name,
                 'REGION': self.region
             },
             function_name=f"{project_name}-GenerateInsightsFunction",
             timeout=lambda_timeout,  # Increased timeout
-            layers=[pandas_layer]  # Attach the Pandas layer
+            layers=[common_layer]
         )
 
         # -------------------------------------------------------------------------
@@ -177,6 +296,13 @@ class FeedbackSurveyStateMachineStack(Stack):
             iam.ManagedPolicy.from_aws_managed_policy_name("AmazonSageMakerFullAccess")
         )
 
+        state_machine_role.add_to_policy(
+            iam.PolicyStatement(
+                actions=["dynamodb:UpdateItem"],
+                resources=[job_registry_table.table_arn]
+            )
+        )
+
         state_machine_role.add_to_policy(
             iam.PolicyStatement(
                 actions=[
@@ -190,36 +316,111 @@ class FeedbackSurveyStateMachineStack(Stack):
             )
         )
 
+        worker_choice = ""
+        worker_state = ""
+        if processing_backend == "worker":
+            processing_queue = self.create_processing_worker_pool(
+                bucket_name, docker_image_uri, processing_worker_count
+            )
+            processing_queue.grant_send_messages(state_machine_role)
+            worker_choice = WORKER_CHOICE
+            worker_state = WORKER_STATE.replace("QUEUE_URL", processing_queue.queue_url).replace("BUCKET_NAME", bucket_name)
+
         # Define the state machine definition with dynamic Lambda ARNs and SageMaker
         state_machine_definition = f"""
         {{
           "Comment": "State Machine for Employee Survey Processing",
-          "StartAt": "StartProcessingJob",
+          "StartAt": "ValidateAndFilter",
           "States": {{
-            "StartProcessingJob": {{
-              "Type": "Task",
-              "Resource": "{process_query_lambda.function_arn}",
-              "Parameters": {{
-                "query.$": "$.query",
-                "filters.$": "$.filters"
+            "ValidateAndFilter": {{
+              "Type": "Parallel",
+              "Comment": "Query validation does not gate the Athena scan; a rejected query fails the branch and stops the other one",
+              "Branches": [
+                {{
+                  "StartAt": "ValidateQuery",
+                  "States": {{
+                    "ValidateQuery": {{
+                      "Type": "Task",
+                      "Resource": "{validate_query_lambda.function_arn}",
+                      "Parameters": {{
+                        "job_id.$": "$.job_id",
+                        "query.$": "$.query",
+                        "traceparent.$": "$.traceparent"
+                      }},
+                      "End": true
+                    }}
+                  }}
+                }},
+                {{
+                  "StartAt": "StartProcessingJob",
+                  "States": {{
+                    "StartProcessingJob": {{
+                      "Type": "Task",
+                      "Resource": "{process_query_lambda.function_arn}",
+                      "Parameters": {{
+                        "job_id.$": "$.job_id",
+                        "query.$": "$.query",
+                        "filters.$": "$.filters",
+                        "dataset_version.$": "$.dataset_version",
+                        "featurizer.$": "$.featurizer",
+                        "cluster_by.$": "$.cluster_by",
+                        "traceparent.$": "$.traceparent",
+                        "execution_arn.$": "$$.Execution.Id"
+                      }},
+                      "ResultSelector": {{
+                        "job_id.$": "$.job_id",
+                        "query.$": "$.query",
+                        "filters.$": "$.filters",
+                        "dataset_version.$": "$.dataset_version",
+                        "object_name.$": "$.object_name",
+                        "row_count.$": "$.row_count",
+                        "plan.$": "$.plan"
+                      }},
+                      "End": true
+                    }}
+                  }}
+                }}
+              ],
+              "ResultSelector": {{
+                "job_id.$": "$[1].job_id",
+                "query.$": "$[1].query",
+                "filters.$": "$[1].filters",
+                "dataset_version.$": "$[1].dataset_version",
+                "object_name.$": "$[1].object_name",
+                "row_count.$": "$[1].row_count",
+                "plan.$": "$[1].plan"
               }},
+              "ResultPath": "$.processing_job",
               "Catch": [
+                {{
+                  "ErrorEquals": [
+                    "InvalidQueryError"
+                  ],
+                  "ResultPath": "$.error_info",
+                  "Next": "RecordInvalidQuery"
+                }},
                 {{
                   "ErrorEquals": [
                     "States.ALL"
                   ],
+                  "ResultPath": "$.error_info",
                   "Next": "HandleGeneralError"
                 }}
               ],
-              "ResultSelector": {{
-                "job_id.$": "$.job_id",
-                "query.$": "$.query",
-                "filters.$": "$.filters",
-                "object_name.$": "$.object_name"
-              }},
-              "ResultPath": "$.processing_job",
-              "Next": "SageMakerCreateProcessingJob"
+              "Next": "ChooseProcessing"
             }},
+            "ChooseProcessing": {{
+              "Type": "Choice",
+              "Comment": "process_query sized the job from its row count; large jobs embed shards on several instances, then merge and cluster",
+              "Choices": [
+                {{
+                  "Variable": "$.processing_job.plan.sharded",
+                  "BooleanEquals": true,
+                  "Next": "SageMakerEmbedShards"
+                }}{worker_choice}
+              ],
+              "Default": "SageMakerCreateProcessingJob"
+            }},{worker_state}
             "SageMakerCreateProcessingJob": {{
               "Type": "Task",
               "Resource": "arn:aws:states:::sagemaker:createProcessingJob.sync",
@@ -230,13 +431,224 @@ class FeedbackSurveyStateMachineStack(Stack):
                     "python3",
                     "/opt/ml/processing/input/code/processing_script.py"
                   ],
-                  "ContainerArguments.$": "States.Array('--input-data', '/opt/ml/processing/input/data', '--output-data', '/opt/ml/processing/output', '--object-name', $.processing_job.object_name)"
+                  "ContainerArguments.$": "States.Array('--input-data', '/opt/ml/processing/input/data', '--output-data', '/opt/ml/processing/output', '--job-id', $.processing_job.job_id, '--mode', 'all', '--sample-size', States.Format('{{}}', $.processing_job.plan.cluster_sample_size), '--featurizer', $.processing_job.plan.featurizer, '--cluster-by', $.processing_job.plan.cluster_by, '--checkpoint-output', '/opt/ml/processing/checkpoints', '--checkpoint-input', '/opt/ml/processing/input/checkpoints', '--progress-output', '/opt/ml/processing/progress')"
+                }},
+                "ProcessingInputs": [
+                  {{
+                    "InputName": "input-data",
+                    "S3Input": {{
+                      "S3Uri.$": "States.Format('s3://{bucket_name}/shards/{{}}/', $.processing_job.job_id)",
+                      "LocalPath": "/opt/ml/processing/input/data",
+                      "S3DataType": "S3Prefix",
+                      "S3InputMode.$": "$.processing_job.plan.input_mode"
+                    }}
+                  }},
+                  {{
+                    "InputName": "code",
+                    "S3Input": {{
+                      "S3Uri": "https://{bucket_name}.s3.us-west-2.amazonaws.com/scripts/",
+                      "LocalPath": "/opt/ml/processing/input/code",
+                      "S3DataType": "S3Prefix",
+                      "S3InputMode": "File"
+                    }}
+                  }},
+                  {{
+                    "InputName": "checkpoints",
+                    "S3Input": {{
+                      "S3Uri.$": "States.Format('s3://{bucket_name}/processed/{{}}/checkpoints/', $.processing_job.job_id)",
+                      "LocalPath": "/opt/ml/processing/input/checkpoints",
+                      "S3DataType": "S3Prefix",
+                      "S3InputMode": "File"
+                    }}
+                  }}
+                ],
+                "ProcessingOutputConfig": {{
+                  "Outputs": [
+                    {{
+                      "OutputName": "output-data",
+                      "S3Output": {{
+                        "S3Uri.$": "States.Format('s3://{bucket_name}/processed/{{}}/', $.processing_job.job_id)",
+                        "LocalPath": "/opt/ml/processing/output",
+                        "S3UploadMode": "EndOfJob"
+                      }}
+                    }},
+                    {{
+                      "OutputName": "checkpoints",
+                      "S3Output": {{
+                        "S3Uri.$": "States.Format('s3://{bucket_name}/processed/{{}}/checkpoints/', $.processing_job.job_id)",
+                        "LocalPath": "/opt/ml/processing/checkpoints",
+                        "S3UploadMode": "Continuous"
+                      }}
+                    }},
+                    {{
+                      "OutputName": "progress",
+                      "S3Output": {{
+                        "S3Uri.$": "States.Format('s3://{bucket_name}/processed/{{}}/progress/', $.processing_job.job_id)",
+                        "LocalPath": "/opt/ml/processing/progress",
+                        "S3UploadMode": "Continuous"
+                      }}
+                    }}
+                  ]
+                }},
+                "ProcessingResources": {{
+                  "ClusterConfig": {{
+                    "InstanceCount.$": "$.processing_job.plan.instance_count",
+                    "InstanceType.$": "$.processing_job.plan.instance_type",
+                    "VolumeSizeInGB.$": "$.processing_job.plan.volume_size_gb"
+                  }}
+                }},
+                "RoleArn": "{sagemaker_role.role_arn}",
+                "ProcessingJobName.$": "States.Format('processing-job-{{}}-{{}}', $.processing_job.job_id, $$.State.RetryCount)",
+                "StoppingCondition": {{
+                  "MaxRuntimeInSeconds": {PROCESSING_MAX_RUNTIME_SECONDS}
+                }}
+              }},
+              "ResultPath": "$.sagemaker_job",
+              "Next": "InvokeLambda2",
+              "Retry": [
+                {{
+                  "ErrorEquals": [
+                    "States.TaskFailed"
+                  ],
+                  "IntervalSeconds": {PROCESSING_RETRY_INTERVAL_SECONDS},
+                  "MaxAttempts": {PROCESSING_MAX_ATTEMPTS},
+                  "BackoffRate": {PROCESSING_BACKOFF_RATE}
+                }}
+              ],
+              "Catch": [
+                {{
+                  "ErrorEquals": [
+                    "States.TaskFailed",
+                    "States.Runtime"
+                  ],
+                  "ResultPath": "$.error_info",
+                  "Next": "HandleGeneralError"
+                }}
+              ]
+            }},
+            "SageMakerEmbedShards": {{
+              "Type": "Task",
+              "Resource": "arn:aws:states:::sagemaker:createProcessingJob.sync",
+              "Parameters": {{
+                "AppSpecification": {{
+                  "ImageUri": "{docker_image_uri}",
+                  "ContainerEntrypoint": [
+                    "python3",
+                    "/opt/ml/processing/input/code/processing_script.py"
+                  ],
+                  "ContainerArguments.$": "States.Array('--input-data', '/opt/ml/processing/input/data', '--output-data', '/opt/ml/processing/output', '--job-id', $.processing_job.job_id, '--mode', 'embed', '--featurizer', $.processing_job.plan.featurizer, '--cluster-by', $.processing_job.plan.cluster_by, '--checkpoint-output', '/opt/ml/processing/checkpoints', '--checkpoint-input', '/opt/ml/processing/input/checkpoints', '--progress-output', '/opt/ml/processing/progress')"
+                }},
+                "ProcessingInputs": [
+                  {{
+                    "InputName": "input-data",
+                    "S3Input": {{
+                      "S3Uri.$": "States.Format('s3://{bucket_name}/shards/{{}}/', $.processing_job.job_id)",
+                      "LocalPath": "/opt/ml/processing/input/data",
+                      "S3DataType": "S3Prefix",
+                      "S3InputMode.$": "$.processing_job.plan.input_mode",
+                      "S3DataDistributionType": "ShardedByS3Key"
+                    }}
+                  }},
+                  {{
+                    "InputName": "code",
+                    "S3Input": {{
+                      "S3Uri": "https://{bucket_name}.s3.us-west-2.amazonaws.com/scripts/",
+                      "LocalPath": "/opt/ml/processing/input/code",
+                      "S3DataType": "S3Prefix",
+                      "S3InputMode": "File"
+                    }}
+                  }},
+                  {{
+                    "InputName": "checkpoints",
+                    "S3Input": {{
+                      "S3Uri.$": "States.Format('s3://{bucket_name}/processed/{{}}/checkpoints/', $.processing_job.job_id)",
+                      "LocalPath": "/opt/ml/processing/input/checkpoints",
+                      "S3DataType": "S3Prefix",
+                      "S3InputMode": "File"
+                    }}
+                  }}
+                ],
+                "ProcessingOutputConfig": {{
+                  "Outputs": [
+                    {{
+                      "OutputName": "output-data",
+                      "S3Output": {{
+                        "S3Uri.$": "States.Format('s3://{bucket_name}/processed/{{}}/embeddings/', $.processing_job.job_id)",
+                        "LocalPath": "/opt/ml/processing/output",
+                        "S3UploadMode": "EndOfJob"
+                      }}
+                    }},
+                    {{
+                      "OutputName": "checkpoints",
+                      "S3Output": {{
+                        "S3Uri.$": "States.Format('s3://{bucket_name}/processed/{{}}/checkpoints/', $.processing_job.job_id)",
+                        "LocalPath": "/opt/ml/processing/checkpoints",
+                        "S3UploadMode": "Continuous"
+                      }}
+                    }},
+                    {{
+                      "OutputName": "progress",
+                      "S3Output": {{
+                        "S3Uri.$": "States.Format('s3://{bucket_name}/processed/{{}}/progress/', $.processing_job.job_id)",
+                        "LocalPath": "/opt/ml/processing/progress",
+                        "S3UploadMode": "Continuous"
+                      }}
+                    }}
+                  ]
+                }},
+                "ProcessingResources": {{
+                  "ClusterConfig": {{
+                    "InstanceCount.$": "$.processing_job.plan.instance_count",
+                    "InstanceType.$": "$.processing_job.plan.instance_type",
+                    "VolumeSizeInGB.$": "$.processing_job.plan.volume_size_gb"
+                  }}
+                }},
+                "RoleArn": "{sagemaker_role.role_arn}",
+                "ProcessingJobName.$": "States.Format('processing-job-{{}}-embed-{{}}', $.processing_job.job_id, $$.State.RetryCount)",
+                "StoppingCondition": {{
+                  "MaxRuntimeInSeconds": {PROCESSING_MAX_RUNTIME_SECONDS}
+                }}
+              }},
+              "ResultPath": "$.sagemaker_embed_job",
+              "Next": "SageMakerMergeAndCluster",
+              "Retry": [
+                {{
+                  "ErrorEquals": [
+                    "States.TaskFailed"
+                  ],
+                  "IntervalSeconds": {PROCESSING_RETRY_INTERVAL_SECONDS},
+                  "MaxAttempts": {PROCESSING_MAX_ATTEMPTS},
+                  "BackoffRate": {PROCESSING_BACKOFF_RATE}
+                }}
+              ],
+              "Catch": [
+                {{
+                  "ErrorEquals": [
+                    "States.TaskFailed",
+                    "States.Runtime"
+                  ],
+                  "ResultPath": "$.error_info",
+                  "Next": "HandleGeneralError"
+                }}
+              ]
+            }},
+            "SageMakerMergeAndCluster": {{
+              "Type": "Task",
+              "Resource": "arn:aws:states:::sagemaker:createProcessingJob.sync",
+              "Parameters": {{
+                "AppSpecification": {{
+                  "ImageUri": "{docker_image_uri}",
+                  "ContainerEntrypoint": [
+                    "python3",
+                    "/opt/ml/processing/input/code/processing_script.py"
+                  ],
+                  "ContainerArguments.$": "States.Array('--input-data', '/opt/ml/processing/input/data', '--output-data', '/opt/ml/processing/output', '--job-id', $.processing_job.job_id, '--mode', 'cluster', '--sample-size', States.Format('{{}}', $.processing_job.plan.cluster_sample_size), '--cluster-by', $.processing_job.plan.cluster_by, '--progress-output', '/opt/ml/processing/progress')"
                 }},
                 "ProcessingInputs": [
                   {{
                     "InputName": "input-data",
                     "S3Input": {{
-                      "S3Uri": "s3://{bucket_name}/filter/",
+                      "S3Uri.$": "States.Format('s3://{bucket_name}/processed/{{}}/embeddings/', $.processing_job.job_id)",
                       "LocalPath": "/opt/ml/processing/input/data",
                       "S3DataType": "S3Prefix",
                       "S3InputMode": "File"
@@ -245,7 +657,7 @@ class FeedbackSurveyStateMachineStack(Stack):
                   {{
                     "InputName": "code",
                     "S3Input": {{
-                      "S3Uri": "https://{bucket_name}.s3.us-west-2.amazonaws.com/scripts/processing_script.py",
+                      "S3Uri": "https://{bucket_name}.s3.us-west-2.amazonaws.com/scripts/",
                       "LocalPath": "/opt/ml/processing/input/code",
                       "S3DataType": "S3Prefix",
                       "S3InputMode": "File"
@@ -257,31 +669,50 @@ class FeedbackSurveyStateMachineStack(Stack):
                     {{
                       "OutputName": "output-data",
                       "S3Output": {{
-                        "S3Uri": "s3://{bucket_name}/processed/",
+                        "S3Uri.$": "States.Format('s3://{bucket_name}/processed/{{}}/', $.processing_job.job_id)",
                         "LocalPath": "/opt/ml/processing/output",
                         "S3UploadMode": "EndOfJob"
                       }}
+                    }},
+                    {{
+                      "OutputName": "progress",
+                      "S3Output": {{
+                        "S3Uri.$": "States.Format('s3://{bucket_name}/processed/{{}}/progress/', $.processing_job.job_id)",
+                        "LocalPath": "/opt/ml/processing/progress",
+                        "S3UploadMode": "Continuous"
+                      }}
                     }}
                   ]
                 }},
                 "ProcessingResources": {{
                   "ClusterConfig": {{
                     "InstanceCount": 1,
-                    "InstanceType": "ml.c5.xlarge",
-                    "VolumeSizeInGB": 10
+                    "InstanceType.$": "$.processing_job.plan.merge_instance_type",
+                    "VolumeSizeInGB.$": "$.processing_job.plan.merge_volume_size_gb"
                   }}
                 }},
                 "RoleArn": "{sagemaker_role.role_arn}",
-                "ProcessingJobName.$": "States.Format('processing-job-{{}}', $.processing_job.job_id)",
+                "ProcessingJobName.$": "States.Format('processing-job-{{}}-{{}}', $.processing_job.job_id, $$.State.RetryCount)",
                 "StoppingCondition": {{
-                  "MaxRuntimeInSeconds": 3600
+                  "MaxRuntimeInSeconds": {PROCESSING_MAX_RUNTIME_SECONDS}
                 }}
               }},
               "ResultPath": "$.sagemaker_job",
               "Next": "InvokeLambda2",
+              "Retry": [
+                {{
+                  "ErrorEquals": [
+                    "States.TaskFailed"
+                  ],
+                  "IntervalSeconds": {PROCESSING_RETRY_INTERVAL_SECONDS},
+                  "MaxAttempts": {PROCESSING_MAX_ATTEMPTS},
+                  "BackoffRate": {PROCESSING_BACKOFF_RATE}
+                }}
+              ],
               "Catch": [
                 {{
                   "ErrorEquals": [
+                    "States.TaskFailed",
                     "States.Runtime"
                   ],
                   "ResultPath": "$.error_info",
@@ -295,7 +726,8 @@ class FeedbackSurveyStateMachineStack(Stack):
               "Parameters": {{
                 "job_id.$": "$.processing_job.job_id",
                 "query.$": "$.processing_job.query",
-                "filters.$": "$.processing_job.filters"
+                "filters.$": "$.processing_job.filters",
+                "traceparent.$": "$.traceparent"
               }},
               "ResultPath": "$.lambda2_result",
               "End": true,
@@ -309,10 +741,94 @@ class FeedbackSurveyStateMachineStack(Stack):
                 }}
               ]
             }},
+            "RecordInvalidQuery": {{
+              "Type": "Task",
+              "Resource": "arn:aws:states:::dynamodb:updateItem",
+              "Parameters": {{
+                "TableName": "{job_registry_table.table_name}",
+                "Key": {{
+                  "job_id": {{
+                    "S.$": "$.job_id"
+                  }}
+                }},
+                "UpdateExpression": "SET #status = :status, #error = :error, #cause = :cause",
+                "ExpressionAttributeNames": {{
+                  "#status": "status",
+                  "#error": "error",
+                  "#cause": "cause"
+                }},
+                "ExpressionAttributeValues": {{
+                  ":status": {{
+                    "S": "FAILED"
+                  }},
+                  ":error": {{
+                    "S": "InvalidQuery"
+                  }},
+                  ":cause": {{
+                    "S": "Invalid query. Please ask about the survey."
+                  }}
+                }}
+              }},
+              "ResultPath": null,
+              "Next": "FailInvalidQuery",
+              "Catch": [
+                {{
+                  "ErrorEquals": [
+                    "States.ALL"
+                  ],
+                  "Next": "FailInvalidQuery"
+                }}
+              ]
+            }},
+            "FailInvalidQuery": {{
+              "Type": "Fail",
+              "Error": "InvalidQuery",
+              "Cause": "Invalid query. Please ask about the survey."
+            }},
             "HandleGeneralError": {{
               "Type": "Pass",
               "Result": "Possible scenarios: The filters you selected returned no data. Please try changing the filters and try again. Alternatively, there may be an internal server issue. Please try again later.",
-              "Next": "FailWithMessage"
+              "ResultPath": "$.message",
+              "Next": "RecordFailure"
+            }},
+            "RecordFailure": {{
+              "Type": "Task",
+              "Resource": "arn:aws:states:::dynamodb:updateItem",
+              "Parameters": {{
+                "TableName": "{job_registry_table.table_name}",
+                "Key": {{
+                  "job_id": {{
+                    "S.$": "$.job_id"
+                  }}
+                }},
+                "UpdateExpression": "SET #status = :status, #error = :error, #cause = :cause",
+                "ExpressionAttributeNames": {{
+                  "#status": "status",
+                  "#error": "error",
+                  "#cause": "cause"
+                }},
+                "ExpressionAttributeValues": {{
+                  ":status": {{
+                    "S": "FAILED"
+                  }},
+                  ":error": {{
+                    "S": "GeneralProcessingError"
+                  }},
+                  ":cause": {{
+                    "S.$": "$.message"
+                  }}
+                }}
+              }},
+              "ResultPath": null,
+              "Next": "FailWithMessage",
+              "Catch": [
+                {{
+                  "ErrorEquals": [
+                    "States.ALL"
+                  ],
+                  "Next": "FailWithMessage"
+                }}
+              ]
             }},
             "FailWithMessage": {{
               "Type": "Fail",
@@ -323,16 +839,89 @@ class FeedbackSurveyStateMachineStack(Stack):
         }}
         """
 
+        # Long enough for the longest path, a sharded job whose embed and
+        # merge steps both use every retry, plus the Lambda stages around them
+        state_machine_timeout = Duration.seconds(2 * processing_step_seconds() + 3 * lambda_timeout.to_seconds())
+
         # Create the State Machine using the hardcoded JSON
         state_machine = sfn.StateMachine(
             self, "FeedbackSurveyStateMachine",
             definition_body=DefinitionBody.from_string(state_machine_definition),
-            timeout=Duration.minutes(30),
+            timeout=state_machine_timeout,
             role=state_machine_role
         )
 
         # Store the state machine ARN as an instance variable
         self.state_machine_arn = state_machine.state_machine_arn
+        self.job_registry_table_name = job_registry_table.table_name
 
         # Output the state machine ARN
         CfnOutput(self, "StateMachineArnOutput", value=state_machine.state_machine_arn, export_name="StateMachineArn")
+
+    def create_processing_worker_pool(self, bucket_name, docker_image_uri, worker_count):
+        """Queue and Fargate service for the warm processing workers."""
+        dead_letter_queue = sqs.Queue(
+            self, "ProcessingWorkerDeadLetterQueue",
+            retention_period=Duration.days(4)
+        )
+        processing_queue = sqs.Queue(
+            self, "ProcessingWorkerQueue",
+            # Workers extend this while a job runs
+            visibility_timeout=Duration.minutes(2),
+            retention_period=Duration.hours(2),
+            dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=3, queue=dead_letter_queue)
+        )
+
+        # Public subnets only: the workers reach S3, SQS and Step Functions
+        # through their public endpoints, without a NAT gateway
+        vpc = ec2.Vpc(
+            self, "ProcessingWorkerVpc",
+            max_azs=2,
+            nat_gateways=0,
+            subnet_configuration=[ec2.SubnetConfiguration(name="public", subnet_type=ec2.SubnetType.PUBLIC)]
+        )
+        cluster = ecs.Cluster(self, "ProcessingWorkerCluster", vpc=vpc)
+
+        task_definition = ecs.FargateTaskDefinition(
+            self, "ProcessingWorkerTask",
+            cpu=4096,
+            memory_limit_mib=8192
+        )
+        task_definition.add_to_task_role_policy(iam.PolicyStatement(
+            actions=["s3:GetObject", "s3:PutObject", "s3:ListBucket"],
+            resources=[f"arn:aws:s3:::{bucket_name}", f"arn:aws:s3:::{bucket_name}/*"]
+        ))
+        task_definition.add_to_task_role_policy(iam.PolicyStatement(
+            actions=["states:SendTaskSuccess", "states:SendTaskFailure", "states:SendTaskHeartbeat"],
+            resources=["*"]
+        ))
+        processing_queue.grant_consume_messages(task_definition.task_role)
+        task_definition.add_to_execution_role_policy(iam.PolicyStatement(
+            actions=[
+                "ecr:GetAuthorizationToken",
+                "ecr:GetDownloadUrlForLayer",
+                "ecr:BatchGetImage",
+                "ecr:BatchCheckLayerAvailability"
+            ],
+            resources=["*"]
+        ))
+        task_definition.add_container(
+            "ProcessingWorker",
+            image=ecs.ContainerImage.from_registry(docker_image_uri),
+            entry_point=["python3", "-c", WORKER_BOOTSTRAP],
+            environment={
+                "PROCESSING_QUEUE_URL": processing_queue.queue_url,
+                "BUCKET_NAME": bucket_name,
+                "AWS_DEFAULT_REGION": self.region
+            },
+            logging=ecs.LogDrivers.aws_logs(stream_prefix="processing-worker")
+        )
+
+        ecs.FargateService(
+            self, "ProcessingWorkerService",
+            cluster=cluster,
+            task_definition=task_definition,
+            desired_count=worker_count,
+            assign_public_ip=True
+        )
+        return processing_queue
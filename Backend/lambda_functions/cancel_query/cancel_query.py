@@ -0,0 +1,130 @@
+import json
+import os
+from botocore.exceptions import ClientError
+from job_registry import get_job_registry, TERMINAL_STATUSES
+from aws_clients import get_client
+from tracing import Tracer
+
+step_function = os.environ['STEP_FUNCTION_ARN']
+bucket = os.environ['BUCKET_NAME']
+inflight_jobs_table = os.environ['INFLIGHT_JOBS_TABLE']
+CANCEL_ERROR = 'JobCancelled'
+CANCEL_CAUSE = 'Cancelled by the user'
+# States an Athena query can still be stopped in
+ATHENA_ACTIVE_STATES = ('QUEUED', 'RUNNING')
+
+dynamodb = get_client('dynamodb')
+s3 = get_client('s3')
+athena = get_client('athena')
+sagemaker = get_client('sagemaker')
+stepfunctions = get_client('stepfunctions')
+registry = get_job_registry()
+tracer = Tracer('cancel_query')
+
+@tracer.handler('cancel_query')
+def lambda_handler(event, context):
+    """Cancel a job: record it CANCELLED, then stop its execution, its Athena
+    query and its SageMaker processing jobs, and tell a worker running it to
+    stop.
+
+    A job that identical requests share (see start_query) keeps running for
+    the others, and only this request leaves it.
+    """
+    body = json.loads(event.get('body') or '{}')
+    job_id = body.get('job_id')
+    if not job_id:
+        return response(400, {'error': 'job_id is required'})
+    tracer.current_span().set_job_id(job_id)
+
+    job = registry.get(job_id)
+    if job is None:
+        return response(404, {'error': 'Job not found'})
+    if job['status'] in TERMINAL_STATUSES:
+        return response(409, {'error': 'Job has already finished', 'status': job['status']})
+
+    try:
+        if job.get('request_key') and leave_shared_job(job['request_key'], job_id):
+            tracer.current_span().set(shared=True)
+            return response(200, {'job_id': job_id, 'status': job['status'], 'shared': True})
+        # Recorded first, so the stages still finishing cannot overwrite it
+        if not registry.cancel(job_id, CANCEL_CAUSE):
+            return response(409, {'error': 'Job has already finished', 'status': registry.get(job_id)['status']})
+        stopped = stop_job(job_id, job)
+    except Exception as e:
+        return response(500, {'error': str(e)})
+
+    tracer.current_span().set(athena_queries=len(stopped['athena_queries']),
+                              processing_jobs=len(stopped['processing_jobs']))
+    return response(200, {'job_id': job_id, 'status': 'CANCELLED', 'stopped': stopped})
+
+
+def leave_shared_job(request_key, job_id):
+    """True if other requests still wait on the job, now this one has left."""
+    try:
+        dynamodb.update_item(
+            TableName=inflight_jobs_table,
+            Key={'request_key': {'S': request_key}},
+            UpdateExpression='ADD subscribers :minus_one',
+            ConditionExpression='job_id = :job_id AND subscribers > :one',
+            ExpressionAttributeValues={':minus_one': {'N': '-1'}, ':one': {'N': '1'}, ':job_id': {'S': job_id}}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return False
+    return True
+
+
+def stop_job(job_id, job):
+    """Stop whatever the job still has running; returns what was stopped."""
+    stopped = {'execution': False, 'athena_queries': [], 'processing_jobs': []}
+
+    # A worker from the pool checks for this between batches (see
+    # processing_worker.py); it is written whichever backend runs the job
+    s3.put_object(Bucket=bucket, Key=worker_cancel_marker(job_id), Body=CANCEL_CAUSE.encode('utf-8'))
+
+    # No further states start once the execution is stopped
+    execution_arn = job.get('execution_arn') or \
+        f"{step_function.replace('stateMachine', 'execution')}:processing-job-{job_id}"
+    try:
+        stepfunctions.stop_execution(executionArn=execution_arn, error=CANCEL_ERROR, cause=CANCEL_CAUSE)
+        stopped['execution'] = True
+    except stepfunctions.exceptions.ExecutionDoesNotExist:
+        pass
+
+    # Recorded by process_query when it starts the query
+    query_execution_id = job.get('athena_query_execution_id')
+    if query_execution_id:
+        execution = athena.get_query_execution(QueryExecutionId=query_execution_id)['QueryExecution']
+        if execution['Status']['State'] in ATHENA_ACTIVE_STATES:
+            athena.stop_query_execution(QueryExecutionId=query_execution_id)
+            stopped['athena_queries'].append(query_execution_id)
+
+    # Every attempt of the job, and of its embed job when it is sharded
+    listing = sagemaker.list_processing_jobs(NameContains=f'processing-job-{job_id}', StatusEquals='InProgress',
+                                             MaxResults=100)
+    for summary in listing['ProcessingJobSummaries']:
+        try:
+            sagemaker.stop_processing_job(ProcessingJobName=summary['ProcessingJobName'])
+            stopped['processing_jobs'].append(summary['ProcessingJobName'])
+        except ClientError as e:
+            # It finished in the meantime
+            print(f"Could not stop {summary['ProcessingJobName']}: {e}")
+    return stopped
+
+
+def worker_cancel_marker(job_id):
+    return f"processed/{job_id}/cancelled"
+
+
+def response(status_code, body):
+    return {
+        'statusCode': status_code,
+        'body': json.dumps(body),
+        "headers": {
+                    "Access-Control-Allow-Origin": "*",
+                    "Access-Control-Allow-Methods": "POST",
+                    "Access-Control-Allow-Headers": "Content-Type",
+                    'Content-Type': 'application/json'
+                    }
+    }
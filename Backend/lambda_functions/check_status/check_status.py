@@ -1,111 +1,309 @@
+import base64
+import gzip
 import json
-import boto3
 import os
+import time
+from job_registry import get_job_registry, TERMINAL_STATUSES
+from aws_clients import get_client
+from tracing import Tracer
 
 step_function = os.environ['STEP_FUNCTION_ARN']
+bucket = os.environ['BUCKET_NAME']
+# A running job whose registry entry is older than this is confirmed against
+# Step Functions, which catches executions that timed out or were aborted
+# without a pipeline stage recording it
+STALE_AFTER_SECONDS = int(os.environ.get('STATUS_STALE_AFTER_SECONDS', '30'))
+# Long polls must answer before the 29 second API Gateway integration timeout
+MAX_WAIT_SECONDS = 20
+LONG_POLL_INTERVAL_SECONDS = 1
+MAX_BATCH_SIZE = 50
+# Results stored in S3 larger than this are returned as a presigned URL
+INLINE_OUTPUT_MAX_BYTES = int(os.environ.get('INLINE_OUTPUT_MAX_BYTES', str(1024 * 1024)))
+PRESIGNED_URL_EXPIRY_SECONDS = 900
+OUTPUT_FORMATS = ('auto', 'inline', 'url', 'gzip')
+# While a job clusters, each processing host reports its stage in order
+# through these, and its encoding progress, in
+# processed/{job_id}/progress/{mode}-{host}.json
+PROGRESS_STAGES = ('loading', 'encoding', 'clustering', 'done')
 
+stepfunctions = get_client('stepfunctions')
+s3 = get_client('s3')
+registry = get_job_registry()
+tracer = Tracer('check_status')
+
+@tracer.handler('check_status')
 def lambda_handler(event, context):
-    stepfunctions = boto3.client('stepfunctions')
-    
-    
-    # Get job_id from query parameters
-    job_id = event['queryStringParameters'].get('jobId')
-    # job_id = "065799ec-4db6-4f5a-9100-2363879dbf9f"
-    execution_name = f"processing-job-{job_id}"
-    executionArn=f"{step_function.replace('stateMachine', 'execution')}:{execution_name}"
-    
-    if not job_id:
-        return {
-            'statusCode': 400,
-            'body': json.dumps({'error': 'jobId is required'}),
-            "headers": {
-                        "Access-Control-Allow-Origin": "*", 
-                        "Access-Control-Allow-Methods": "POST",
-                        "Access-Control-Allow-Headers": "Content-Type"
-                        }
-        }
-    
-    # Construct execution name from job_id
-    execution_name = f"processing-job-{job_id}"
-    
-    # Describe the execution
+    """Status of one job (?jobId=) or many (?jobIds=a,b,c).
+
+    With waitSeconds=N the request is held until a job's state differs from
+    the state the client last saw (since=, one token per job) or from the
+    state at the start of the request, or until N seconds have passed.
+
+    format= selects how finished results are returned: inline in 'output',
+    as a presigned 'output_url', or (single job only) as a gzip-compressed
+    body. 'auto' inlines small results and links large ones; batches link.
+    """
+    params = event.get('queryStringParameters') or {}
+    batch = 'jobIds' in params
+    if batch:
+        job_ids = [job_id.strip() for job_id in params['jobIds'].split(',') if job_id.strip()]
+    else:
+        job_ids = [params['jobId']] if params.get('jobId') else []
+
+    if not job_ids:
+        return response(400, {'error': 'jobId is required'})
+    # A single-job poll joins that job's trace
+    if not batch:
+        tracer.current_span().set_job_id(job_ids[0])
+    tracer.current_span().set(jobs=len(job_ids))
+    if len(job_ids) > MAX_BATCH_SIZE:
+        return response(400, {'error': f'At most {MAX_BATCH_SIZE} jobIds can be requested at once'})
+
     try:
-        response = stepfunctions.describe_execution(
-            executionArn=f"{step_function.replace('stateMachine', 'execution')}:{execution_name}"
-        )
-        
-        print(executionArn)
-        status = response['status']
-        output = response.get('output', None)
-        
+        wait_seconds = min(max(float(params.get('waitSeconds', 0)), 0), MAX_WAIT_SECONDS)
+    except ValueError:
+        return response(400, {'error': 'waitSeconds must be a number'})
+
+    output_format = params.get('format')
+    if output_format is None:
+        accept = {k.lower(): v for k, v in (event.get('headers') or {}).items()}.get('accept', '')
+        output_format = 'gzip' if 'application/gzip' in accept else 'auto'
+    if output_format not in OUTPUT_FORMATS:
+        return response(400, {'error': f"format must be one of {', '.join(OUTPUT_FORMATS)}"})
+    if batch and output_format == 'gzip':
+        return response(400, {'error': 'format=gzip is only available for a single jobId'})
+    if batch and output_format == 'auto':
+        output_format = 'url'
+
+    since = params.get('since')
+    since_states = since.split(',') if since else None
+    if since_states is not None and len(since_states) != len(job_ids):
+        return response(400, {'error': 'since must have one state per job id'})
+
+    try:
+        # Progress is not part of the state, so a long poll reads it once,
+        # for the answer, rather than listing S3 on every poll
+        statuses = [get_job_status(job_id, output_format, with_progress=not wait_seconds) for job_id in job_ids]
+
+        if wait_seconds:
+            baseline = since_states or [state_token(result) for _, result in statuses]
+            deadline = time.time() + wait_seconds
+            while not has_changed(statuses, baseline) and time.time() < deadline:
+                time.sleep(LONG_POLL_INTERVAL_SECONDS)
+                statuses = [
+                    (status_code, result) if is_settled(status_code, result)
+                    else get_job_status(job_id, output_format, with_progress=False)
+                    for job_id, (status_code, result) in zip(job_ids, statuses)
+                ]
+            statuses = [
+                get_job_status(job_id, output_format) if reports_progress(result) else (status_code, result)
+                for job_id, (status_code, result) in zip(job_ids, statuses)
+            ]
+
+        if not batch:
+            status_code, result = statuses[0]
+            if output_format == 'gzip' and result.get('status') == 'SUCCEEDED':
+                return gzip_response(job_ids[0])
+            if status_code == 200:
+                result = dict(result, state=state_token(result))
+            return response(status_code, result)
+
+        return response(200, {
+            'jobs': [
+                dict(result, job_id=job_id, statusCode=status_code, state=state_token(result))
+                for job_id, (status_code, result) in zip(job_ids, statuses)
+            ]
+        })
+
+    except Exception as e:
+        return response(500, {'error': str(e)})
+
+
+def get_job_status(job_id, output_format='auto', with_progress=True):
+    """Return (status_code, result) for one job, as served by the API."""
+    job = registry.get(job_id)
+    now = int(time.time())
+
+    if job is None or (job['status'] not in TERMINAL_STATUSES and now - job.get('updated_at', 0) >= STALE_AFTER_SECONDS):
+        job = refresh_from_execution(job_id, job)
+
+    if job is None:
+        return 404, {'error': 'Job not found'}
+
+    status = job['status']
+    result = {
+        'job_id': job_id,
+        'status': status
+    }
+    if job.get('stage'):
+        result['stage'] = job['stage']
+    if with_progress and reports_progress(result):
+        try:
+            result['progress'] = processing_progress(job_id, job.get('row_count'))
+        except Exception as e:
+            print(f"Could not read the progress of {job_id}: {e}")
+
+    if status == 'SUCCEEDED':
+        location = job.get('result_location')
+        if location is None and 'output' not in job:
+            return 500, {'error': 'lambda2_result or body not found in output'}
         result = {
-            'job_id': job_id,
-            'status': status
+            'status':status
         }
-        
-        if status == 'SUCCEEDED' and output:
-            # Parse the Step Function's output as JSON
-            output_json = json.loads(output)
-            
-            # Check if lambda2_result is present and contains 'body'
-            if "lambda2_result" in output_json and "body" in output_json["lambda2_result"]:
-                lambda2_body = output_json["lambda2_result"]["body"]
-                result = {
-                    'status':status,
-                    'output':lambda2_body
-                }
-                
-                return {
-                    'statusCode': 200,
-                    'body': json.dumps(result),
-                    "headers": {
-                        "Access-Control-Allow-Origin": "*", 
-                        "Access-Control-Allow-Methods": "POST",
-                        "Access-Control-Allow-Headers": "Content-Type"
-                        }
-                }
-            else:
-                return {
-                    'statusCode': 500,
-                    'body': json.dumps({'error': 'lambda2_result or body not found in output'}),
-                    'headers': {
-                        'Content-Type': 'application/json'
+        if location is None:
+            result['output'] = job['output']
+        elif output_format in ('url', 'gzip') or (output_format == 'auto' and location['size'] > INLINE_OUTPUT_MAX_BYTES):
+            result['output_url'] = s3.generate_presigned_url(
+                'get_object',
+                Params={'Bucket': location['bucket'], 'Key': location['key']},
+                ExpiresIn=PRESIGNED_URL_EXPIRY_SECONDS
+            )
+            result['output_size'] = location['size']
+        else:
+            stored = s3.get_object(Bucket=location['bucket'], Key=location['key'])['Body'].read()
+            result['output'] = json.loads(gzip.decompress(stored))
+    elif status in TERMINAL_STATUSES:
+        result['error'] = job.get('error', 'Unknown error')
+        result['cause'] = job.get('cause', 'No cause provided')
+
+    return 200, result
+
+
+def processing_progress(job_id, row_count=None):
+    """How far the processing hosts have got, from the reports they publish.
+
+    'provisioning' until the first report, and again between the sharded
+    embed and merge jobs. Rows are counted over the embedding hosts, against
+    the job's row count; the ETA is for the encoding to finish.
+    """
+    listing = s3.list_objects_v2(Bucket=bucket, Prefix=f"processed/{job_id}/progress/")
+    reports = [
+        json.loads(s3.get_object(Bucket=bucket, Key=item['Key'])['Body'].read())
+        for item in listing.get('Contents', [])
+    ]
+    merge = [report for report in reports if report['mode'] == 'cluster']
+    encoders = [report for report in reports if report['mode'] != 'cluster']
+    current = merge or encoders
+    if not current or (not merge and all(report['mode'] == 'embed' and report['stage'] == 'done' for report in current)):
+        return {'stage': 'provisioning'}
+
+    stage = min((report['stage'] for report in current), key=PROGRESS_STAGES.index)
+    rows_encoded = sum(report['rows_encoded'] for report in encoders)
+    rows_total = row_count
+    if rows_total is None and all(report['rows_total'] is not None for report in encoders):
+        rows_total = sum(report['rows_total'] for report in encoders)
+    progress = {
+        'stage': stage,
+        'hosts': len(current),
+        'rows_encoded': rows_encoded,
+        'rows_total': rows_total,
+        'updated_at': max(report['updated_at'] for report in current)
+    }
+    if stage == 'encoding':
+        rate = sum(report['rows_per_second'] or 0 for report in encoders if report['stage'] == 'encoding')
+        progress['rows_per_second'] = rate
+        if rate and rows_total is not None:
+            progress['eta_seconds'] = max(rows_total - rows_encoded, 0) / rate
+    return progress
+
+
+def reports_progress(result):
+    # Processing hosts report progress while the job clusters
+    return result.get('status') == 'RUNNING' and result.get('stage') == 'CLUSTERING'
+
+
+def state_token(result):
+    # What a client compares between polls: the status plus the stage
+    if 'status' not in result:
+        return 'UNKNOWN'
+    if result.get('stage') and result['status'] not in TERMINAL_STATUSES:
+        return f"{result['status']}:{result['stage']}"
+    return result['status']
+
+
+def is_settled(status_code, result):
+    # Finished jobs and errors (e.g. unknown job ids) will not change
+    return status_code != 200 or result.get('status') in TERMINAL_STATUSES
+
+
+def has_changed(statuses, baseline):
+    if any(state_token(result) != seen for (_, result), seen in zip(statuses, baseline)):
+        return True
+    # Nothing left to wait for once every job has finished
+    return all(is_settled(status_code, result) for status_code, result in statuses)
+
+
+def gzip_response(job_id):
+    job = registry.get(job_id)
+    location = job.get('result_location')
+    if location is None:
+        body = gzip.compress(json.dumps({'status': 'SUCCEEDED', 'output': job['output']}).encode('utf-8'))
+    else:
+        # The stored object is already gzip-compressed. Gzip members can be
+        # concatenated, so the response envelope is wrapped around it
+        # without decompressing the stored result.
+        stored = s3.get_object(Bucket=location['bucket'], Key=location['key'])['Body'].read()
+        body = gzip.compress(b'{"status": "SUCCEEDED", "output": ') + stored + gzip.compress(b'}')
+    return {
+        'statusCode': 200,
+        'body': base64.b64encode(body).decode('ascii'),
+        'isBase64Encoded': True,
+        "headers": {
+                    "Content-Type": "application/gzip",
+                    "Access-Control-Allow-Origin": "*",
+                    "Access-Control-Allow-Methods": "POST",
+                    "Access-Control-Allow-Headers": "Content-Type"
                     }
-                }
-        elif status == 'FAILED':
-            result['error'] = response.get('error', 'Unknown error')
-            result['cause'] = response.get('cause', 'No cause provided')
-        
-        return {
-            'statusCode': 200,
-            'body': json.dumps(result),
-            # 'headers': {
-            #     'Content-Type': 'application/json'
-            # }
-            "headers": {
-                        "Access-Control-Allow-Origin": "*", 
-                        "Access-Control-Allow-Methods": "POST",
-                        "Access-Control-Allow-Headers": "Content-Type"
-                        }
-        }
-        
+    }
+
+
+def response(status_code, body):
+    return {
+        'statusCode': status_code,
+        'body': json.dumps(body),
+        "headers": {
+                    "Access-Control-Allow-Origin": "*",
+                    "Access-Control-Allow-Methods": "POST",
+                    "Access-Control-Allow-Headers": "Content-Type"
+                    }
+    }
+
+
+def refresh_from_execution(job_id, job):
+    """Read the job's state from Step Functions and cache it in the registry.
+
+    Returns the refreshed job, or None if there is no such execution.
+    """
+    execution_arn = (job or {}).get('execution_arn') or \
+        f"{step_function.replace('stateMachine', 'execution')}:processing-job-{job_id}"
+    try:
+        execution = stepfunctions.describe_execution(executionArn=execution_arn)
     except stepfunctions.exceptions.ExecutionDoesNotExist:
-        return {
-            'statusCode': 404,
-            'body': json.dumps({'error': 'Job not found'}),
-            "headers": {
-                        "Access-Control-Allow-Origin": "*", 
-                        "Access-Control-Allow-Methods": "POST",
-                        "Access-Control-Allow-Headers": "Content-Type"
-                        }
-        }
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'body': json.dumps({'error': str(e)}),
-            "headers": {
-                        "Access-Control-Allow-Origin": "*", 
-                        "Access-Control-Allow-Methods": "POST",
-                        "Access-Control-Allow-Headers": "Content-Type"
-                        }
-        }
+        return job
+
+    status = execution['status']
+    print(f"Refreshed {execution_arn} from Step Functions: {status}")
+
+    if status == 'RUNNING':
+        # Refreshing updated_at keeps the next polls on the registry
+        registry.update_stage(job_id, (job or {}).get('stage', 'SUBMITTED'), execution_arn=execution_arn)
+    elif status == 'SUCCEEDED':
+        output_json = json.loads(execution.get('output') or '{}')
+        lambda2_result = output_json.get('lambda2_result', {})
+        registry.record_result(
+            job_id, status,
+            output=lambda2_result.get('body'),
+            result_location=lambda2_result.get('result_location')
+        )
+    else:
+        registry.record_result(
+            job_id, status,
+            error=execution.get('error', 'Unknown error'),
+            cause=execution.get('cause', 'No cause provided')
+        )
+
+    refreshed = registry.get(job_id)
+    if refreshed is None:
+        # Executions started before the registry existed have no entry
+        refreshed = {'job_id': job_id, 'status': status}
+    return refreshed
@@ -1,24 +1,63 @@
-import boto3
 import json
 import os
+from datasets import DATASETS_PREFIX, manifest_key, version_from_key
+from multipart_upload import find_upload_key, plan_parts, list_uploaded_parts, missing_parts, part_number_gaps
+from aws_clients import get_client
 
-s3_client = boto3.client('s3')
+s3_client = get_client('s3')
+lambda_client = get_client('lambda')
 
 def lambda_handler(event, context):
     body = json.loads(event['body'])
     upload_id = body['uploadId']
-    parts = body['parts']  # Array of dicts {PartNumber, ETag}
 
-    # Hard-coded file name from environment variable
-    file_name = os.environ.get('FILE_NAME', 'survey.csv')
     bucket_name = os.environ['BUCKET_NAME']
-    key = f'raw/{file_name}'
+    # The key initiate_upload chose (dataset version, file name and
+    # compression extension) is looked up from the upload id
+    key = find_upload_key(s3_client, bucket_name, upload_id, DATASETS_PREFIX)
+    if key is None:
+        return error_response(400, {"error": "uploadId does not match an upload in progress"})
+    dataset_version = version_from_key(key)
+
+    # S3's record of the received parts is authoritative, not the client's list
+    uploaded = list_uploaded_parts(s3_client, bucket_name, key, upload_id)
+
+    part_numbers = sorted(uploaded)
+    if 'fileSize' in body:
+        try:
+            plan = plan_parts(body['fileSize'])
+        except ValueError as e:
+            return error_response(400, {"error": str(e)})
+        missing = [part['partNumber'] for part in missing_parts(plan, uploaded)]
+        if missing:
+            return error_response(400, {
+                "error": "Upload is incomplete",
+                "missingParts": missing
+            })
+        part_numbers = [part['partNumber'] for part in plan['parts']]
+    if not part_numbers:
+        return error_response(400, {"error": "No parts have been uploaded"})
+    # Without a declared size, a gap in the parts would silently truncate the object
+    gaps = part_number_gaps(part_numbers)
+    if gaps:
+        return error_response(400, {
+            "error": "Upload is incomplete",
+            "missingParts": gaps
+        })
+
+    # A client-supplied part list must agree with what S3 received
+    for part in body.get('parts', []):
+        received = uploaded.get(part['PartNumber'])
+        if received is None or received['ETag'].strip('"') != part['ETag'].strip('"'):
+            return error_response(409, {
+                "error": f"Part {part['PartNumber']} does not match the uploaded data"
+            })
 
     # Complete the multipart upload
     multipart_upload = {
         'Parts': [
-            {'ETag': part['ETag'], 'PartNumber': part['PartNumber']}
-            for part in parts
+            {'ETag': uploaded[part_number]['ETag'], 'PartNumber': part_number}
+            for part_number in part_numbers
         ]
     }
 
@@ -29,11 +68,35 @@ def lambda_handler(event, context):
         MultipartUpload=multipart_upload
     )
 
+    # Validation and profiling stream the whole object, so they run
+    # asynchronously, write the dataset manifest and activate the version
+    lambda_client.invoke(
+        FunctionName=os.environ['PROFILE_FUNCTION_NAME'],
+        InvocationType='Event',
+        Payload=json.dumps({'key': key, 'dataset_version': dataset_version}).encode('utf-8')
+    )
+
     return {
         "statusCode": 200,
-        "body": json.dumps({"message": "Multipart upload completed successfully"}),
+        "body": json.dumps({
+            "message": "Multipart upload completed successfully",
+            "datasetVersion": dataset_version,
+            "manifestKey": manifest_key(dataset_version)
+        }),
+        "headers": {
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "POST",
+            "Access-Control-Allow-Headers": "Content-Type"
+            }
+    }
+
+
+def error_response(status_code, body):
+    return {
+        "statusCode": status_code,
+        "body": json.dumps(body),
         "headers": {
-            "Access-Control-Allow-Origin": "*", 
+            "Access-Control-Allow-Origin": "*",
             "Access-Control-Allow-Methods": "POST",
             "Access-Control-Allow-Headers": "Content-Type"
             }
@@ -0,0 +1,51 @@
+import json
+import os
+from datasets import cached_active_version, load_filter_index
+from aws_clients import get_client
+
+bucket = os.environ['BUCKET_NAME']
+# A named version's index never changes; the active one can move on upload
+PINNED_MAX_AGE_SECONDS = 86400
+ACTIVE_MAX_AGE_SECONDS = 60
+
+s3 = get_client('s3')
+
+def lambda_handler(event, context):
+    """Distinct values and row counts per filterable column (GET /filter-values).
+
+    Serves the active dataset version unless ?datasetVersion= names another;
+    ?columns=market,region limits the response to those columns.
+    """
+    params = event.get('queryStringParameters') or {}
+    pinned = bool(params.get('datasetVersion'))
+    try:
+        dataset_version = params.get('datasetVersion') or cached_active_version(s3, bucket)
+        if not dataset_version:
+            return response(404, {'error': 'No dataset has been uploaded and validated yet'})
+        index = load_filter_index(s3, bucket, dataset_version)
+    except ValueError as e:
+        return response(400, {'error': str(e)})
+    except s3.exceptions.NoSuchKey:
+        return response(404, {'error': f'No filter value index for dataset version {dataset_version}'})
+
+    if params.get('columns'):
+        wanted = {column.strip().lower() for column in params['columns'].split(',')}
+        index = dict(index, columns={
+            column: details for column, details in index['columns'].items() if column in wanted
+        })
+
+    max_age = PINNED_MAX_AGE_SECONDS if pinned else ACTIVE_MAX_AGE_SECONDS
+    return response(200, index, {'Cache-Control': f'max-age={max_age}'})
+
+
+def response(status_code, body, headers=None):
+    return {
+        'statusCode': status_code,
+        'body': json.dumps(body),
+        "headers": dict({
+                    "Access-Control-Allow-Origin": "*",
+                    "Access-Control-Allow-Methods": "GET",
+                    "Access-Control-Allow-Headers": "Content-Type",
+                    'Content-Type': 'application/json'
+                    }, **(headers or {}))
+    }
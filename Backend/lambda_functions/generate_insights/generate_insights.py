@@ -1,14 +1,21 @@
 import json
-import boto3
-import pandas as pd
-import numpy as np  # Import NumPy
-from io import StringIO
+import gzip
+import io
+from datetime import datetime
 from botocore.exceptions import ClientError
 import os
+from representatives import EmptyCSVError, format_question_summaries, select_representatives
+from job_registry import get_job_registry
+from aws_clients import get_client
+from tracing import Tracer
 
 bucket = os.environ['BUCKET_NAME']
-bedrock_client = boto3.client('bedrock-runtime', region_name='us-east-1')
+bedrock_client = get_client('bedrock-runtime', region_name='us-east-1')
+s3 = get_client('s3')
+sagemaker = get_client('sagemaker')
 # COMMENT_COLUMNS = os.environ['COMMENT_COLUMNS']
+registry = get_job_registry()
+tracer = Tracer('generate_insights')
 
 def invoke_bedrock_model(prompt, model_id):
     # model_id = "anthropic.claude-3-haiku-20240307-v1:0"
@@ -25,8 +32,11 @@ def invoke_bedrock_model(prompt, model_id):
     }
     request = json.dumps(native_request)
     try:
-        response = bedrock_client.invoke_model(modelId=model_id, body=request)
-        model_response = json.loads(response["body"].read())
+        with tracer.span('bedrock.invoke_model', model_id=model_id, max_tokens=native_request['max_tokens']) as span:
+            response = bedrock_client.invoke_model(modelId=model_id, body=request)
+            model_response = json.loads(response["body"].read())
+            usage = model_response.get('usage', {})
+            span.set(input_tokens=usage.get('input_tokens'), output_tokens=usage.get('output_tokens'))
         
         # Log the model response for debugging
         # print(f"Model Response: {model_response}")
@@ -36,12 +46,172 @@ def invoke_bedrock_model(prompt, model_id):
     except (ClientError, Exception) as e:
         raise Exception(f"ERROR: Can't invoke '{model_id}'. Reason: {e}")
 
+@tracer.handler('generate_insights')
 def lambda_handler(event, context):
+    job_id = event.get('job_id')
+    if job_id:
+        registry.update_stage(job_id, 'GENERATING_INSIGHTS')
+        delete_checkpoints(job_id)
+        record_processing_job_spans(job_id, event.get('traceparent'))
+
+    result = generate_insights(event)
+
+    # The registry serves the result to check_status from here on
+    if job_id and result['statusCode'] == 200:
+        # Only a pointer travels through the Step Functions state, which keeps
+        # large insight sets clear of the 256 KB payload limit
+        location = store_result(job_id, result['body'])
+        registry.record_result(job_id, 'SUCCEEDED', result_location=location)
+        return {
+            'statusCode': 200,
+            'result_location': location
+        }
+    if job_id:
+        # No insights: the body is the reason, as a JSON string
+        error = 'InsufficientData' if result['statusCode'] == 400 else 'InsightsGenerationError'
+        registry.record_result(job_id, 'FAILED', error=error, cause=json.loads(result['body']))
+    return result
+
+def results_prefix(job_id):
+    # Written by the processing job(s); embeddings/ only for sharded jobs
+    return f"processed/{job_id}/"
+
+# Written next to the results when the warm worker pool ran the job
+WORKER_TIMINGS_FILE = 'worker.json'
+# Written instead of row clusters when each question was clustered on its own
+QUESTION_SUMMARIES_FILE = 'cluster_summaries.json'
+
+def delete_checkpoints(job_id):
+    """Remove the embedding batches the processing job saved as it went.
+
+    Only a retry of the job reads them, and they are as large as the
+    embeddings themselves.
+    """
+    prefix = f"{results_prefix(job_id)}checkpoints/"
+    try:
+        while True:
+            response = s3.list_objects_v2(Bucket=bucket, Prefix=prefix)
+            keys = [{'Key': item['Key']} for item in response.get('Contents', [])]
+            if keys:
+                s3.delete_objects(Bucket=bucket, Delete={'Objects': keys, 'Quiet': True})
+            if not response.get('IsTruncated'):
+                return
+    except Exception as e:
+        print(f"Could not delete the checkpoints of {job_id}: {e}")
+
+def record_processing_job_spans(job_id, traceparent):
+    """Spans for the SageMaker jobs or the worker that just finished, from
+    their timings and from the spans the processing script wrote."""
+    try:
+        prefix = results_prefix(job_id)
+        keys = [item['Key'] for item in s3.list_objects_v2(Bucket=bucket, Prefix=prefix).get('Contents', [])]
+        if f"{prefix}{WORKER_TIMINGS_FILE}" in keys:
+            attach_script_spans(keys, prefix, record_worker_job(prefix, job_id, traceparent))
+            return
+
+        jobs = [(f'processing-job-{job_id}', prefix)]
+        if any(key.startswith(f"{prefix}embeddings/") for key in keys):
+            jobs.insert(0, (f'processing-job-{job_id}-embed', f"{prefix}embeddings/"))
+        for job_name, spans_prefix in jobs:
+            attempts = processing_job_attempts(job_name)
+            for attempt, attempt_name in enumerate(attempts):
+                run_span = record_sagemaker_job(attempt_name, job_id, traceparent, attempt)
+                # The results, and the spans with them, are the last attempt's
+                if run_span is not None and attempt == len(attempts) - 1:
+                    attach_script_spans(keys, spans_prefix, run_span)
+    except Exception as e:
+        print(f"Could not record processing job spans for {job_id}: {e}")
+
+def attach_script_spans(keys, spans_prefix, run_span):
+    for key in keys:
+        directory, name = key.rsplit('/', 1)
+        if f"{directory}/" == spans_prefix and name.startswith('trace_spans'):
+            body = s3.get_object(Bucket=bucket, Key=key)['Body'].read().decode('utf-8')
+            script_spans = [json.loads(line) for line in body.splitlines() if line.strip()]
+            for span in script_spans:
+                if span['parent_span_id'] is None:
+                    span['parent_span_id'] = run_span.span_id
+            tracer.extend(script_spans)
+
+def record_worker_job(prefix, job_id, traceparent):
+    body = s3.get_object(Bucket=bucket, Key=f"{prefix}{WORKER_TIMINGS_FILE}")['Body'].read()
+    timings = json.loads(body)
+    submitted, started, ended = (
+        datetime.fromisoformat(timings[name]) for name in ('submitted_at', 'started_at', 'ended_at')
+    )
+    job_span = tracer.record(
+        'worker.processing_job', _ns(submitted), _ns(ended), job_id=job_id, parent=traceparent,
+        worker=timings['worker']
+    )
+    # Queue wait is the time until a warm worker took the message
+    tracer.record('worker.queue_wait', _ns(submitted), _ns(started), parent=job_span)
+    return tracer.record('worker.run', _ns(started), _ns(ended), parent=job_span)
+
+def processing_job_attempts(job_name):
+    """The names of the attempts at a processing job, first to last: the
+    state machine names them job_name-0, job_name-1, ... as it retries."""
+    response = sagemaker.list_processing_jobs(NameContains=job_name, MaxResults=100)
+    attempts = {}
+    for summary in response['ProcessingJobSummaries']:
+        name = summary['ProcessingJobName']
+        attempt = name[len(job_name) + 1:]
+        if name.startswith(f"{job_name}-") and attempt.isdigit():
+            attempts[int(attempt)] = name
+    return [attempts[attempt] for attempt in sorted(attempts)]
+
+def record_sagemaker_job(job_name, job_id, traceparent, attempt=0):
+    job = sagemaker.describe_processing_job(ProcessingJobName=job_name)
+    created, started, ended = job['CreationTime'], job.get('ProcessingStartTime'), job.get('ProcessingEndTime')
+    if not (started and ended):
+        return None
+    cluster = job['ProcessingResources']['ClusterConfig']
+    job_span = tracer.record(
+        'sagemaker.processing_job', _ns(created), _ns(ended), job_id=job_id, parent=traceparent,
+        job_name=job_name, attempt=attempt, status=job['ProcessingJobStatus'], instance_type=cluster['InstanceType'],
+        instance_count=cluster['InstanceCount']
+    )
+    # Provisioning is instance start-up and image pull; the run is the container
+    tracer.record('sagemaker.provisioning', _ns(created), _ns(started), parent=job_span)
+    return tracer.record('sagemaker.run', _ns(started), _ns(ended), parent=job_span)
+
+def _ns(timestamp):
+    return int(timestamp.timestamp() * 1e9)
+
+def store_result(job_id, insights_summary):
+    payload = json.dumps(insights_summary).encode('utf-8')
+    compressed = gzip.compress(payload)
+    key = f"results/{job_id}/insights.json.gz"
+    # Stored gzip-encoded so presigned downloads are decompressed by the browser
+    s3.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=compressed,
+        ContentType='application/json',
+        ContentEncoding='gzip'
+    )
+    return {
+        'bucket': bucket,
+        'key': key,
+        'size': len(payload),
+        'compressed_size': len(compressed)
+    }
+
+def load_question_summaries(job_id):
+    try:
+        response = s3.get_object(Bucket=bucket, Key=f"{results_prefix(job_id)}{QUESTION_SUMMARIES_FILE}")
+    except s3.exceptions.NoSuchKey:
+        return None
+    return json.loads(response['Body'].read())
+
+def generate_insights(event):
     try:
         # Define S3 bucket and key
         query = event.get('query')
+        summaries = load_question_summaries(event['job_id']) if event.get('job_id') else None
+        if summaries is not None:
+            return generate_question_insights(query, summaries)
         bucket_name = bucket
-        key = "processed/clustered_results.csv"
+        key = f"{results_prefix(event['job_id'])}clustered_results.csv" if event.get('job_id') else "processed/clustered_results.csv"
         
         if not bucket_name or not key:
             return {
@@ -49,61 +219,36 @@ def lambda_handler(event, context):
                 'body': json.dumps('Error: Both bucket_name and key are required.')
             }
         
-        # Initialize S3 client
-        s3_client = boto3.client('s3')
-        
         # Get the CSV file from S3
-        response = s3_client.get_object(Bucket=bucket_name, Key=key)
-        content = response['Body'].read().decode('utf-8')
+        response = s3.get_object(Bucket=bucket_name, Key=key)
         
-        # Read CSV content into pandas DataFrame
-        df = pd.read_csv(StringIO(content))
-        print("DataFrame Head:\n", df.head())
+        # Stream the CSV through the csv module, keeping only the rows that
+        # go into the prompt; pandas here dominated the cold start
+        lines = io.TextIOWrapper(response['Body'], encoding='utf-8', newline='')
+        with tracer.span('select_representatives') as span:
+            header, data_row_count, final_result = select_representatives(lines)
+            span.set(rows=data_row_count, selected=len(final_result))
+        print(f"Read {data_row_count} rows with columns {header}")
         
         # Check the number of data rows (excluding headers)
-        data_row_count = len(df)
         if data_row_count == 0 or data_row_count == 2:
             return {
                 'statusCode': 400,
                 'body': json.dumps('Error: The CSV file contains insufficient data (either empty or duplicate columns). Please change your filters.')
             }
         
-        # Initialize list to store desired rows
-        result_list = []
-        
-        # Filter rows where 'is_unique' is True
-        if 'is_unique' in df.columns:
-            unique_rows = df[df['is_unique'] == True].drop(columns=['combined_comments'], errors='ignore').to_dict(orient='records')
-            result_list.extend(unique_rows)
-            print(f"Unique Rows Added: {len(unique_rows)}")
-        else:
+        # Unique rows plus the first row of each cluster
+        if 'is_unique' not in header:
             return {
                 'statusCode': 400,
                 'body': json.dumps("Error: 'is_unique' column not found in the CSV.")
             }
         
-        # Handle 'cluster' column
-        if 'cluster' in df.columns:
-            # Ensure 'cluster' values are numeric and non-negative
-            clusters = df['cluster'].dropna().unique()
-            clusters = [c for c in clusters if isinstance(c, (int, float, np.integer, np.floating)) and c >= 0]
-            print("Filtered Clusters:", clusters)
-            
-            for cluster_value in clusters:
-                # Select the first row for each unique cluster value
-                cluster_row = df[df['cluster'] == cluster_value].iloc[0].drop(labels=['combined_comments'], errors='ignore').to_dict()
-                result_list.append(cluster_row)
-                print(f"Added Cluster Row for Cluster {cluster_value}: ID {cluster_row.get('id', 'N/A')}")
-        else:
+        if 'cluster' not in header:
             return {
                 'statusCode': 400,
                 'body': json.dumps("Error: 'cluster' column not found in the CSV.")
             }
-        
-        # Remove potential duplicates if a row is both 'is_unique' and part of a 'cluster'
-        # This ensures each row appears only once in the result
-        unique_result = {tuple(item.items()): item for item in result_list}.values()
-        final_result = list(unique_result)
         print("Final Result List Length:", len(final_result))
         
         if not final_result:
@@ -141,55 +286,9 @@ def lambda_handler(event, context):
         for idx, comment in enumerate(comments_list, start=1):
             prompt += f"Cluster {idx}:\n- {comment}\n\n"
         
-        prompt += (
-            f"In response to the user query: '{query}', please generate detailed insights and actionable recommendations based on the comments provided. "
-            "Each insight should be thoroughly explained with context, covering the key analysis and underlying factors."
-            "For each insight, also provide a detailed recommendation that addresses the identified issue, opportunity, or pattern. "
-            "The recommendation should offer concrete solutions or next steps. Additionally, include a entire sample row that exemplifies each insight. "
-            "Ensure the output is in JSON format with the following structure:\n\n"
-            "{\n"
-            '  "insights": [\n'
-            "    {\n"
-            '      "insight": "Insight description",\n'
-            '      "recommendation": "Actionable recommendation",\n'
-            '      "sample_row": "A entire row that illustrates the insight"\n'
-            "    },\n"
-            "    ...\n"
-            "  ],\n"
-            '  "summary": "Overall summary of the insights."\n'
-            "}\n\n"
-            "Please ensure the JSON strictly follows the above format to facilitate parsing on the frontend."
-        )
-        
-        print("Constructed Prompt:\n", prompt)
-        
-        # Invoke the Bedrock model
-        model_id = "anthropic.claude-3-5-sonnet-20240620-v1:0"  # Replace with your actual model ID
-        llm_response = invoke_bedrock_model(prompt, model_id)
-        print("LLM Response:\n", llm_response)
-        
-        # Validate and parse the JSON response from LLM
-        try:
-            insights_summary = json.loads(llm_response)
-        except json.JSONDecodeError:
-            return {
-                'statusCode': 500,
-                'body': json.dumps('Error: The model response is not valid JSON.')
-            }
-        
-        # Optionally, validate the structure of the JSON
-        if not isinstance(insights_summary, dict) or 'insights' not in insights_summary or 'summary' not in insights_summary:
-            return {
-                'statusCode': 500,
-                'body': json.dumps('Error: The model response does not follow the expected JSON structure.')
-            }
-        
-        return {
-            'statusCode': 200,
-            'body': insights_summary
-        }
+        return request_insights(prompt + insights_instructions(query))
     
-    except pd.errors.EmptyDataError:
+    except EmptyCSVError:
         # Specific handling for empty CSV files
         return {
             'statusCode': 400,
@@ -201,3 +300,70 @@ def lambda_handler(event, context):
             'statusCode': 500,
             'body': json.dumps(f'An unexpected error occurred: {str(e)}')
         }
+
+def generate_question_insights(query, summaries):
+    with tracer.span('format_question_summaries') as span:
+        sections = format_question_summaries(summaries)
+        span.set(questions=len(summaries['questions']))
+    if not sections:
+        return {
+            'statusCode': 400,
+            'body': json.dumps('Error: No data available after filtering.')
+        }
+    prompt = (
+        "We have a large dataset of employee survey comments that have been processed using clustering techniques. "
+        "The answers to each survey question were clustered separately, so each cluster is a distinct theme within one question. "
+        "Below, for each question, is one representative answer from each of its largest clusters with the number of rows in the cluster, "
+        "followed by some of the answers that fit no cluster:\n\n"
+    )
+    return request_insights(prompt + sections + insights_instructions(query))
+
+def insights_instructions(query):
+    return (
+        f"In response to the user query: '{query}', please generate detailed insights and actionable recommendations based on the comments provided. "
+        "Each insight should be thoroughly explained with context, covering the key analysis and underlying factors."
+        "For each insight, also provide a detailed recommendation that addresses the identified issue, opportunity, or pattern. "
+        "The recommendation should offer concrete solutions or next steps. Additionally, include a entire sample row that exemplifies each insight. "
+        "Ensure the output is in JSON format with the following structure:\n\n"
+        "{\n"
+        '  "insights": [\n'
+        "    {\n"
+        '      "insight": "Insight description",\n'
+        '      "recommendation": "Actionable recommendation",\n'
+        '      "sample_row": "A entire row that illustrates the insight"\n'
+        "    },\n"
+        "    ...\n"
+        "  ],\n"
+        '  "summary": "Overall summary of the insights."\n'
+        "}\n\n"
+        "Please ensure the JSON strictly follows the above format to facilitate parsing on the frontend."
+    )
+
+def request_insights(prompt):
+    print("Constructed Prompt:\n", prompt)
+    
+    # Invoke the Bedrock model
+    model_id = "anthropic.claude-3-5-sonnet-20240620-v1:0"  # Replace with your actual model ID
+    llm_response = invoke_bedrock_model(prompt, model_id)
+    print("LLM Response:\n", llm_response)
+    
+    # Validate and parse the JSON response from LLM
+    try:
+        insights_summary = json.loads(llm_response)
+    except json.JSONDecodeError:
+        return {
+            'statusCode': 500,
+            'body': json.dumps('Error: The model response is not valid JSON.')
+        }
+    
+    # Optionally, validate the structure of the JSON
+    if not isinstance(insights_summary, dict) or 'insights' not in insights_summary or 'summary' not in insights_summary:
+        return {
+            'statusCode': 500,
+            'body': json.dumps('Error: The model response does not follow the expected JSON structure.')
+        }
+    
+    return {
+        'statusCode': 200,
+        'body': insights_summary
+    }
@@ -0,0 +1,83 @@
+import csv
+
+# Picks the rows sent to the model from the clustered results CSV: every row
+# flagged is_unique, then the first row of each cluster (noise, -1, excluded).
+# A single pass with the csv module keeps only the selected rows, so the
+# Lambda needs neither pandas nor numpy. Jobs clustered per question send
+# the processing script's summaries of each question's clusters instead.
+
+# Columns the processing job adds for its own use
+DROPPED_COLUMNS = ('combined_comments',)
+
+
+class EmptyCSVError(ValueError):
+    pass
+
+
+def cluster_label(value):
+    # Labels are written as ints, or as floats when the column has gaps
+    try:
+        label = float(value)
+    except (TypeError, ValueError):
+        return None
+    if label != label or label < 0:
+        return None
+    return label
+
+
+def select_representatives(lines):
+    """Return (header, row_count, rows) for the clustered results CSV.
+
+    Raises EmptyCSVError if there is not even a header.
+    """
+    reader = csv.DictReader(lines)
+    header = reader.fieldnames
+    if header is None:
+        raise EmptyCSVError('The CSV file is empty')
+
+    unique_rows = []
+    cluster_rows = {}
+    row_count = 0
+    for row in reader:
+        row_count += 1
+        for column in DROPPED_COLUMNS:
+            row.pop(column, None)
+        if (row.get('is_unique') or '').strip().lower() == 'true':
+            unique_rows.append(row)
+        label = cluster_label(row.get('cluster'))
+        if label is not None and label not in cluster_rows:
+            cluster_rows[label] = row
+
+    # A row can be both unique and the first of its cluster; keep it once
+    selected = []
+    seen = set()
+    for row in unique_rows + list(cluster_rows.values()):
+        key = tuple((column, str(value)) for column, value in row.items())
+        if key not in seen:
+            seen.add(key)
+            selected.append(row)
+    return header, row_count, selected
+
+
+def question_title(column):
+    # comment__reason_to_leave -> Reason to leave
+    return column[len('comment'):].strip('_').replace('_', ' ').capitalize() or column
+
+
+def format_question_summaries(summaries):
+    """Prompt text for the per-question cluster summaries ('' if empty)."""
+    sections = []
+    for summary in summaries['questions']:
+        if not summary['clusters'] and not summary['unique_answers']:
+            continue
+        lines = [f"Question: {question_title(summary['question'])} ({summary['answered']} answers)"]
+        for number, cluster in enumerate(summary['clusters'], start=1):
+            lines.append(f"Cluster {number} ({cluster['rows']} rows):\n- {cluster['representative']}")
+        omitted = summary['cluster_count'] - len(summary['clusters'])
+        if omitted > 0:
+            lines.append(f"({omitted} smaller clusters not shown)")
+        if summary['unique_answers']:
+            lines.append(f"Answers in no cluster ({summary['unique_rows']} rows, some shown):")
+            lines.extend(f"- {answer}" for answer in summary['unique_answers'])
+        sections.append("\n".join(lines) + "\n\n")
+    return "".join(sections)
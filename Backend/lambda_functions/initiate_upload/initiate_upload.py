@@ -1,17 +1,35 @@
-import boto3
 import json
 import os
+from datasets import new_dataset_version, dataset_object_key, dataset_file_name, COMPRESSION_FORMATS
+from aws_clients import get_client
 
-s3_client = boto3.client('s3')
+s3_client = get_client('s3')
 
 def lambda_handler(event, context):
+    # Optional: {"compression": "gzip" | "zstd"} for a pre-compressed CSV
+    body = json.loads(event.get('body') or '{}')
+    compression = body.get('compression')
+
     # Hard-coded file name and type from environment variables
-    file_name = os.environ.get('FILE_NAME', 'survey.csv')
-    file_type = os.environ.get('FILE_TYPE', 'text/csv')
+    try:
+        file_name = dataset_file_name(os.environ.get('FILE_NAME', 'survey.csv'), compression)
+    except ValueError as e:
+        return {
+            "statusCode": 400,
+            "body": json.dumps({"error": str(e)}),
+            "headers": {
+                "Access-Control-Allow-Origin": "*",
+                "Access-Control-Allow-Methods": "POST",
+                "Access-Control-Allow-Headers": "Content-Type"
+            }
+        }
+    file_type = COMPRESSION_FORMATS[compression]['content_type'] if compression else os.environ.get('FILE_TYPE', 'text/csv')
 
     # Retrieve bucket name from environment variable
     bucket_name = os.environ['BUCKET_NAME']
-    key = f'raw/{file_name}'
+    # Each upload is a new dataset version; it only becomes active once profiled
+    dataset_version = new_dataset_version()
+    key = dataset_object_key(dataset_version, file_name)
 
     # Initiate multipart upload
     response = s3_client.create_multipart_upload(
@@ -25,10 +43,12 @@ def lambda_handler(event, context):
         "statusCode": 200,
         "body": json.dumps({
             "uploadId": upload_id,
-            "fileName": file_name
+            "fileName": file_name,
+            "datasetVersion": dataset_version,
+            "compression": compression
         }),
         "headers": {
-            "Access-Control-Allow-Origin": "*", 
+            "Access-Control-Allow-Origin": "*",
             "Access-Control-Allow-Methods": "POST",
             "Access-Control-Allow-Headers": "Content-Type"
         }
@@ -1,9 +1,13 @@
-import boto3
 import os
+import csv
+import io
 import json
 import uuid
-from botocore.exceptions import ClientError
 import time
+from job_registry import get_job_registry
+from aws_clients import get_client
+from tracing import Tracer
+from processing_plan import ROWS_PER_SHARD, plan_processing
 
 
 bucket = os.environ['BUCKET_NAME']
@@ -11,75 +15,180 @@ athena_table_name = os.environ['ATHENA_TABLE']
 athena_database =  os.environ['ATHENA_DATABASE']
 COMMENT_COLUMNS = os.environ['COMMENT_COLUMNS']
 
-s3 = boto3.client('s3')
-bedrock_client = boto3.client('bedrock-runtime', region_name='us-east-1')
-sagemaker = boto3.client('sagemaker')
+s3 = get_client('s3')
+athena = get_client('athena')
+bedrock_client = get_client('bedrock-runtime', region_name='us-east-1')
+sagemaker = get_client('sagemaker')
+stepfunctions = get_client('stepfunctions')
+registry = get_job_registry()
+tracer = Tracer('process_query')
+NO_DATA_MESSAGE = "The filters you selected have no data. Please select different filters to get insights."
 
+
+class NoDataError(ValueError):
+    # The filters matched no rows
+    pass
+
+
+@tracer.handler('process_query')
 def lambda_handler(event, context):
    
     query = event.get('query')
     filters = event.get('filters', {})
+    # Pinned by start_query so a newer upload never changes this job's data
+    dataset_version = event.get('dataset_version')
+    # Used to abandon the Athena query if the execution stops while it runs
+    execution_arn = event.get('execution_arn')
+    # Executions started by start_query carry the public job id
+    job_id = event.get('job_id') or str(uuid.uuid4())
+    registry.update_stage(job_id, 'FILTERING')
+
+    # Failures are raised, not returned: the state machine's Catch then
+    # records them through HandleGeneralError and RecordFailure
+    sql_query = generate_sql_query(filters, dataset_version)
+    print(f"The SQL Query is: {sql_query}")
+
+    # Query CSV data
+    object_name = athena_query(sql_query, execution_arn, job_id)
+
+    # The processing job reads its shards from shards/{job_id}/ and is
+    # sized from the row count
+    row_count, input_bytes, shard_count = shard_results(f"filter/{object_name}", job_id)
+    plan = plan_processing(row_count, input_bytes, shard_count,
+                           featurizer=event.get('featurizer') or 'transformer',
+                           cluster_by=event.get('cluster_by') or 'row')
+    print(f"Processing plan for {row_count} rows: {plan}")
+    tracer.current_span().set(rows=row_count, instance_type=plan['instance_type'],
+                              instance_count=plan['instance_count'], featurizer=plan['featurizer'],
+                              cluster_by=plan['cluster_by'])
+    # The processing job downloads this prefix to resume from, and a
+    # SageMaker input must not be empty
+    s3.put_object(Bucket=bucket, Key=f"{checkpoint_prefix(job_id)}plan.json", Body=json.dumps(plan))
+
+    registry.update_stage(job_id, 'CLUSTERING', row_count=row_count)
+
+    return {
+        'job_id': job_id,
+        'query': query,
+        'filters': filters,
+        'dataset_version': dataset_version,
+        'object_name':object_name,
+        'row_count': row_count,
+        'plan': plan
+    }
+
+
+def shard_prefix(job_id):
+    # Outside filter/, which holds only Athena's results
+    return f"shards/{job_id}/"
+
+
+def checkpoint_prefix(job_id):
+    return f"processed/{job_id}/checkpoints/"
+
+
+def shard_results(result_key, job_id, rows_per_shard=ROWS_PER_SHARD):
+    """Split the Athena result CSV into shards of rows_per_shard rows.
+
+    Each shard repeats the header, so any subset of shards is valid input.
+    Returns (row_count, bytes written, shard count).
+    """
+    with tracer.span('shard_results') as span:
+        body = s3.get_object(Bucket=bucket, Key=result_key)['Body']
+        # csv-aware, since comments can contain newlines
+        reader = csv.reader(io.TextIOWrapper(body, encoding='utf-8', newline=''))
+        header = next(reader)
+
+        row_count = input_bytes = shard_count = 0
+        shard = None
+        for row in reader:
+            if shard is None:
+                shard = io.StringIO()
+                writer = csv.writer(shard, quoting=csv.QUOTE_ALL)
+                writer.writerow(header)
+                shard_rows = 0
+            writer.writerow(row)
+            row_count += 1
+            shard_rows += 1
+            if shard_rows == rows_per_shard:
+                input_bytes += put_shard(job_id, shard_count, shard)
+                shard_count += 1
+                shard = None
+        if shard is not None:
+            input_bytes += put_shard(job_id, shard_count, shard)
+            shard_count += 1
+
+        span.set(rows=row_count, bytes=input_bytes, shards=shard_count)
+        return row_count, input_bytes, shard_count
+
+
+def put_shard(job_id, index, shard):
+    data = shard.getvalue().encode('utf-8')
+    s3.put_object(Bucket=bucket, Key=f"{shard_prefix(job_id)}part-{index:05d}.csv", Body=data)
+    return len(data)
+
+
+def execution_is_running(execution_arn):
+    response = stepfunctions.describe_execution(executionArn=execution_arn)
+    return response['status'] == 'RUNNING'
+
+
+def athena_query(query, execution_arn=None, job_id=None):
+    client = athena
+    ATHENA_OUTPUT_BUCKET = f"s3://{bucket}/filter/"  # S3 bucket where Athena will put the results
+    # s3://samplecdksurveyfeedbacktesting3/filter/
+    DATABASE = athena_database  # The name of the database in Athena
+    QUERY = query  # The SQL query you want to execute
+    with tracer.span('athena.query') as span:
+        state, query_execution_id = run_athena_query(client, QUERY, DATABASE, ATHENA_OUTPUT_BUCKET, execution_arn, span,
+                                                     job_id)
     
-    sql_query = generate_sql_query(filters)
-    try:
-        
-        
-        # Generate SQL query using NLP based on user query
-        sql_query = generate_sql_query(filters)
-        print(f"The SQL Query is: {sql_query}")
-        
-        # Query CSV data
-        # filtered_data = query_csv_s3(s3, BUCKET_NAME, object_key, sql_query, use_header=True)
-        object_name = athena_query(sql_query)
-        
-        # Processing job name
-        job_id = str(uuid.uuid4())
-        # processing_job_name = f'processing-job-{job_id}'
-    
+    # Here, you can handle the response as per your requirement
+    if state == 'SUCCEEDED':
+        # Fetch the results if necessary
+        # print(result_data)
         
-        return {
-            'job_id': job_id,
-            'query': query,
-            'filters': filters,
-            'object_name':object_name
-        }
+        result_data = client.get_query_results(QueryExecutionId=query_execution_id)
+        # print(result_data)
         
-    except ClientError as e:
-        return {
-            'statusCode': 400,
-            'error': f"Client error: {e}"
-        }
+        # Check if the result has less than or equal to 2 rows
+        if len(result_data['ResultSet']['Rows']) <= 2:
+            raise NoDataError(NO_DATA_MESSAGE)
         
-    except ValueError as e:
-        # Handle specific validation errors like no data
-        raise ValueError(f"The filters you selected have no data. Please select different filters to get insights.")
         
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'error': f"Unexpected error: {e}"
-        }
 
+        # Athena names the result after the query, so concurrent jobs never
+        # read each other's
+        execution = client.get_query_execution(QueryExecutionId=query_execution_id)['QueryExecution']
+        output_location = execution['ResultConfiguration']['OutputLocation']
+        print("The query result is", output_location)
+        file_name = output_location.split('/')[-1]
+        
+        return file_name
+    raise RuntimeError(f"Athena query {query_execution_id} finished {state}")
+      
+    
+def run_athena_query(client, query, database, output_location, execution_arn, span, job_id=None):
+    """Start the query and poll it to completion; returns (state, query_execution_id).
 
-def athena_query(query):
-    s3 = boto3.client('s3')
-    client = boto3.client('athena')
-    ATHENA_OUTPUT_BUCKET = f"s3://{bucket}/filter/"  # S3 bucket where Athena will put the results
-    # s3://samplecdksurveyfeedbacktesting3/filter/
-    DATABASE = athena_database  # The name of the database in Athena
-    QUERY = query  # The SQL query you want to execute
+    Athena's own queue and execution times are recorded as spans under span.
+    """
     response = client.start_query_execution(
-        QueryString=QUERY,
+        QueryString=query,
         QueryExecutionContext={
-            'Database': DATABASE
+            'Database': database
         },
         ResultConfiguration={
-            'OutputLocation': ATHENA_OUTPUT_BUCKET
+            'OutputLocation': output_location
         }
     )
     print(response)
 
     query_execution_id = response['QueryExecutionId']
+    span.set(query_execution_id=query_execution_id)
+    # For cancel_query to stop
+    if job_id:
+        registry.update_stage(job_id, 'FILTERING', athena_query_execution_id=query_execution_id)
     
     while True:
         response = client.get_query_execution(QueryExecutionId=query_execution_id)
@@ -88,66 +197,65 @@ def athena_query(query):
         if state in ['SUCCEEDED', 'FAILED', 'CANCELLED']:  # (optional) checking the status 
             break
         
-        time.sleep(3)  # Poll every 5 seconds
-    
-    # Here, you can handle the response as per your requirement
-    if state == 'SUCCEEDED':
-        # Fetch the results if necessary
-        # print(result_data)
-        
-        result_data = client.get_query_results(QueryExecutionId=query_execution_id)
-        # print(result_data)
-        
-        # Check if the result has less than or equal to 2 rows
-        if len(result_data['ResultSet']['Rows']) <= 2:
-            raise ValueError("The filters you selected have no data. Please select different filters to get insights.")
-        
+        # Validation runs in a parallel branch; once it rejects the query the
+        # execution fails and this scan is no longer needed
+        if execution_arn and not execution_is_running(execution_arn):
+            client.stop_query_execution(QueryExecutionId=query_execution_id)
+            raise RuntimeError(f"Execution {execution_arn} is no longer running, cancelled Athena query {query_execution_id}")
         
+        time.sleep(3)  # Poll every 5 seconds
 
-        # Get list of objects
-        s3_client = boto3.client('s3')
-    
-        # Get list of objects
-        response = s3_client.list_objects_v2(Bucket=bucket, Prefix='filter/')
-        
-        # Sort objects by last modified date
-        objects = sorted(response['Contents'], key=lambda obj: obj['LastModified'], reverse=True)
-        print("The objects are",objects)
-        
-        # Get latest object
-        latest_file = objects[0]
-        print("this is file",latest_file['Key'])
-        if latest_file['Key'][-8:] == "metadata":
-            latest_file = objects[1]
-        # print(latest_file['Key'])
-        
-        # Access latest file data
-        file_name = latest_file['Key'].split('/')[-1]
-        
-        return file_name
-    else:
-        return None
-      
+    record_athena_statistics(response['QueryExecution'], span)
+    return state, query_execution_id
+
+
+def record_athena_statistics(query_execution, span):
+    # The span covers what the Lambda waited, including the polling interval;
+    # the child spans are Athena's own account of where the time went
+    statistics = query_execution.get('Statistics', {})
+    span.set(
+        state=query_execution['Status']['State'],
+        data_scanned_bytes=statistics.get('DataScannedInBytes'),
+        queue_ms=statistics.get('QueryQueueTimeInMillis'),
+        planning_ms=statistics.get('QueryPlanningTimeInMillis'),
+        engine_ms=statistics.get('EngineExecutionTimeInMillis'),
+        service_processing_ms=statistics.get('ServiceProcessingTimeInMillis'),
+        total_execution_ms=statistics.get('TotalExecutionTimeInMillis')
+    )
+    submitted = query_execution['Status'].get('SubmissionDateTime')
+    start_ns = int(submitted.timestamp() * 1e9) if submitted else span.start_ns
+    for name, key in (('athena.queue', 'QueryQueueTimeInMillis'), ('athena.execution', 'EngineExecutionTimeInMillis')):
+        duration_ns = int(statistics.get(key, 0) * 1e6)
+        tracer.record(name, start_ns, start_ns + duration_ns, parent=span)
+        start_ns += duration_ns
     
-def generate_sql_query(filters):
+
+def generate_sql_query(filters, dataset_version=None):
     # Define the columns to always select
     
     # Base SQL query with selected comment columns
     sql_query = f"SELECT * FROM {athena_table_name}"
     
+    where_conditions = []
+    # dataset_version is an injected partition, so Athena reads only that
+    # version's prefix; the value was validated when the version was created
+    if dataset_version:
+        where_conditions.append(f"dataset_version = '{dataset_version}'")
+
     # Check if there are filters to apply
     if filters:
-        where_conditions = []
         # Build the WHERE conditions based on the filters
         for filter_category in filters:
             for category, values in filter_category.items():
                 if isinstance(values, list):
                     # Multiple values for the same category, use IN clause
-                    where_conditions.append(f"{category} IN ({', '.join([f'\'{v}\'' for v in values])})")
+                    quoted_values = ', '.join(f"'{v}'" for v in values)
+                    where_conditions.append(f"{category} IN ({quoted_values})")
                 else:
                     # Single value, use equality
                     where_conditions.append(f"{category} = '{values}'")
     
+    if where_conditions:
         # Combine all WHERE conditions with AND
         sql_query += " WHERE " + " AND ".join(where_conditions)
 
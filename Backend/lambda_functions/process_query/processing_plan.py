@@ -0,0 +1,113 @@
+import math
+import os
+
+# Sizes the SageMaker processing for a job from the filtered row count.
+#
+# Small jobs run on one instance sized to the rows. Above ROWS_PER_SHARD the
+# filtered rows are split into shards and the job runs in two steps: an
+# embedding job with one instance per shard (ShardedByS3Key, at most
+# MAX_INSTANCES), then a single-instance job that merges the embeddings and
+# clusters them. Embedding is the slow part and scales out; clustering needs
+# every row at once, so the merge instance is sized for memory instead.
+#
+# The input is downloaded to the volume first (File input) by default. Set
+# PROCESSING_INPUT_MODE=Pipe to stream the filtered rows to the embedding
+# instances instead, so the volume holds only what the job writes.
+#
+# With PROCESSING_BACKEND=worker, unsharded jobs go to the warm worker pool
+# (processing_worker.py) instead, which skips provisioning and model load.
+
+ROWS_PER_SHARD = int(os.environ.get('ROWS_PER_SHARD', '25000'))
+MAX_INSTANCES = int(os.environ.get('MAX_PROCESSING_INSTANCES', '10'))
+PROCESSING_BACKEND = os.environ.get('PROCESSING_BACKEND', 'sagemaker')
+BACKENDS = ('sagemaker', 'worker')
+# Most documents DBSCAN clusters; beyond that the processing script clusters
+# a stratified sample and assigns the rest to the nearest cluster
+CLUSTER_SAMPLE_SIZE = int(os.environ.get('CLUSTER_SAMPLE_SIZE', '50000'))
+PROCESSING_INPUT_MODE = os.environ.get('PROCESSING_INPUT_MODE', 'File')
+INPUT_MODES = ('Pipe', 'File')
+# Chosen per job by start_query; 'lexical' is hashed TF-IDF reduced by SVD
+FEATURIZERS = ('transformer', 'lexical')
+# Also per job: 'question' clusters each comment column on its own
+CLUSTER_BY = ('row', 'question')
+
+# (most rows per instance, instance type), smallest first
+INSTANCE_TYPES = (
+    (5000, 'ml.m5.large'),
+    (15000, 'ml.c5.xlarge'),
+    (None, 'ml.c5.2xlarge'),
+)
+# Clustering holds all embeddings and their neighbourhoods in memory
+MERGE_INSTANCE_TYPES = (
+    (100000, 'ml.m5.2xlarge'),
+    (None, 'ml.r5.4xlarge'),
+)
+
+MIN_VOLUME_GB = 10
+MAX_VOLUME_GB = 200
+# Input, the written results and scratch space, relative to the input size;
+# a streamed input takes no space
+VOLUME_INPUT_MULTIPLE = 4
+# 384 float32 dimensions per row, plus the row itself
+EMBEDDING_BYTES_PER_ROW = 384 * 4
+
+
+def instance_type_for(rows, tiers=INSTANCE_TYPES):
+    for most_rows, instance_type in tiers:
+        if most_rows is None or rows <= most_rows:
+            return instance_type
+
+
+def volume_size_gb(input_bytes, input_mode='File'):
+    multiple = VOLUME_INPUT_MULTIPLE - 1 if input_mode == 'Pipe' else VOLUME_INPUT_MULTIPLE
+    needed = math.ceil(input_bytes * multiple / 1024 ** 3)
+    return min(MAX_VOLUME_GB, max(MIN_VOLUME_GB, MIN_VOLUME_GB + needed))
+
+
+def plan_processing(row_count, input_bytes, shard_count, backend=PROCESSING_BACKEND,
+                    input_mode=PROCESSING_INPUT_MODE, featurizer='transformer', cluster_by='row'):
+    """Instance type, count and volume for the job's processing.
+
+    shard_count is the number of shard objects the input was split into;
+    each embedding instance takes one or more whole shards. The merge step
+    always reads files: it loads the embeddings the embed step saved.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown processing backend {backend}")
+    if input_mode not in INPUT_MODES:
+        raise ValueError(f"Unknown processing input mode {input_mode}")
+    if featurizer not in FEATURIZERS:
+        raise ValueError(f"Unknown featurizer {featurizer}")
+    if cluster_by not in CLUSTER_BY:
+        raise ValueError(f"Unknown clustering unit {cluster_by}")
+    if shard_count <= 1:
+        return {
+            'backend': backend,
+            'sharded': False,
+            'shards': shard_count,
+            'instance_type': instance_type_for(row_count),
+            'instance_count': 1,
+            'input_mode': input_mode,
+            'volume_size_gb': volume_size_gb(input_bytes, input_mode),
+            'cluster_sample_size': CLUSTER_SAMPLE_SIZE,
+            'featurizer': featurizer,
+            'cluster_by': cluster_by
+        }
+
+    instance_count = min(shard_count, MAX_INSTANCES)
+    shards_per_instance = math.ceil(shard_count / instance_count)
+    rows_per_instance = math.ceil(row_count / shard_count) * shards_per_instance
+    return {
+        'backend': 'sagemaker',
+        'sharded': True,
+        'shards': shard_count,
+        'instance_type': instance_type_for(rows_per_instance),
+        'instance_count': instance_count,
+        'input_mode': input_mode,
+        'volume_size_gb': volume_size_gb(input_bytes * shards_per_instance / shard_count, input_mode),
+        'merge_instance_type': instance_type_for(row_count, MERGE_INSTANCE_TYPES),
+        'merge_volume_size_gb': volume_size_gb(input_bytes + row_count * EMBEDDING_BYTES_PER_ROW),
+        'cluster_sample_size': CLUSTER_SAMPLE_SIZE,
+        'featurizer': featurizer,
+        'cluster_by': cluster_by
+    }
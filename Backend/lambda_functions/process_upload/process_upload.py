@@ -1,40 +1,57 @@
-import boto3
 import json
 import os
+from datasets import DATASETS_PREFIX
+from multipart_upload import find_upload_key, plan_parts, list_uploaded_parts, missing_parts
+from aws_clients import get_client
 
-s3_client = boto3.client('s3')
+s3_client = get_client('s3')
+
+# Signed URLs per response; larger uploads are fetched page by page with
+# firstPartNumber so the response stays well under the Lambda payload limit
+MAX_URLS_PER_RESPONSE = 1000
 
 def lambda_handler(event, context):
     try:
         body = json.loads(event['body'])
         upload_id = body['uploadId']
-        parts = body['parts']  # List of part numbers
 
-        # Hard-coded file name from environment variable
-        file_name = os.environ.get('FILE_NAME', 'survey.csv')
+        # The key initiate_upload chose (dataset version, file name and
+        # compression extension) is looked up from the upload id
         bucket_name = os.environ['BUCKET_NAME']
-        key = f'raw/{file_name}'
-
-        # Generate pre-signed URLs for each part
-        presigned_urls = []
-        for part_number in parts:
-            presigned_url = s3_client.generate_presigned_url(
-                'upload_part',
-                Params={
-                    'Bucket': bucket_name,
-                    'Key': key,
-                    'UploadId': upload_id,
-                    'PartNumber': part_number,
-                },
-                ExpiresIn=3600  # URL valid for 1 hour
+        key = find_upload_key(s3_client, bucket_name, upload_id, DATASETS_PREFIX)
+        if key is None:
+            raise ValueError("uploadId does not match an upload in progress")
+
+        if 'fileSize' in body:
+            result = plan_upload(
+                bucket_name, key, upload_id,
+                file_size=body['fileSize'],
+                resume=body.get('resume', False),
+                first_part_number=body.get('firstPartNumber', 1)
             )
-            presigned_urls.append({'partNumber': part_number, 'url': presigned_url})
+        else:
+            # Client-chosen part numbers
+            parts = body['parts']  # List of part numbers
+            result = {'presignedUrls': [
+                {'partNumber': part_number, 'url': sign_part(bucket_name, key, upload_id, part_number)}
+                for part_number in parts
+            ]}
 
         return {
             "statusCode": 200,
-            "body": json.dumps({"presignedUrls": presigned_urls}),
+            "body": json.dumps(result),
+            "headers": {
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "POST",
+            "Access-Control-Allow-Headers": "Content-Type"
+            }
+        }
+    except ValueError as e:
+        return {
+            "statusCode": 400,
+            "body": json.dumps({"error": str(e)}),
             "headers": {
-            "Access-Control-Allow-Origin": "*", 
+            "Access-Control-Allow-Origin": "*",
             "Access-Control-Allow-Methods": "POST",
             "Access-Control-Allow-Headers": "Content-Type"
             }
@@ -44,8 +61,57 @@ def lambda_handler(event, context):
             "statusCode": 500,
             "body": json.dumps({"error": str(e)}),
             "headers": {
-            "Access-Control-Allow-Origin": "*", 
+            "Access-Control-Allow-Origin": "*",
             "Access-Control-Allow-Methods": "POST",
             "Access-Control-Allow-Headers": "Content-Type"
             }
         }
+
+
+def plan_upload(bucket_name, key, upload_id, file_size, resume, first_part_number):
+    """Part layout for the file plus a signed URL for every part still to upload.
+
+    With resume, parts S3 already holds are reported in uploadedParts and not
+    signed again, so an interrupted upload continues where it stopped.
+    """
+    plan = plan_parts(file_size)
+
+    uploaded = list_uploaded_parts(s3_client, bucket_name, key, upload_id) if resume else {}
+    pending = [part for part in missing_parts(plan, uploaded) if part['partNumber'] >= first_part_number]
+    page = pending[:MAX_URLS_PER_RESPONSE]
+
+    presigned_urls = []
+    for part in page:
+        presigned_urls.append({
+            'partNumber': part['partNumber'],
+            'offset': part['offset'],
+            'size': part['size'],
+            'url': sign_part(bucket_name, key, upload_id, part['partNumber'])
+        })
+
+    return {
+        'uploadId': upload_id,
+        'fileSize': plan['fileSize'],
+        'partSize': plan['partSize'],
+        'partCount': plan['partCount'],
+        'uploadedParts': sorted(
+            number for number, part in uploaded.items()
+            if number <= plan['partCount'] and part['Size'] == plan['parts'][number - 1]['size']
+        ),
+        'presignedUrls': presigned_urls,
+        # Part number to pass as firstPartNumber for the next page, if any
+        'nextPartNumber': pending[len(page)]['partNumber'] if len(pending) > len(page) else None
+    }
+
+
+def sign_part(bucket_name, key, upload_id, part_number):
+    return s3_client.generate_presigned_url(
+        'upload_part',
+        Params={
+            'Bucket': bucket_name,
+            'Key': key,
+            'UploadId': upload_id,
+            'PartNumber': part_number,
+        },
+        ExpiresIn=3600  # URL valid for 1 hour
+    )
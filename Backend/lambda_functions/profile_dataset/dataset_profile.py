@@ -0,0 +1,176 @@
+import codecs
+import csv
+import zlib
+from collections import Counter
+
+# Single streaming pass over an uploaded survey CSV: checks the header against
+# the Glue schema and collects the statistics written to the dataset manifest.
+# Memory use is bounded by one chunk plus the capped distinct-value counters.
+
+# Filter columns with more distinct values than this are not enumerated
+MAX_DISTINCT_VALUES = 1000
+
+
+def processed_column_name(column):
+    # Same normalisation FeedbackSurveyStateMachineStack applies for Glue
+    return column.strip().lower().replace(" ", "_").replace(":", "_")
+
+
+def iter_decompressed(chunks, compression=None):
+    """Decompress a stream of byte chunks; compression is None, 'gzip' or 'zstd'.
+
+    Codec errors are raised as ValueError so a corrupt upload is reported in
+    the manifest like any other invalid file.
+    """
+    if compression is None:
+        yield from chunks
+    elif compression == 'gzip':
+        yield from _iter_gunzipped(chunks)
+    elif compression == 'zstd':
+        yield from _iter_unzstd(chunks)
+    else:
+        raise ValueError(f"Unsupported compression {compression!r}")
+
+
+def _iter_gunzipped(chunks):
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    in_member = False
+    try:
+        for chunk in chunks:
+            while chunk:
+                in_member = True
+                yield decompressor.decompress(chunk)
+                if not decompressor.eof:
+                    break
+                # gzip allows several members back to back (e.g. pigz, cat)
+                chunk = decompressor.unused_data
+                decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                in_member = False
+        yield decompressor.flush()
+    except zlib.error as e:
+        raise ValueError(f"The file is not valid gzip: {e}")
+    if in_member:
+        raise ValueError("The gzip stream is truncated")
+
+
+def _iter_unzstd(chunks):
+    # Not in the Lambda runtime; shipped in the zstd layer
+    import zstandard
+    decompressor = zstandard.ZstdDecompressor().decompressobj(read_across_frames=True)
+    try:
+        for chunk in chunks:
+            yield decompressor.decompress(chunk)
+    except zstandard.ZstdError as e:
+        raise ValueError(f"The file is not valid zstd: {e}")
+
+
+def iter_lines(chunks, encoding='utf-8-sig'):
+    """Turn a stream of byte chunks into text lines, whatever the chunk boundaries."""
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    pending = ''
+    for chunk in chunks:
+        pieces = (pending + decoder.decode(chunk)).split('\n')
+        pending = pieces.pop()
+        for piece in pieces:
+            yield piece + '\n'
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+def profile_csv(lines, expected_headers, max_distinct_values=MAX_DISTINCT_VALUES):
+    """Validate and profile CSV lines; returns the manifest statistics."""
+    expected = [processed_column_name(column) for column in expected_headers]
+    comment_columns = [column for column in expected if column.startswith('comment_')]
+    filter_columns = [column for column in expected if not column.startswith('comment_') and column != 'id']
+
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    errors = []
+    if header is None:
+        return {
+            'valid': False,
+            'errors': ['The file is empty'],
+            'header': [],
+            'row_count': 0
+        }
+
+    found = [processed_column_name(column) for column in header]
+    if found != expected:
+        missing = [column for column in expected if column not in found]
+        unexpected = [column for column in found if column not in expected]
+        errors.append(
+            f"Header does not match the Glue schema (missing: {missing}, unexpected: {unexpected}, "
+            f"expected {len(expected)} columns in order, found {len(found)})"
+        )
+
+    positions = {column: index for index, column in enumerate(found)}
+    comment_positions = [(column, positions[column]) for column in comment_columns if column in positions]
+    filter_positions = [(column, positions[column]) for column in filter_columns if column in positions]
+
+    row_count = 0
+    malformed_rows = 0
+    empty_comments = Counter()
+    value_counts = {column: Counter() for column, _ in filter_positions}
+    overflowed = set()
+
+    for row in reader:
+        if not row:
+            continue
+        row_count += 1
+        if len(row) != len(found):
+            malformed_rows += 1
+            continue
+        for column, index in comment_positions:
+            if not row[index].strip():
+                empty_comments[column] += 1
+        for column, index in filter_positions:
+            if column in overflowed:
+                continue
+            counts = value_counts[column]
+            counts[row[index]] += 1
+            if len(counts) > max_distinct_values:
+                # High-cardinality column: stop tracking it to bound memory
+                overflowed.add(column)
+                counts.clear()
+
+    if row_count == 0:
+        errors.append('The file has a header but no data rows')
+    if malformed_rows:
+        errors.append(f"{malformed_rows} rows do not have {len(found)} fields")
+
+    well_formed = row_count - malformed_rows
+    return {
+        'valid': not errors,
+        'errors': errors,
+        'header': found,
+        'row_count': row_count,
+        'malformed_rows': malformed_rows,
+        'comment_null_rates': {
+            column: (empty_comments[column] / well_formed if well_formed else None)
+            for column, _ in comment_positions
+        },
+        'filter_values': {
+            column: {
+                'truncated': column in overflowed,
+                'values': [] if column in overflowed else sorted(value_counts[column]),
+                'row_counts': {} if column in overflowed else dict(value_counts[column])
+            }
+            for column, _ in filter_positions
+        }
+    }
+
+
+def filter_value_index(profile, dataset_version):
+    """Distinct values with row counts per filter column, served by /filter-values."""
+    return {
+        'dataset_version': dataset_version,
+        'row_count': profile['row_count'] - profile['malformed_rows'],
+        'columns': {
+            column: {
+                'truncated': details['truncated'],
+                'values': [{'value': value, 'rows': details['row_counts'][value]} for value in details['values']]
+            }
+            for column, details in profile['filter_values'].items()
+        }
+    }
@@ -0,0 +1,116 @@
+import json
+import os
+from datetime import datetime, timezone
+from botocore.exceptions import ClientError
+from dataset_profile import filter_value_index, iter_decompressed, iter_lines, profile_csv
+from datasets import (activate_version, compression_for_key, dataset_object_key, filter_index_key, manifest_key,
+                      new_dataset_version, read_active_version)
+from aws_clients import get_client
+
+bucket = os.environ['BUCKET_NAME']
+file_name = os.environ.get('FILE_NAME', 'survey.csv')
+# Where uploads were stored before dataset versions
+LEGACY_KEY = f"raw/{file_name}"
+EXPECTED_HEADERS = json.loads(os.environ['EXPECTED_HEADERS'])
+# Bytes fetched per ranged GET; bounds the memory used by the pass
+CHUNK_SIZE = int(os.environ.get('PROFILE_CHUNK_SIZE', str(8 * 1024 * 1024)))
+
+s3_client = get_client('s3')
+
+def lambda_handler(event, context):
+    """Validate and profile an uploaded dataset, write its manifest and activate it.
+
+    Invoked asynchronously by complete_upload with the uploaded object's key
+    and dataset version. An invalid upload is never activated, so queries keep
+    reading the previous version.
+
+    With {"bootstrap": true} (sent once on deploy) a dataset uploaded before
+    dataset versions is registered instead, see bootstrap_legacy_dataset.
+    """
+    if event.get('bootstrap'):
+        return bootstrap_legacy_dataset()
+    return profile_and_activate(event['key'], event['dataset_version'])
+
+
+def bootstrap_legacy_dataset():
+    """Register the object at LEGACY_KEY as the first dataset version.
+
+    Deployments from before dataset versions keep their data there and have
+    no active pointer, so every query would be refused until a re-upload.
+    Nothing happens once a version is active or if there is no legacy object.
+    """
+    if read_active_version(s3_client, bucket):
+        print("A dataset version is already active; nothing to bootstrap")
+        return {'statusCode': 200, 'bootstrapped': False}
+    try:
+        s3_client.head_object(Bucket=bucket, Key=LEGACY_KEY)
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+            raise
+        print(f"No legacy dataset at s3://{bucket}/{LEGACY_KEY}; nothing to bootstrap")
+        return {'statusCode': 200, 'bootstrapped': False}
+
+    # Copied, not moved, so the original stays as it was
+    dataset_version = new_dataset_version()
+    key = dataset_object_key(dataset_version, file_name)
+    s3_client.copy({'Bucket': bucket, 'Key': LEGACY_KEY}, bucket, key)
+    print(f"Copied s3://{bucket}/{LEGACY_KEY} to {key}")
+    return dict(profile_and_activate(key, dataset_version), bootstrapped=True)
+
+
+def profile_and_activate(key, dataset_version):
+    head = s3_client.head_object(Bucket=bucket, Key=key)
+
+    # Compressed uploads are decompressed on the fly; ranged GETs still
+    # fetch the stored (compressed) bytes
+    compression = compression_for_key(key)
+    chunks = iter_decompressed(iter_object_chunks(key, head['ContentLength']), compression)
+    try:
+        profile = profile_csv(iter_lines(chunks), EXPECTED_HEADERS)
+    except ValueError as e:
+        profile = {'valid': False, 'errors': [str(e)], 'header': [], 'row_count': 0}
+    print(f"Profiled s3://{bucket}/{key}: {profile['row_count']} rows, valid={profile['valid']}, errors={profile['errors']}")
+
+    manifest = dict(
+        profile,
+        bucket=bucket,
+        key=key,
+        dataset_version=dataset_version,
+        compression=compression,
+        etag=head['ETag'],
+        size=head['ContentLength'],
+        profiled_at=datetime.now(timezone.utc).isoformat()
+    )
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=manifest_key(dataset_version),
+        Body=json.dumps(manifest).encode('utf-8'),
+        ContentType='application/json'
+    )
+
+    # The manifest and filter value index are written first so the active
+    # pointer never names a version without them
+    if profile['valid']:
+        s3_client.put_object(
+            Bucket=bucket,
+            Key=filter_index_key(dataset_version),
+            Body=json.dumps(filter_value_index(profile, dataset_version)).encode('utf-8'),
+            ContentType='application/json'
+        )
+        activate_version(s3_client, bucket, dataset_version)
+        print(f"Activated dataset version {dataset_version}")
+
+    return {
+        'statusCode': 200,
+        'valid': profile['valid'],
+        'dataset_version': dataset_version,
+        'manifest_key': manifest_key(dataset_version)
+    }
+
+
+def iter_object_chunks(key, size):
+    # Ranged GETs keep a single request from holding the whole object
+    for start in range(0, size, CHUNK_SIZE):
+        end = min(start + CHUNK_SIZE, size) - 1
+        response = s3_client.get_object(Bucket=bucket, Key=key, Range=f'bytes={start}-{end}')
+        yield response['Body'].read()
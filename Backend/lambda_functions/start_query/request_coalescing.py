@@ -0,0 +1,35 @@
+import hashlib
+import json
+
+
+def normalize_query(query):
+    # Case, whitespace and trailing punctuation do not change the question
+    text = " ".join((query or "").split()).casefold()
+    return text.rstrip("?.! ")
+
+
+def normalize_filters(filters):
+    # Filters arrive as a list of {category: value | [values]} conditions that
+    # generate_sql_query ANDs together, so the order of conditions and of the
+    # values inside an IN list does not matter, and 'x' is the same as ['x']
+    conditions = []
+    for filter_category in filters or []:
+        for category, values in filter_category.items():
+            if not isinstance(values, list):
+                values = [values]
+            conditions.append([str(category).lower(), sorted({str(v) for v in values})])
+    return sorted(conditions)
+
+
+def canonical_request_key(query, filters, dataset_version=None, featurizer="transformer", cluster_by="row"):
+    """Stable hash identifying requests that would produce the same job."""
+    canonical = {
+        "query": normalize_query(query),
+        "filters": normalize_filters(filters),
+        # A new dataset version answers the same question differently
+        "dataset_version": dataset_version,
+        "featurizer": featurizer,
+        "cluster_by": cluster_by,
+    }
+    payload = json.dumps(canonical, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
@@ -1,18 +1,54 @@
 import json
-import boto3
 import uuid
-from botocore.exceptions import ClientError
 import os
+import time
+from botocore.exceptions import ClientError
+from request_coalescing import canonical_request_key
+from job_registry import get_job_registry
+from datasets import cached_active_version, load_filter_index
+from aws_clients import get_client
+from tracing import Tracer
 
 step_function = os.environ['STEP_FUNCTION_ARN']
-bedrock_client = boto3.client('bedrock-runtime', region_name='us-east-1')
+inflight_jobs_table = os.environ['INFLIGHT_JOBS_TABLE']
+bucket_name = os.environ['BUCKET_NAME']
+# How long a finished or abandoned job keeps its request key reserved
+COALESCE_WINDOW_SECONDS = int(os.environ.get('COALESCE_WINDOW_SECONDS', '1800'))
+# An entry younger than this may belong to an execution that is still starting
+START_GRACE_SECONDS = 60
+# How the processing job turns comments into vectors: sentence-transformer
+# embeddings, or hashed TF-IDF reduced by SVD for quick exploratory queries
+FEATURIZERS = ('transformer', 'lexical')
+# Whether each row's comments are clustered together, or each question's
+# answers on their own
+CLUSTER_BY = ('row', 'question')
+
+dynamodb = get_client('dynamodb')
+s3 = get_client('s3')
+stepfunctions = get_client('stepfunctions')
+registry = get_job_registry()
+tracer = Tracer('start_query')
 
+@tracer.handler('start_query')
 def lambda_handler(event, context):
-    stepfunctions = boto3.client('stepfunctions')
     body = json.loads(event.get('body', '{}'))
     query = body.get('query')
     
     filters = body.get('filters')
+    featurizer = body.get('featurizer') or 'transformer'
+    cluster_by = body.get('cluster_by') or 'row'
+    if featurizer not in FEATURIZERS or cluster_by not in CLUSTER_BY:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'error': f"featurizer must be one of {', '.join(FEATURIZERS)} "
+                                         f"and cluster_by one of {', '.join(CLUSTER_BY)}"}),
+            "headers": {
+                "Access-Control-Allow-Origin": "*", 
+                "Access-Control-Allow-Methods": "POST",
+                "Access-Control-Allow-Headers": "Content-Type",
+                'Content-Type': 'application/json'
+            }
+        }
     
     # return{
     #     "event":event,
@@ -30,57 +66,31 @@ def lambda_handler(event, context):
     #         }
     #     }
     
-    # Generate a unique job ID
-    job_id = str(uuid.uuid4())
-    validation_prompt = (
-        f"The user query is: '{query}'. We are building a Q&A bot to analyze feedback from the Hospital Employee Data survey. "
-        "The survey contains multiple columns discussing various aspects of employees, such as sex, gender, employee ID, name, location, "
-        "ethnicity, comments, views, sentiments, departments, centers of excellence (COE), COE level departments, tenure bands. "
-        "A query is valid if it relates to any of these demographics or survey data points, such as analyzing feedback, employee sentiments, "
-        "or identifying trends and insights based on the survey results. This includes queries that focus on specific locations or other demographics."
-        
-        "Valid queries are those that ask for analysis of feedback, employee sentiment (positive or negative), key trends, or insights from the survey data. "
-        "Even if phrased differently, queries that seek information about feedback or analysis related to specific locations or demographics should be considered valid. "
-        "For instance, 'What is the feedback from employees in a certain location?', 'Can you provide overall feedback?', or 'What are the most common comments?' are all valid."
-    
-        "Examples of valid queries include: "
-        "'What are the top insights from the survey?', 'What are the major areas of positive feedback?', "
-        "'What is the overall employee sentiment?', or 'What are the most common negative comments?'. "
-        "Queries related to feedback for specific locations or groups are also valid."
-    
-        "Invalid queries are those unrelated to the survey's demographics or feedback data. This includes questions that ask about "
-        "topics outside the survey, such as external statistics or company policies. For example, queries like 'What is the weather today?' "
-        "or 'What is the company's financial performance?' would be considered invalid."
-    
-        "To summarize: If the query asks for feedback, insights, or analysis related to the survey data, respond with 'Valid'. "
-        "If it asks for unrelated information, respond with 'Invalid'. The response must be a single word: 'Valid' or 'Invalid'."
-    )
-    # validation_prompt = (
-    #     f"The user query is: '{query}'. This bot analyzes feedback from the Hospital Employee Data survey. "
-    #     "Valid queries ask for information related to employee feedback, sentiments, trends, or insights from the survey data, "
-    #     "including demographics like sex, gender, location, departments, and tenure."
-        
-    #     "Examples of valid queries include: 'What is the employee feedback?', 'What are the top insights?', "
-    #     "'What are the major areas of positive feedback?', or 'What is the overall sentiment?' "
-    #     "Questions about specific demographics, such as feedback for certain locations or departments, are also valid."
-    
-    #     "Invalid queries are those unrelated to the survey, such as questions about external data or topics like the weather or financial performance."
-        
-    #     "If the query is about feedback, insights, or analysis related to the survey, respond with 'Valid'. "
-    #     "If it asks for unrelated information, respond with 'Invalid'. The response must be a single word: 'Valid' or 'Invalid'."
-    # )
-
-
-    print(validation_prompt)
-    # Invoke the Bedrock model to validate the query
-    validation_result = invoke_bedrock_model(validation_prompt, model_id="anthropic.claude-3-5-sonnet-20240620-v1:0")
-    print("In the result :",validation_result)
+    # Each job is pinned to the dataset version active when it starts, so an
+    # upload that activates a new version never changes data under it
+    dataset_version = cached_active_version(s3, bucket_name)
+    if not dataset_version:
+        return {
+            'statusCode': 409,
+            'body': json.dumps({'error': 'No dataset has been uploaded and validated yet'}),
+            "headers": {
+                "Access-Control-Allow-Origin": "*", 
+                "Access-Control-Allow-Methods": "POST",
+                "Access-Control-Allow-Headers": "Content-Type",
+                'Content-Type': 'application/json'
+            }
+        }
 
-    # If the query is invalid, return an error response
-    if validation_result == "Invalid":
+    # Filters the value index shows match no rows are rejected here instead
+    # of after a full Athena scan
+    empty_filters = filters_without_rows(dataset_version, filters)
+    if empty_filters:
         return {
             'statusCode': 400,
-            'body': json.dumps({'error': 'Invalid query. Please ask about the survey.'}),
+            'body': json.dumps({
+                'error': 'The filters you selected have no data. Please select different filters to get insights.',
+                'emptyFilters': empty_filters
+            }),
             "headers": {
                 "Access-Control-Allow-Origin": "*", 
                 "Access-Control-Allow-Methods": "POST",
@@ -88,14 +98,68 @@ def lambda_handler(event, context):
                 'Content-Type': 'application/json'
             }
         }
-    
+
+    # Identical requests share one execution while it is in flight
+    request_key = canonical_request_key(query, filters, dataset_version, featurizer, cluster_by)
+    try:
+        job_id, coalesced = reserve_job(stepfunctions, request_key)
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'error': str(e)}),
+            "headers": {
+                "Access-Control-Allow-Origin": "*", 
+                "Access-Control-Allow-Methods": "POST",
+                "Access-Control-Allow-Headers": "Content-Type",
+                'Content-Type': 'application/json'
+            }
+        }
+
+    # The job's trace starts here; its id is derived from the job id
+    span = tracer.current_span()
+    span.set_job_id(job_id)
+    span.set(coalesced=coalesced, dataset_version=dataset_version)
+
+    execution_arn = f"{step_function.replace('stateMachine', 'execution')}:processing-job-{job_id}"
+    if coalesced:
+        print(f"Attached request {request_key} to in-flight job {job_id}")
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'job_id': job_id,
+                'execution_arn': execution_arn,
+                'coalesced': True
+            }),
+            "headers":{
+                    "Access-Control-Allow-Origin": "*", 
+                    "Access-Control-Allow-Methods": "POST",
+                    "Access-Control-Allow-Headers": "Content-Type",
+                    'Content-Type': 'application/json'
+            }
+        }
+
+    # Query validation runs inside the state machine, in parallel with the
+    # Athena filtering, so the job id is returned without waiting on it
+
     # Define the input for the Step Function
     input_data = {
+        "job_id": job_id,
         "query": query,
-        "filters": filters
+        "filters": filters,
+        "dataset_version": dataset_version,
+        "featurizer": featurizer,
+        "cluster_by": cluster_by,
+        # Parent span for the state machine's tasks and the processing job
+        "traceparent": span.traceparent()
         # "object_name": object_name
     }
     
+    # Recorded before the execution starts, so process_query's stages are
+    # never overwritten by it and cancel_query can find a running job's
+    # execution and the request key the other requests share it under
+    registry.update_stage(job_id, 'SUBMITTED', execution_arn=execution_arn, dataset_version=dataset_version,
+                          request_key=request_key)
+
     # Start Step Function execution
     try:
         response = stepfunctions.start_execution(
@@ -104,6 +168,8 @@ def lambda_handler(event, context):
             input=json.dumps(input_data)
         )
     except Exception as e:
+        release_job(request_key, job_id)
+        registry.record_result(job_id, 'FAILED', error='StartExecutionFailed', cause=str(e))
         return {
             'statusCode': 500,
             'body': json.dumps({'error': str(e)}),
@@ -114,7 +180,7 @@ def lambda_handler(event, context):
                 'Content-Type': 'application/json'
             }
         }
-    
+
     # Return the job ID to the frontend
     return {
         'statusCode': 200,
@@ -130,23 +196,113 @@ def lambda_handler(event, context):
         }
     }
 
-def invoke_bedrock_model(prompt, model_id):
-    native_request = {
-        "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 4000,
-        "temperature": 0.5,
-        "messages": [
-            {
-                "role": "user",
-                "content": [{"type": "text", "text": prompt}],
-            }
-        ],
-    }
-    request = json.dumps(native_request)
+
+def filters_without_rows(dataset_version, filters):
+    """Filter categories none of whose requested values occur in the dataset.
+
+    Only columns fully enumerated by the version's index are checked; an AND
+    of individually non-empty conditions can still match nothing, which
+    process_query reports as before.
+    """
     try:
-        response = bedrock_client.invoke_model(modelId=model_id, body=request)
-        model_response = json.loads(response["body"].read())
-        response_text = model_response["content"][0]["text"]
-        return response_text.strip()
-    except (ClientError, Exception) as e:
-        raise Exception(f"ERROR: Can't invoke '{model_id}'. Reason: {e}")
+        columns = load_filter_index(s3, bucket_name, dataset_version)['columns']
+    except s3.exceptions.NoSuchKey:
+        return []
+    empty = []
+    for filter_category in filters or []:
+        for category, values in filter_category.items():
+            column = columns.get(str(category).lower())
+            if column is None or column['truncated']:
+                continue
+            known = {entry['value'] for entry in column['values']}
+            if not isinstance(values, list):
+                values = [values]
+            if not any(str(value) in known for value in values):
+                empty.append(category)
+    return empty
+
+
+def reserve_job(stepfunctions, request_key, attempts=3):
+    """Return (job_id, coalesced) for the request key.
+
+    Claims the key with a fresh job id, or attaches to the job that already
+    holds it if that execution is still running.
+    """
+    for _ in range(attempts):
+        now = int(time.time())
+        job_id = str(uuid.uuid4())
+        try:
+            dynamodb.put_item(
+                TableName=inflight_jobs_table,
+                Item={
+                    'request_key': {'S': request_key},
+                    'job_id': {'S': job_id},
+                    'subscribers': {'N': '1'},
+                    'created_at': {'N': str(now)},
+                    'expires_at': {'N': str(now + COALESCE_WINDOW_SECONDS)}
+                },
+                ConditionExpression='attribute_not_exists(request_key) OR expires_at < :now',
+                ExpressionAttributeValues={':now': {'N': str(now)}}
+            )
+            return job_id, False
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+        existing = dynamodb.get_item(
+            TableName=inflight_jobs_table,
+            Key={'request_key': {'S': request_key}},
+            ConsistentRead=True
+        ).get('Item')
+        if not existing:
+            continue
+        existing_job_id = existing['job_id']['S']
+
+        if job_is_in_flight(stepfunctions, existing_job_id, int(existing['created_at']['N']), now):
+            dynamodb.update_item(
+                TableName=inflight_jobs_table,
+                Key={'request_key': {'S': request_key}},
+                UpdateExpression='ADD subscribers :one',
+                ExpressionAttributeValues={':one': {'N': '1'}}
+            )
+            return existing_job_id, True
+
+        # The previous job has finished; expire its entry so the next attempt
+        # can claim the key. The condition keeps concurrent callers from
+        # expiring an entry somebody else has just claimed.
+        try:
+            dynamodb.update_item(
+                TableName=inflight_jobs_table,
+                Key={'request_key': {'S': request_key}},
+                UpdateExpression='SET expires_at = :zero',
+                ConditionExpression='job_id = :job_id',
+                ExpressionAttributeValues={':zero': {'N': '0'}, ':job_id': {'S': existing_job_id}}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+    raise Exception(f"Could not reserve a job for request {request_key}")
+
+
+def job_is_in_flight(stepfunctions, job_id, created_at, now):
+    execution_arn = f"{step_function.replace('stateMachine', 'execution')}:processing-job-{job_id}"
+    try:
+        response = stepfunctions.describe_execution(executionArn=execution_arn)
+    except stepfunctions.exceptions.ExecutionDoesNotExist:
+        # The owner has reserved the key but not started the execution yet
+        return now - created_at < START_GRACE_SECONDS
+    return response['status'] == 'RUNNING'
+
+
+def release_job(request_key, job_id):
+    # Give the key back if the execution could not be started
+    try:
+        dynamodb.delete_item(
+            TableName=inflight_jobs_table,
+            Key={'request_key': {'S': request_key}},
+            ConditionExpression='job_id = :job_id',
+            ExpressionAttributeValues={':job_id': {'S': job_id}}
+        )
+    except ClientError as e:
+        print(f"Could not release request key {request_key}: {e}")
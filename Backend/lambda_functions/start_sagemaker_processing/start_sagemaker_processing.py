@@ -1,9 +1,10 @@
-import boto3
 import os
 import json
+from aws_clients import get_client
+
+sagemaker_client = get_client('sagemaker')
 
 def lambda_handler(event, context):
-    sagemaker_client = boto3.client('sagemaker')
     job_id = event.get('job_id')
     objectName = event.get('object_name')
 
@@ -0,0 +1,72 @@
+import re
+
+# Local first tier of query validation. Clear-cut queries are decided here in
+# microseconds; only queries that match neither (or both) vocabularies are
+# escalated to the Bedrock validator.
+
+VALID = "Valid"
+INVALID = "Invalid"
+
+# Vocabulary specific to the survey. Everyday words (pay, team, stay, issues)
+# also appear in off-topic questions, so they are left to the Bedrock validator.
+SURVEY_TERMS = re.compile(
+    r"\b("
+    r"feedback|comments?|survey|responses?|respondents?|"
+    r"sentiments?|insights?|themes?|"
+    r"employees?|staff|workforce|nurs(?:e|es|ing)|colleagues?|"
+    r"burn ?out|burning out|well-?being|morale|engagement|employee satisfaction|job satisfaction|"
+    r"retention|turnover|attrition|reasons? to (?:stay|leave)|"
+    r"tenure|tenure bands?|ethnicity|demographics?|"
+    r"departments?|job famil(?:y|ies)|coe|centers? of excellence|magnet"
+    r")\b",
+    re.IGNORECASE,
+)
+
+# Topics the bot cannot answer from the survey data
+OFF_TOPIC_TERMS = re.compile(
+    r"\b("
+    r"weather|forecast|temperature outside|stock|stocks|share price|crypto|bitcoin|"
+    r"revenue|profit|financial performance|earnings|quarterly results|"
+    r"recipe|movie|movies|song|lyrics|sports?|football|soccer|basketball|"
+    r"capital of|president|election|news|translate|poem|joke|"
+    r"python|javascript|sql injection|write (?:me )?(?:a|some) code|"
+    r"ignore (?:all |the )?(?:previous|above) instructions|system prompt"
+    r")\b",
+    re.IGNORECASE,
+)
+
+MIN_QUERY_CHARS = 3
+MAX_QUERY_CHARS = 2000
+
+
+def classify_query(query):
+    """Return 'Valid' or 'Invalid' for clear-cut queries, None when ambiguous."""
+    if not isinstance(query, str):
+        return INVALID
+
+    text = " ".join(query.split())
+    if len(text) < MIN_QUERY_CHARS or not re.search(r"[a-zA-Z]", text):
+        return INVALID
+    if len(text) > MAX_QUERY_CHARS:
+        # Very long inputs are unusual enough to deserve the model's judgement
+        return None
+
+    on_topic = SURVEY_TERMS.search(text) is not None
+    off_topic = OFF_TOPIC_TERMS.search(text) is not None
+
+    if on_topic and not off_topic:
+        return VALID
+    if off_topic and not on_topic:
+        return INVALID
+    return None
+
+
+def parse_verdict(response_text):
+    """Normalise the model's one-word answer into 'Valid' or 'Invalid'.
+
+    Anything other than a clear 'Valid' fails closed.
+    """
+    words = (response_text or "").strip().split()
+    if words and words[0].strip(".'\"").capitalize() == VALID:
+        return VALID
+    return INVALID
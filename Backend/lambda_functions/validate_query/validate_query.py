@@ -0,0 +1,90 @@
+import json
+from botocore.exceptions import ClientError
+from query_classifier import classify_query, parse_verdict
+from aws_clients import get_client
+from tracing import Tracer
+
+bedrock_client = get_client('bedrock-runtime', region_name='us-east-1')
+tracer = Tracer('validate_query')
+
+
+class InvalidQueryError(Exception):
+    # Raised so the state machine can stop the parallel filtering branch
+    pass
+
+
+@tracer.handler('validate_query')
+def lambda_handler(event, context):
+    query = event.get('query')
+
+    # Clear-cut queries are decided locally; only ambiguous ones reach the LLM
+    validation_result = classify_query(query)
+    print("Local validation result:", validation_result)
+    tracer.current_span().set(decided_locally=validation_result is not None)
+
+    if validation_result is None:
+        validation_prompt = (
+            f"The user query is: '{query}'. We are building a Q&A bot to analyze feedback from the Hospital Employee Data survey. "
+            "The survey contains multiple columns discussing various aspects of employees, such as sex, gender, employee ID, name, location, "
+            "ethnicity, comments, views, sentiments, departments, centers of excellence (COE), COE level departments, tenure bands. "
+            "A query is valid if it relates to any of these demographics or survey data points, such as analyzing feedback, employee sentiments, "
+            "or identifying trends and insights based on the survey results. This includes queries that focus on specific locations or other demographics."
+        
+            "Valid queries are those that ask for analysis of feedback, employee sentiment (positive or negative), key trends, or insights from the survey data. "
+            "Even if phrased differently, queries that seek information about feedback or analysis related to specific locations or demographics should be considered valid. "
+            "For instance, 'What is the feedback from employees in a certain location?', 'Can you provide overall feedback?', or 'What are the most common comments?' are all valid."
+    
+            "Examples of valid queries include: "
+            "'What are the top insights from the survey?', 'What are the major areas of positive feedback?', "
+            "'What is the overall employee sentiment?', or 'What are the most common negative comments?'. "
+            "Queries related to feedback for specific locations or groups are also valid."
+    
+            "Invalid queries are those unrelated to the survey's demographics or feedback data. This includes questions that ask about "
+            "topics outside the survey, such as external statistics or company policies. For example, queries like 'What is the weather today?' "
+            "or 'What is the company's financial performance?' would be considered invalid."
+    
+            "To summarize: If the query asks for feedback, insights, or analysis related to the survey data, respond with 'Valid'. "
+            "If it asks for unrelated information, respond with 'Invalid'. The response must be a single word: 'Valid' or 'Invalid'."
+        )
+        print(validation_prompt)
+        # A one-word verdict needs only a handful of output tokens
+        validation_response = invoke_bedrock_model(
+            validation_prompt,
+            model_id="anthropic.claude-3-5-sonnet-20240620-v1:0",
+            max_tokens=5,
+            temperature=0
+        )
+        validation_result = parse_verdict(validation_response)
+        print("In the result :",validation_result)
+
+    if validation_result == "Invalid":
+        raise InvalidQueryError("Invalid query. Please ask about the survey.")
+
+    return {
+        'query': query,
+        'validation': validation_result
+    }
+
+def invoke_bedrock_model(prompt, model_id, max_tokens=4000, temperature=0.5):
+    native_request = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "messages": [
+            {
+                "role": "user",
+                "content": [{"type": "text", "text": prompt}],
+            }
+        ],
+    }
+    request = json.dumps(native_request)
+    try:
+        with tracer.span('bedrock.invoke_model', model_id=model_id, max_tokens=native_request['max_tokens']) as span:
+            response = bedrock_client.invoke_model(modelId=model_id, body=request)
+            model_response = json.loads(response["body"].read())
+            usage = model_response.get('usage', {})
+            span.set(input_tokens=usage.get('input_tokens'), output_tokens=usage.get('output_tokens'))
+        response_text = model_response["content"][0]["text"]
+        return response_text.strip()
+    except (ClientError, Exception) as e:
+        raise Exception(f"ERROR: Can't invoke '{model_id}'. Reason: {e}")
@@ -0,0 +1,66 @@
+import os
+import threading
+
+# Shared AWS client factory for the Lambdas.
+#
+# get_client returns one client per (service, region) for the life of the
+# process, so warm invocations reuse its pooled keep-alive connections instead
+# of rebuilding the client (endpoint and credential resolution) and repeating
+# the TLS handshake. Timeouts and retries are explicit rather than botocore's
+# defaults. set_client_factory swaps in stand-ins for tests and local runs.
+
+MAX_POOL_CONNECTIONS = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '20'))
+CONNECT_TIMEOUT_SECONDS = float(os.environ.get('AWS_CONNECT_TIMEOUT_SECONDS', '5'))
+READ_TIMEOUT_SECONDS = float(os.environ.get('AWS_READ_TIMEOUT_SECONDS', '60'))
+MAX_ATTEMPTS = int(os.environ.get('AWS_MAX_ATTEMPTS', '3'))
+
+# Model invocations stream tokens for well over the default read timeout
+READ_TIMEOUT_OVERRIDES = {
+    'bedrock-runtime': 300,
+}
+
+_clients = {}
+_lock = threading.Lock()
+_client_factory = None
+
+
+def client_config(service_name):
+    from botocore.config import Config
+    return Config(
+        max_pool_connections=MAX_POOL_CONNECTIONS,
+        connect_timeout=CONNECT_TIMEOUT_SECONDS,
+        read_timeout=READ_TIMEOUT_OVERRIDES.get(service_name, READ_TIMEOUT_SECONDS),
+        retries={'max_attempts': MAX_ATTEMPTS, 'mode': 'standard'},
+        tcp_keepalive=True
+    )
+
+
+def get_client(service_name, region_name=None):
+    """The process-wide client for service_name, created on first use."""
+    key = (service_name, region_name)
+    client = _clients.get(key)
+    if client is None:
+        # Client creation is not thread-safe in boto3, and is the slow part
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = _create_client(service_name, region_name)
+    return client
+
+
+def set_client_factory(factory):
+    """Build clients with factory(service_name, region_name) instead of boto3.
+
+    Passing None restores boto3. Clients created so far are discarded.
+    """
+    global _client_factory
+    with _lock:
+        _client_factory = factory
+        _clients.clear()
+
+
+def _create_client(service_name, region_name):
+    if _client_factory is not None:
+        return _client_factory(service_name, region_name)
+    import boto3
+    return boto3.client(service_name, region_name=region_name, config=client_config(service_name))
@@ -0,0 +1,133 @@
+import json
+import re
+import time
+import uuid
+from datetime import datetime, timezone
+
+# Every upload lands under its own dataset version. The Glue table projects
+# dataset_version as a partition over these prefixes, and a single pointer
+# object names the active version. New queries pin the version that is active
+# when they start, so replacing the pointer (one atomic S3 PUT) never changes
+# the data under a running job.
+
+ACTIVE_POINTER_KEY = 'datasets/active.json'
+VERSION_PATTERN = re.compile(r'^v\d{8}T\d{6}Z-[0-9a-f]{8}$')
+
+# How long a warm container trusts its copy of the active dataset pointer
+ACTIVE_VERSION_CACHE_SECONDS = 10
+# Filter value indexes never change once written; keep the last few per container
+MAX_CACHED_INDEXES = 4
+
+_active_version = {'value': None, 'fetched_at': 0}
+_filter_indexes = {}
+
+# Compressed uploads are stored as-is under their codec's extension, which is
+# how Athena and pandas pick the decompressor, so nothing converts them
+COMPRESSION_FORMATS = {
+    'gzip': {'extension': '.gz', 'content_type': 'application/gzip'},
+    'zstd': {'extension': '.zst', 'content_type': 'application/zstd'},
+}
+
+
+def new_dataset_version():
+    # Sortable by upload time, unique across concurrent uploads
+    return f"v{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}-{uuid.uuid4().hex[:8]}"
+
+
+def validate_dataset_version(version):
+    # Versions end up in S3 keys and SQL, so only the generated form is accepted
+    if not isinstance(version, str) or not VERSION_PATTERN.match(version):
+        raise ValueError("datasetVersion is missing or malformed")
+    return version
+
+
+def validate_compression(compression):
+    if compression is not None and compression not in COMPRESSION_FORMATS:
+        raise ValueError(f"compression must be one of {sorted(COMPRESSION_FORMATS)}")
+    return compression
+
+
+def dataset_file_name(file_name, compression=None):
+    if validate_compression(compression) is None:
+        return file_name
+    return file_name + COMPRESSION_FORMATS[compression]['extension']
+
+
+def compression_for_key(key):
+    for compression, details in COMPRESSION_FORMATS.items():
+        if key.endswith(details['extension']):
+            return compression
+    return None
+
+
+DATASETS_PREFIX = 'raw/dataset_version='
+
+
+def dataset_prefix(version):
+    return f"{DATASETS_PREFIX}{validate_dataset_version(version)}/"
+
+
+def version_from_key(key):
+    """The dataset version an object key under DATASETS_PREFIX belongs to."""
+    if not key.startswith(DATASETS_PREFIX):
+        raise ValueError("The object is not part of a dataset version")
+    return validate_dataset_version(key[len(DATASETS_PREFIX):].split('/', 1)[0])
+
+
+def dataset_object_key(version, file_name):
+    return f"{dataset_prefix(version)}{file_name}"
+
+
+def manifest_key(version):
+    return f"datasets/{validate_dataset_version(version)}/manifest.json"
+
+
+def filter_index_key(version):
+    return f"datasets/{validate_dataset_version(version)}/filter_values.json"
+
+
+def read_active_version(s3_client, bucket_name):
+    """The active dataset pointer, or None before the first successful upload."""
+    try:
+        response = s3_client.get_object(Bucket=bucket_name, Key=ACTIVE_POINTER_KEY)
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    return json.loads(response['Body'].read())
+
+
+def activate_version(s3_client, bucket_name, version):
+    pointer = {
+        'dataset_version': validate_dataset_version(version),
+        'manifest_key': manifest_key(version),
+        'activated_at': datetime.now(timezone.utc).isoformat()
+    }
+    s3_client.put_object(
+        Bucket=bucket_name,
+        Key=ACTIVE_POINTER_KEY,
+        Body=json.dumps(pointer).encode('utf-8'),
+        ContentType='application/json'
+    )
+    return pointer
+
+
+def cached_active_version(s3_client, bucket_name, max_age_seconds=ACTIVE_VERSION_CACHE_SECONDS):
+    """Active dataset version, re-read from S3 at most every max_age_seconds."""
+    now = time.time()
+    if now - _active_version['fetched_at'] > max_age_seconds:
+        pointer = read_active_version(s3_client, bucket_name)
+        _active_version['value'] = pointer['dataset_version'] if pointer else None
+        _active_version['fetched_at'] = now
+    return _active_version['value']
+
+
+def load_filter_index(s3_client, bucket_name, version):
+    """The filter value index written when the version was profiled.
+
+    Raises s3_client.exceptions.NoSuchKey if the version has no index.
+    """
+    if version not in _filter_indexes:
+        response = s3_client.get_object(Bucket=bucket_name, Key=filter_index_key(version))
+        if len(_filter_indexes) >= MAX_CACHED_INDEXES:
+            _filter_indexes.pop(next(iter(_filter_indexes)))
+        _filter_indexes[version] = json.loads(response['Body'].read())
+    return _filter_indexes[version]
@@ -0,0 +1,184 @@
+import json
+import os
+import time
+
+# Job registry shared by the API Lambdas and the pipeline stages.
+#
+# Every stage records where a job is (its stage) and, once it is done, the
+# terminal status and output. check_status reads from here instead of calling
+# Step Functions on every poll. The in-memory registry is a stand-in with the
+# same behaviour for tests and local runs.
+
+TERMINAL_STATUSES = ('SUCCEEDED', 'FAILED', 'TIMED_OUT', 'ABORTED', 'CANCELLED')
+# A cancelled job keeps that status: stages still finishing when it was
+# cancelled must not record their own result over it
+FINAL_STATUSES = ('CANCELLED',)
+
+# Registry entries are removed by DynamoDB TTL after this long
+JOB_TTL_SECONDS = 7 * 24 * 3600
+
+# Fields stored as JSON documents rather than scalars
+JSON_FIELDS = ('output', 'result_location')
+
+
+class DynamoDBJobRegistry:
+
+    def __init__(self, table_name, client=None):
+        if client is None:
+            from aws_clients import get_client
+            client = get_client('dynamodb')
+        self.table_name = table_name
+        self.client = client
+
+    def get(self, job_id):
+        response = self.client.get_item(
+            TableName=self.table_name,
+            Key={'job_id': {'S': job_id}},
+            ConsistentRead=True
+        )
+        item = response.get('Item')
+        if not item:
+            return None
+        return {name: _from_attribute(name, value) for name, value in item.items()}
+
+    def update_stage(self, job_id, stage, status='RUNNING', **details):
+        """Record a non-terminal transition. Ignored once the job has finished."""
+        fields = dict(details, stage=stage, status=status)
+        self._update(job_id, fields, unless_status=TERMINAL_STATUSES)
+
+    def record_result(self, job_id, status, output=None, error=None, cause=None, result_location=None):
+        """Record the terminal status of a job and its output or failure.
+
+        Large outputs are kept in S3 and recorded as a result_location.
+        """
+        fields = {'status': status}
+        if output is not None:
+            fields['output'] = output
+        if result_location is not None:
+            fields['result_location'] = result_location
+        if error is not None:
+            fields['error'] = error
+        if cause is not None:
+            fields['cause'] = cause
+        self._update(job_id, fields, unless_status=FINAL_STATUSES)
+
+    def cancel(self, job_id, cause):
+        """Record that the job was cancelled; False if it had already finished."""
+        return self._update(job_id, {'status': 'CANCELLED', 'error': 'Cancelled', 'cause': cause},
+                            unless_status=TERMINAL_STATUSES)
+
+    def _update(self, job_id, fields, unless_status):
+        now = int(time.time())
+        fields = dict(fields, updated_at=now)
+        if 'expires_at' not in fields:
+            fields['expires_at'] = now + JOB_TTL_SECONDS
+
+        names = {}
+        values = {}
+        assignments = []
+        for index, (name, value) in enumerate(fields.items()):
+            names[f'#f{index}'] = name
+            values[f':v{index}'] = _to_attribute(name, value)
+            assignments.append(f'#f{index} = :v{index}')
+
+        kwargs = {
+            'TableName': self.table_name,
+            'Key': {'job_id': {'S': job_id}},
+            'UpdateExpression': 'SET ' + ', '.join(assignments),
+            'ExpressionAttributeNames': names,
+            'ExpressionAttributeValues': values
+        }
+        # Late updates must not reopen a finished job or overwrite a cancelled one
+        names['#status'] = 'status'
+        kept = []
+        for index, status in enumerate(unless_status):
+            values[f':t{index}'] = {'S': status}
+            kept.append(f':t{index}')
+        kwargs['ConditionExpression'] = f"attribute_not_exists(#status) OR NOT #status IN ({', '.join(kept)})"
+
+        try:
+            self.client.update_item(**kwargs)
+        except self.client.exceptions.ConditionalCheckFailedException:
+            print(f"Job {job_id} has already finished, ignoring update {fields}")
+            return False
+        return True
+
+
+class InMemoryJobRegistry:
+
+    def __init__(self):
+        self.jobs = {}
+
+    def get(self, job_id):
+        job = self.jobs.get(job_id)
+        return json.loads(json.dumps(job)) if job else None
+
+    def update_stage(self, job_id, stage, status='RUNNING', **details):
+        if self._has_status(job_id, TERMINAL_STATUSES):
+            print(f"Job {job_id} has already finished, ignoring stage {stage}")
+            return
+        self._update(job_id, dict(details, stage=stage, status=status))
+
+    def record_result(self, job_id, status, output=None, error=None, cause=None, result_location=None):
+        fields = {'status': status}
+        if output is not None:
+            fields['output'] = output
+        if result_location is not None:
+            fields['result_location'] = result_location
+        if error is not None:
+            fields['error'] = error
+        if cause is not None:
+            fields['cause'] = cause
+        if self._has_status(job_id, FINAL_STATUSES):
+            print(f"Job {job_id} was cancelled, ignoring result {status}")
+            return
+        self._update(job_id, fields)
+
+    def cancel(self, job_id, cause):
+        if self._has_status(job_id, TERMINAL_STATUSES):
+            return False
+        self._update(job_id, {'status': 'CANCELLED', 'error': 'Cancelled', 'cause': cause})
+        return True
+
+    def _has_status(self, job_id, statuses):
+        return self.jobs.get(job_id, {}).get('status') in statuses
+
+    def _update(self, job_id, fields):
+        job = self.jobs.setdefault(job_id, {'job_id': job_id})
+        job.update(json.loads(json.dumps(fields)))
+        job['updated_at'] = int(time.time())
+
+
+def _to_attribute(name, value):
+    if name in JSON_FIELDS:
+        return {'S': json.dumps(value)}
+    if isinstance(value, bool):
+        return {'BOOL': value}
+    if isinstance(value, (int, float)):
+        return {'N': str(value)}
+    return {'S': str(value)}
+
+
+def _from_attribute(name, attribute):
+    if 'S' in attribute:
+        return json.loads(attribute['S']) if name in JSON_FIELDS else attribute['S']
+    if 'N' in attribute:
+        number = float(attribute['N'])
+        return int(number) if number.is_integer() else number
+    if 'BOOL' in attribute:
+        return attribute['BOOL']
+    return None
+
+
+_registry = None
+
+
+def get_job_registry():
+    """Registry for this process, selected by JOB_REGISTRY_BACKEND."""
+    global _registry
+    if _registry is None:
+        if os.environ.get('JOB_REGISTRY_BACKEND', 'dynamodb') == 'memory':
+            _registry = InMemoryJobRegistry()
+        else:
+            _registry = DynamoDBJobRegistry(os.environ['JOB_REGISTRY_TABLE'])
+    return _registry
@@ -0,0 +1,79 @@
+import math
+
+# Planning for S3 multipart uploads: the server picks the part layout from the
+# declared file size so clients only have to PUT byte ranges in parallel, and
+# can resume an interrupted upload from the parts S3 already holds.
+
+MIB = 1024 * 1024
+MIN_PART_SIZE = 5 * MIB          # S3 minimum for every part except the last
+MAX_PART_SIZE = 5 * 1024 * MIB   # S3 maximum part size
+MAX_PARTS = 10000                # S3 maximum number of parts per upload
+TARGET_PART_SIZE = 16 * MIB      # Large enough to amortise per-request overhead
+MIN_PARALLEL_PARTS = 8           # Smaller files are split further so they still upload in parallel
+
+
+def plan_parts(file_size):
+    """Return the part size and part layout for an upload of file_size bytes."""
+    if not isinstance(file_size, int) or file_size <= 0:
+        raise ValueError("fileSize must be a positive number of bytes")
+    if file_size > MAX_PARTS * MAX_PART_SIZE:
+        raise ValueError("fileSize exceeds the maximum size of an S3 object")
+
+    part_size = min(TARGET_PART_SIZE, math.ceil(file_size / MIN_PARALLEL_PARTS))
+    part_size = max(part_size, MIN_PART_SIZE, math.ceil(file_size / MAX_PARTS))
+    # Whole MiB part sizes keep byte ranges easy to reason about client side
+    part_size = min(math.ceil(part_size / MIB) * MIB, MAX_PART_SIZE)
+
+    part_count = math.ceil(file_size / part_size)
+    parts = []
+    for part_number in range(1, part_count + 1):
+        offset = (part_number - 1) * part_size
+        parts.append({
+            'partNumber': part_number,
+            'offset': offset,
+            'size': min(part_size, file_size - offset)
+        })
+    return {
+        'fileSize': file_size,
+        'partSize': part_size,
+        'partCount': part_count,
+        'parts': parts
+    }
+
+
+def list_uploaded_parts(s3_client, bucket_name, key, upload_id):
+    """Parts S3 has received for the upload, keyed by part number."""
+    uploaded = {}
+    paginator = s3_client.get_paginator('list_parts')
+    for page in paginator.paginate(Bucket=bucket_name, Key=key, UploadId=upload_id):
+        for part in page.get('Parts', []):
+            uploaded[part['PartNumber']] = {'ETag': part['ETag'], 'Size': part['Size']}
+    return uploaded
+
+
+def find_upload_key(s3_client, bucket_name, upload_id, prefix=''):
+    """Key of the multipart upload still in progress under upload_id, or None.
+
+    Clients only hold the upload id; the key (and with it the dataset
+    version and file extension) stays on the server.
+    """
+    paginator = s3_client.get_paginator('list_multipart_uploads')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        for upload in page.get('Uploads', []):
+            if upload['UploadId'] == upload_id:
+                return upload['Key']
+    return None
+
+
+def missing_parts(plan, uploaded):
+    """Planned parts that are absent, or present with the wrong size."""
+    return [
+        part for part in plan['parts']
+        if uploaded.get(part['partNumber'], {}).get('Size') != part['size']
+    ]
+
+
+def part_number_gaps(part_numbers):
+    """Part numbers absent from 1..N, where N is the highest one received."""
+    received = set(part_numbers)
+    return [number for number in range(1, max(received, default=0) + 1) if number not in received]
@@ -0,0 +1,274 @@
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Spans for one job across the Lambdas, the state machine and the processing
+# job.
+#
+# A job's trace id is derived from its job_id, so every component joins the
+# same trace from the job_id it already receives. The parent span travels
+# through the state machine input as a W3C traceparent. Spans are buffered
+# and written by flush() at the end of each invocation, to the exporter named
+# by TRACE_EXPORTER:
+#   stdout  one {"trace_span": ...} JSON line per span, into CloudWatch Logs
+#   file    JSON lines appended to TRACE_FILE
+#   otlp    OTLP/HTTP JSON to OTEL_EXPORTER_OTLP_ENDPOINT, e.g. a local collector
+#   none    spans are dropped
+# Tracing never fails the request it observes: export errors are printed.
+
+DEFAULT_EXPORTER = 'stdout'
+DEFAULT_OTLP_ENDPOINT = 'http://localhost:4318'
+OTLP_TIMEOUT_SECONDS = 2
+
+STATUS_OK = 'OK'
+STATUS_ERROR = 'ERROR'
+
+
+def trace_id_for(job_id):
+    """The 32 hex digit trace id of a job."""
+    try:
+        return uuid.UUID(str(job_id)).hex
+    except ValueError:
+        return hashlib.md5(str(job_id).encode('utf-8')).hexdigest()
+
+
+def format_traceparent(trace_id, span_id):
+    return f"00-{trace_id}-{span_id}-01"
+
+
+def parse_traceparent(value):
+    """(trace_id, span_id) from a traceparent, or None if it is malformed."""
+    parts = str(value or '').split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16)
+        int(parts[2], 16)
+    except ValueError:
+        return None
+    return parts[1], parts[2]
+
+
+def _new_span_id():
+    return uuid.uuid4().hex[:16]
+
+
+class Span:
+
+    def __init__(self, name, service, parent=None, trace_id=None, attributes=None):
+        self.name = name
+        self.service = service
+        self.span_id = _new_span_id()
+        # A Span in this process, or (trace_id, span_id) from a traceparent
+        self.parent = parent
+        self._trace_id = trace_id
+        self.attributes = dict(attributes or {})
+        self.status = STATUS_OK
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    @property
+    def trace_id(self):
+        if self._trace_id is None:
+            if isinstance(self.parent, Span):
+                return self.parent.trace_id
+            if self.parent:
+                return self.parent[0]
+            self._trace_id = uuid.uuid4().hex
+        return self._trace_id
+
+    @property
+    def parent_span_id(self):
+        if isinstance(self.parent, Span):
+            return self.parent.span_id
+        if self.parent:
+            return self.parent[1]
+        return None
+
+    def set_job_id(self, job_id):
+        """Move the span (and spans under it) into the job's trace."""
+        self._trace_id = trace_id_for(job_id)
+        self.attributes['job_id'] = job_id
+
+    def set(self, **attributes):
+        self.attributes.update({name: value for name, value in attributes.items() if value is not None})
+
+    def traceparent(self):
+        return format_traceparent(self.trace_id, self.span_id)
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_span_id': self.parent_span_id,
+            'name': self.name,
+            'service': self.service,
+            'start_time_unix_nano': self.start_ns,
+            'end_time_unix_nano': self.end_ns,
+            'duration_ms': (self.end_ns - self.start_ns) / 1e6,
+            'status': self.status,
+            'attributes': self.attributes
+        }
+
+
+class Tracer:
+    """Creates the spans of one service (a Lambda, the processing job)."""
+
+    def __init__(self, service):
+        self.service = service
+        self._finished = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def current_span(self):
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def _start(self, name, job_id, parent, attributes):
+        if isinstance(parent, str):
+            parent = parse_traceparent(parent)
+        if parent is None:
+            parent = self.current_span()
+        span = Span(name, self.service, parent=parent, attributes=attributes)
+        if job_id:
+            span.set_job_id(job_id)
+        return span
+
+    @contextmanager
+    def span(self, name, job_id=None, parent=None, **attributes):
+        """Time the block as a span, nested under the enclosing span by default.
+
+        parent may be a Span or a traceparent string.
+        """
+        span = self._start(name, job_id, parent, attributes)
+        stack = self._stack()
+        stack.append(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = STATUS_ERROR
+            span.set(error=f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            stack.pop()
+            span.end_ns = time.time_ns()
+            self._add(span)
+
+    def record(self, name, start_ns, end_ns, job_id=None, parent=None, **attributes):
+        """Add a span timed elsewhere, e.g. by Athena or SageMaker."""
+        span = self._start(name, job_id, parent, attributes)
+        span.start_ns, span.end_ns = int(start_ns), int(end_ns)
+        self._add(span)
+        return span
+
+    def extend(self, span_dicts):
+        """Add spans exported by another process, such as the processing job."""
+        for span_dict in span_dicts:
+            self._add(span_dict)
+
+    def _add(self, span):
+        with self._lock:
+            self._finished.append(span)
+
+    def flush(self):
+        with self._lock:
+            spans, self._finished = self._finished, []
+        # Converted only now: a span's trace id can change until its root
+        # learns the job id
+        if spans:
+            export([span.to_dict() if isinstance(span, Span) else span for span in spans])
+
+    def handler(self, name):
+        """Wrap a Lambda handler in a span and flush when it returns.
+
+        The span joins the trace of the event's job_id and traceparent, as
+        passed by the state machine.
+        """
+        def decorate(function):
+            @functools.wraps(function)
+            def wrapper(event, context):
+                fields = event if isinstance(event, dict) else {}
+                try:
+                    with self.span(name, job_id=fields.get('job_id'), parent=fields.get('traceparent')):
+                        return function(event, context)
+                finally:
+                    self.flush()
+            return wrapper
+        return decorate
+
+
+def export(spans):
+    exporter = os.environ.get('TRACE_EXPORTER', DEFAULT_EXPORTER).lower()
+    try:
+        if exporter == 'stdout':
+            for span in spans:
+                print(json.dumps({'trace_span': span}, default=str))
+        elif exporter == 'file':
+            with open(os.environ.get('TRACE_FILE', 'trace_spans.jsonl'), 'a') as f:
+                for span in spans:
+                    f.write(json.dumps(span, default=str) + '\n')
+        elif exporter == 'otlp':
+            _export_otlp(spans)
+    except Exception as e:
+        print(f"Could not export {len(spans)} trace spans to {exporter}: {e}")
+
+
+def _export_otlp(spans):
+    import urllib.request
+    endpoint = os.environ.get('OTEL_EXPORTER_OTLP_TRACES_ENDPOINT')
+    if not endpoint:
+        endpoint = os.environ.get('OTEL_EXPORTER_OTLP_ENDPOINT', DEFAULT_OTLP_ENDPOINT).rstrip('/') + '/v1/traces'
+    request = urllib.request.Request(
+        endpoint,
+        data=json.dumps(to_otlp(spans)).encode('utf-8'),
+        headers={'Content-Type': 'application/json'},
+        method='POST'
+    )
+    with urllib.request.urlopen(request, timeout=OTLP_TIMEOUT_SECONDS) as response:
+        response.read()
+
+
+def to_otlp(spans):
+    """An OTLP/HTTP JSON ExportTraceServiceRequest for the spans."""
+    by_service = {}
+    for span in spans:
+        by_service.setdefault(span['service'], []).append({
+            'traceId': span['trace_id'],
+            'spanId': span['span_id'],
+            'parentSpanId': span['parent_span_id'] or '',
+            'name': span['name'],
+            'kind': 1,
+            'startTimeUnixNano': str(span['start_time_unix_nano']),
+            'endTimeUnixNano': str(span['end_time_unix_nano']),
+            'attributes': [_otlp_attribute(k, v) for k, v in span['attributes'].items()],
+            'status': {'code': 2 if span['status'] == STATUS_ERROR else 1}
+        })
+    return {'resourceSpans': [
+        {
+            'resource': {'attributes': [_otlp_attribute('service.name', service)]},
+            'scopeSpans': [{'scope': {'name': 'feedback_survey_insights'}, 'spans': service_spans}]
+        }
+        for service, service_spans in by_service.items()
+    ]}
+
+
+def _otlp_attribute(key, value):
+    if isinstance(value, bool):
+        typed = {'boolValue': value}
+    elif isinstance(value, int):
+        typed = {'intValue': str(value)}
+    elif isinstance(value, float):
+        typed = {'doubleValue': value}
+    else:
+        typed = {'stringValue': str(value)}
+    return {'key': key, 'value': typed}
@@ -0,0 +1,7 @@
+"""Local end-to-end run of the query pipeline.
+
+The real handlers run in state machine order against stand-ins: a directory
+for S3, DuckDB for Athena, a fake Bedrock with configurable latency, and
+processing_script.main in-process for the SageMaker job. See __main__ for
+the command line.
+"""
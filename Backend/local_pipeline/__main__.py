@@ -0,0 +1,82 @@
+"""Run the pipeline locally and report per-stage latency.
+
+    python -m local_pipeline --data survey.csv --runs 3
+    python -m local_pipeline --data survey.csv --filters '[{"market": "West"}]' \
+        --bedrock-latency-ms 2000 --fake-embeddings --json report.json
+    python -m local_pipeline --data survey.csv --runs 20 --trace-file spans.jsonl
+    python benchmarks/trace_report.py spans.jsonl
+    python -m local_pipeline --data survey.csv --runs 5 --backend worker
+    python -m local_pipeline --data survey.csv --featurizer lexical
+    python -m local_pipeline --data survey.csv --cluster-by question
+
+Needs boto3, duckdb and the processing script's dependencies (see
+local_pipeline/requirements.txt). --fake-embeddings replaces the
+sentence-transformers model with a hashing stand-in for runs without the
+model cached locally.
+"""
+import argparse
+import json
+import os
+import tempfile
+
+from .pipeline import Pipeline, read_headers, summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the feedback survey pipeline against local stand-ins.")
+    parser.add_argument('--data', required=True, help="survey CSV to ingest")
+    parser.add_argument('--query', default="What are the top insights from the survey?")
+    parser.add_argument('--filters', default='[]', help="filters as sent to /process-query, as JSON")
+    parser.add_argument('--runs', type=int, default=1, help="number of queries to run after ingesting")
+    parser.add_argument('--bedrock-latency-ms', type=float, default=0.0)
+    parser.add_argument('--fake-embeddings', action='store_true')
+    parser.add_argument('--workdir', help="directory for the local S3 (default: a temporary directory)")
+    parser.add_argument('--json', help="also write the report to this file")
+    parser.add_argument('--trace-file', help="append the jobs' trace spans to this file")
+    parser.add_argument('--backend', choices=('sagemaker', 'worker'),
+                        help="processing backend for unsharded jobs (default: the deployed value)")
+    parser.add_argument('--rows-per-shard', type=int, help="shard size for sharded processing (default: the deployed value)")
+    parser.add_argument('--cluster-sample-size', type=int,
+                        help="most documents to cluster before sampling (default: the deployed value)")
+    parser.add_argument('--featurizer', choices=('transformer', 'lexical'),
+                        help="how the processing job vectorizes comments (default: transformer)")
+    parser.add_argument('--cluster-by', choices=('row', 'question'),
+                        help="cluster each row's comments together or each comment column on its own (default: row)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        pipeline = Pipeline(
+            args.workdir or scratch,
+            read_headers(args.data),
+            bedrock_latency_seconds=args.bedrock_latency_ms / 1000,
+            fake_embeddings=args.fake_embeddings,
+            trace_file=args.trace_file and os.path.abspath(args.trace_file),
+            rows_per_shard=args.rows_per_shard,
+            backend=args.backend,
+            cluster_sample_size=args.cluster_sample_size
+        )
+        try:
+            pipeline.ingest(args.data)
+            results = [pipeline.run_query(args.query, json.loads(args.filters), args.featurizer, args.cluster_by) for _ in range(args.runs)]
+        finally:
+            pipeline.close()
+
+    report = {
+        'stages': summarize(pipeline.timings),
+        'jobs': [{'job_id': job_id, 'status': result.get('status'), 'error': result.get('error')} for job_id, result in results],
+        'bedrock_calls': pipeline.bedrock.calls,
+    }
+
+    print(f"{'stage':<24}{'runs':>6}{'p50 ms':>12}{'max ms':>12}")
+    for row in report['stages']:
+        print(f"{row['stage']:<24}{row['runs']:>6}{row['p50_ms']:>12.1f}{row['max_ms']:>12.1f}")
+    for job in report['jobs']:
+        print(f"job {job['job_id']}: {job['status']}" + (f" ({job['error']})" if job['error'] else ''))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,355 @@
+import csv
+import importlib
+import json
+import os
+import shutil
+import statistics
+import sys
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from .stand_ins import FakeBedrock, FakeDynamoDB, FakeSageMaker, FakeStepFunctions, LocalAthena, LocalS3
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BUCKET = 'local-bucket'
+STATE_MACHINE_ARN = 'arn:aws:states:local:000000000000:stateMachine:local-pipeline'
+INFLIGHT_JOBS_TABLE = 'local-inflight-jobs'
+ATHENA_DATABASE = 'local_database'
+ATHENA_TABLE = 'survey_data'
+
+# SubmitToWorkerPool's HeartbeatSeconds and TimeoutSeconds
+WORKER_HEARTBEAT_SECONDS = 60
+WORKER_TIMEOUT_SECONDS = 3600
+
+HANDLERS = ('profile_dataset', 'start_query', 'validate_query', 'process_query', 'generate_insights', 'check_status')
+
+
+class Pipeline:
+    """Runs the real handlers in state machine order against local stand-ins.
+
+    Module-level clients are created when the handlers are imported, so only
+    one Pipeline can exist per process.
+    """
+
+    def __init__(self, workdir, headers, bedrock_latency_seconds=0.0, fake_embeddings=False, trace_file=None,
+                 rows_per_shard=None, backend=None, cluster_sample_size=None):
+        glue_names = [self._glue_name(h) for h in headers]
+        self.timings = []
+        self.workdir = workdir
+        self.s3 = LocalS3(os.path.join(workdir, 's3'))
+        self.athena = LocalAthena(self.s3, BUCKET, ATHENA_TABLE, glue_names)
+        self.bedrock = FakeBedrock(bedrock_latency_seconds)
+        self.stepfunctions = FakeStepFunctions()
+        self.sagemaker = FakeSageMaker()
+        self.dynamodb = FakeDynamoDB({INFLIGHT_JOBS_TABLE: 'request_key'})
+
+        os.environ.update({
+            'AWS_DEFAULT_REGION': 'us-west-2',
+            'BUCKET_NAME': BUCKET,
+            'STEP_FUNCTION_ARN': STATE_MACHINE_ARN,
+            'INFLIGHT_JOBS_TABLE': INFLIGHT_JOBS_TABLE,
+            'JOB_REGISTRY_BACKEND': 'memory',
+            'ATHENA_DATABASE': ATHENA_DATABASE,
+            'ATHENA_TABLE': ATHENA_TABLE,
+            'COMMENT_COLUMNS': json.dumps([c for c in glue_names if c.startswith('comment_')]),
+            'EXPECTED_HEADERS': json.dumps(headers),
+            'PROFILE_FUNCTION_NAME': 'local-profile-dataset',
+        })
+        if rows_per_shard:
+            # Small enough to exercise sharded processing with a sample file
+            os.environ['ROWS_PER_SHARD'] = str(rows_per_shard)
+        if backend:
+            os.environ['PROCESSING_BACKEND'] = backend
+        if cluster_sample_size is not None:
+            os.environ['CLUSTER_SAMPLE_SIZE'] = str(cluster_sample_size)
+        # Spans go to a file for benchmarks/trace_report.py, unless an
+        # exporter (e.g. otlp to a local collector) is already configured
+        if trace_file:
+            os.environ.setdefault('TRACE_EXPORTER', 'file')
+            os.environ.setdefault('TRACE_FILE', trace_file)
+        else:
+            os.environ.setdefault('TRACE_EXPORTER', 'none')
+
+        sys.path.insert(0, os.path.join(BACKEND, 'lambda_layers', 'common', 'python'))
+        for name in HANDLERS:
+            sys.path.insert(0, os.path.join(BACKEND, 'lambda_functions', name))
+        sys.path.insert(0, os.path.join(BACKEND, 'processing_script'))
+
+        import aws_clients
+        clients = {
+            's3': self.s3,
+            'athena': self.athena,
+            'bedrock-runtime': self.bedrock,
+            'stepfunctions': self.stepfunctions,
+            'sagemaker': self.sagemaker,
+            'dynamodb': self.dynamodb,
+        }
+        aws_clients.set_client_factory(lambda service, region: clients.get(service) or _UnusedClient(service))
+
+        if fake_embeddings:
+            sys.modules['sentence_transformers'] = fake_sentence_transformers()
+
+        self.handlers = {name: importlib.import_module(name) for name in HANDLERS}
+        self.processing_script = importlib.import_module('processing_script')
+        if fake_embeddings:
+            # Spawned per-question processes would import the real model
+            self.processing_script.QUESTION_START_METHOD = 'fork'
+        self.registry = importlib.import_module('job_registry').get_job_registry()
+
+        self.job_queue = None
+        self.worker = None
+        if backend == 'worker':
+            self._start_worker()
+
+    def _start_worker(self):
+        # One warm worker on a thread, taking jobs from a SQLite queue in the
+        # workdir the way the Fargate workers take them from SQS
+        job_queue = importlib.import_module('job_queue')
+        processing_worker = importlib.import_module('processing_worker')
+        os.makedirs(self.workdir, exist_ok=True)
+        self.job_queue = job_queue.SQLiteJobQueue(os.path.join(self.workdir, 'queue.db'))
+        self.worker = processing_worker.ProcessingWorker(
+            self.job_queue, self.s3, self.stepfunctions, name='local-worker'
+        )
+        self.worker.warm_up()
+        self._worker_thread = threading.Thread(target=self.worker.run_forever, args=(1,), daemon=True)
+        self._worker_thread.start()
+
+    def close(self):
+        if self.worker is not None:
+            self.worker.stopping.set()
+            self._worker_thread.join()
+
+    @staticmethod
+    def _glue_name(column):
+        # Same normalisation as FeedbackSurveyStateMachineStack
+        return column.lower().replace(" ", "_").replace(":", "_")
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings.append((name, time.perf_counter() - start))
+
+    def ingest(self, data_path):
+        """Store the CSV as a new dataset version and profile (activate) it."""
+        from datasets import new_dataset_version, dataset_object_key
+        version = new_dataset_version()
+        key = dataset_object_key(version, os.path.basename(data_path))
+        destination = self.s3.path(BUCKET, key)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.copyfile(data_path, destination)
+
+        with self.stage('profile_dataset'):
+            result = self.handlers['profile_dataset'].lambda_handler({'key': key, 'dataset_version': version}, None)
+        if not result['valid']:
+            manifest = json.loads(self.s3.get_object(Bucket=BUCKET, Key=result['manifest_key'])['Body'].read())
+            raise ValueError(f"Dataset failed validation: {manifest['errors']}")
+        return version
+
+    def run_query(self, query, filters, featurizer=None, cluster_by=None):
+        """One request through start_query, the state machine and check_status."""
+        request = {'query': query, 'filters': filters}
+        if featurizer:
+            request['featurizer'] = featurizer
+        if cluster_by:
+            request['cluster_by'] = cluster_by
+        with self.stage('start_query'):
+            response = self.handlers['start_query'].lambda_handler({'body': json.dumps(request)}, None)
+        body = json.loads(response['body'])
+        if response['statusCode'] != 200:
+            raise ValueError(f"start_query returned {response['statusCode']}: {body}")
+        job_id = body['job_id']
+        execution_arn = body['execution_arn']
+        execution_input = json.loads(self.stepfunctions.describe_execution(executionArn=execution_arn)['input'])
+
+        with self.stage('state_machine'):
+            status, output = self._run_state_machine(job_id, execution_arn, execution_input)
+        self.stepfunctions.finish(execution_arn, status, output)
+
+        with self.stage('check_status'):
+            response = self.handlers['check_status'].lambda_handler({'queryStringParameters': {'jobId': job_id}}, None)
+        return job_id, json.loads(response['body'])
+
+    def _run_state_machine(self, job_id, execution_arn, execution_input):
+        validate_query = self.handlers['validate_query']
+        try:
+            # ValidateAndFilter: the two branches run concurrently
+            with self.stage('validate_and_filter'), ThreadPoolExecutor(max_workers=2) as pool:
+                validation = pool.submit(self._timed, 'validate_query', validate_query.lambda_handler, {
+                    'job_id': job_id,
+                    'query': execution_input['query'],
+                    'traceparent': execution_input['traceparent']
+                })
+                processing_job = pool.submit(self._timed, 'process_query', self.handlers['process_query'].lambda_handler,
+                                             dict(execution_input, execution_arn=execution_arn))
+                validation.result()
+                processing_job = processing_job.result()
+
+            # ChooseProcessing and the SageMaker jobs or worker it leads to
+            plan = processing_job['plan']
+            # A worker timeout falls back to a SageMaker job, as in the state machine
+            ran_on_worker = plan.get('backend') == 'worker' and self._run_on_worker(job_id, plan, execution_input)
+            if plan['sharded']:
+                with self.stage('sagemaker_processing'):
+                    self._run_sharded_processing(job_id, plan)
+            elif not ran_on_worker:
+                with self.stage('sagemaker_processing'):
+                    input_data = self._processing_input(job_id, 'data', self._shard_keys(job_id), plan['input_mode'])
+                    self._run_processing_job(f'processing-job-{job_id}-0', input_data,
+                                             f'processed/{job_id}/', job_id, 'all', plan['instance_type'],
+                                             sample_size=plan['cluster_sample_size'], featurizer=plan['featurizer'],
+                                             cluster_by=plan['cluster_by'], checkpointed=True)
+            with self.stage('generate_insights'):
+                result = self.handlers['generate_insights'].lambda_handler({
+                    'job_id': job_id,
+                    'query': processing_job['query'],
+                    'filters': processing_job['filters'],
+                    'traceparent': execution_input['traceparent']
+                }, None)
+            return 'SUCCEEDED', result
+        except validate_query.InvalidQueryError as e:
+            self.registry.record_result(job_id, 'FAILED', error='InvalidQuery', cause=str(e))
+            return 'FAILED', None
+        except Exception as e:
+            self.registry.record_result(job_id, 'FAILED', error='GeneralProcessingError', cause=str(e))
+            return 'FAILED', None
+
+    def _run_on_worker(self, job_id, plan, execution_input):
+        """SubmitToWorkerPool; False if it timed out and SageMaker should run the job."""
+        with self.stage('worker_processing'):
+            token = self.stepfunctions.create_task_token()
+            self.job_queue.send({
+                'task_token': token,
+                'job_id': job_id,
+                'bucket': BUCKET,
+                'input_prefix': f'shards/{job_id}/',
+                'output_prefix': f'processed/{job_id}/',
+                'submitted_at': datetime.now(timezone.utc).isoformat(),
+                'cluster_sample_size': plan['cluster_sample_size'],
+                'featurizer': plan['featurizer'],
+                'cluster_by': plan['cluster_by'],
+                'traceparent': execution_input['traceparent']
+            })
+            try:
+                self.stepfunctions.wait_for_task(token, WORKER_HEARTBEAT_SECONDS, WORKER_TIMEOUT_SECONDS)
+            except self.stepfunctions.exceptions.TaskTimedOut:
+                return False
+        return True
+
+    def _run_processing_job(self, job_name, input_dir, output_prefix, job_id, mode, instance_type, host=None,
+                            sample_size=0, featurizer='transformer', cluster_by='row', checkpointed=False):
+        output_dir = self.s3.path(BUCKET, output_prefix)
+        os.makedirs(output_dir, exist_ok=True)
+        # The checkpoint output and the input a retry resumes from are the
+        # same S3 prefix; only the first attempt is run here
+        checkpoints = self.s3.path(BUCKET, f'processed/{job_id}/checkpoints/') if checkpointed else None
+        started = datetime.now(timezone.utc)
+        self.processing_script.main(input_dir, output_dir, job_id=job_id, mode=mode, host=host, sample_size=sample_size,
+                                    featurizer=featurizer, cluster_by=cluster_by, checkpoint_output=checkpoints,
+                                    checkpoint_input=checkpoints,
+                                    progress_output=self.s3.path(BUCKET, f'processed/{job_id}/progress/'))
+        self.sagemaker.record_job(job_name, started, datetime.now(timezone.utc), instance_type=instance_type)
+
+    def _run_sharded_processing(self, job_id, plan):
+        # ShardedByS3Key: each instance gets a disjoint subset of the shard
+        # objects; the instances run one after another here
+        shard_keys = self._shard_keys(job_id)
+        started = datetime.now(timezone.utc)
+        for instance in range(plan['instance_count']):
+            input_data = self._processing_input(job_id, f'algo-{instance + 1}',
+                                                shard_keys[instance::plan['instance_count']], plan['input_mode'])
+            self._run_processing_job(f'processing-job-{job_id}-embed-0', input_data,
+                                     f'processed/{job_id}/embeddings/', job_id, 'embed', plan['instance_type'],
+                                     host=f'algo-{instance + 1}', featurizer=plan['featurizer'],
+                                     cluster_by=plan['cluster_by'], checkpointed=True)
+        self.sagemaker.record_job(f'processing-job-{job_id}-embed-0', started, datetime.now(timezone.utc),
+                                  instance_type=plan['instance_type'], instance_count=plan['instance_count'])
+        self._run_processing_job(f'processing-job-{job_id}-0', self.s3.path(BUCKET, f'processed/{job_id}/embeddings/'),
+                                 f'processed/{job_id}/', job_id, 'cluster', plan['merge_instance_type'],
+                                 sample_size=plan['cluster_sample_size'], cluster_by=plan['cluster_by'])
+
+    def _shard_keys(self, job_id):
+        listing = self.s3.list_objects_v2(Bucket=BUCKET, Prefix=f'shards/{job_id}/')
+        return [item['Key'] for item in listing['Contents']]
+
+    def _processing_input(self, job_id, channel, keys, input_mode):
+        """The objects copied into a directory (File input mode), or streamed
+        back to back into a named pipe next to it (Pipe), as SageMaker does."""
+        input_dir = os.path.join(self.workdir, 'sagemaker', job_id, channel)
+        if input_mode != 'Pipe':
+            os.makedirs(input_dir, exist_ok=True)
+            for key in keys:
+                shutil.copyfile(self.s3.path(BUCKET, key), os.path.join(input_dir, key.rsplit('/', 1)[1]))
+            return input_dir
+        os.makedirs(os.path.dirname(input_dir), exist_ok=True)
+        os.mkfifo(f'{input_dir}_0')
+        threading.Thread(target=self._write_pipe, args=(f'{input_dir}_0', keys), daemon=True).start()
+        return input_dir
+
+    def _write_pipe(self, pipe, keys):
+        with open(pipe, 'wb') as f:
+            for key in keys:
+                with open(self.s3.path(BUCKET, key), 'rb') as source:
+                    shutil.copyfileobj(source, f)
+
+    def _timed(self, name, handler, event):
+        with self.stage(name):
+            return handler(event, None)
+
+
+def summarize(timings):
+    """Per-stage count, p50 and max in milliseconds, in first-seen order."""
+    by_stage = {}
+    for name, seconds in timings:
+        by_stage.setdefault(name, []).append(seconds * 1000)
+    return [
+        {'stage': name, 'runs': len(values), 'p50_ms': statistics.median(values), 'max_ms': max(values)}
+        for name, values in by_stage.items()
+    ]
+
+
+def read_headers(data_path):
+    with open(data_path, newline='', encoding='utf-8-sig') as f:
+        return next(csv.reader(f))
+
+
+class _UnusedClient:
+    # Handlers create some clients they never call in this flow
+    def __init__(self, service):
+        self.service = service
+
+    def __getattr__(self, name):
+        raise RuntimeError(f"The local pipeline has no stand-in for {self.service}.{name}")
+
+
+def fake_sentence_transformers():
+    # Deterministic bag-of-words hashing in place of the embedding model, for
+    # runs without the model cached locally (no network)
+    import hashlib
+    import numpy as np
+
+    class SentenceTransformer:
+        dimensions = 384
+
+        def __init__(self, model_name, *args, **kwargs):
+            self.model_name = model_name
+
+        def encode(self, documents, **kwargs):
+            vectors = np.zeros((len(documents), self.dimensions), dtype=np.float32)
+            for row, document in enumerate(documents):
+                for token in document.lower().split():
+                    digest = hashlib.md5(token.encode('utf-8')).digest()
+                    vectors[row, int.from_bytes(digest[:4], 'little') % self.dimensions] += 1.0
+            return vectors
+
+    module = types.ModuleType('sentence_transformers')
+    module.SentenceTransformer = SentenceTransformer
+    return module
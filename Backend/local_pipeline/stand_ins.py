@@ -0,0 +1,416 @@
+import csv
+import io
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+# Local stand-ins for the AWS services the Lambdas call. Each implements only
+# the operations and arguments the handlers actually use, returning responses
+# shaped like boto3's.
+
+
+class LocalS3:
+    """S3 backed by a directory: s3://bucket/key is root/bucket/key."""
+
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, bucket, key):
+        return os.path.join(self.root, bucket, *key.split('/'))
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        path = self.path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            if hasattr(Body, 'read'):
+                shutil.copyfileobj(Body, f)
+            else:
+                f.write(Body if isinstance(Body, bytes) else Body.encode('utf-8'))
+        return {'ETag': f'"{uuid.uuid4().hex}"'}
+
+    def get_object(self, Bucket, Key, Range=None):
+        path = self.path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise self.exceptions.NoSuchKey(Key)
+        with open(path, 'rb') as f:
+            if Range:
+                start, end = (int(n) for n in Range[len('bytes='):].split('-'))
+                f.seek(start)
+                data = f.read(end - start + 1)
+            else:
+                data = f.read()
+        return {'Body': io.BytesIO(data), 'ContentLength': len(data)}
+
+    def head_object(self, Bucket, Key):
+        path = self.path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise self.exceptions.NoSuchKey(Key)
+        stat = os.stat(path)
+        return {'ContentLength': stat.st_size, 'ETag': f'"{int(stat.st_mtime_ns)}"'}
+
+    def list_objects_v2(self, Bucket, Prefix=''):
+        base = os.path.join(self.root, Bucket)
+        contents = []
+        for directory, _, files in os.walk(base):
+            for name in files:
+                path = os.path.join(directory, name)
+                key = os.path.relpath(path, base).replace(os.sep, '/')
+                if key.startswith(Prefix):
+                    stat = os.stat(path)
+                    contents.append({
+                        'Key': key,
+                        'Size': stat.st_size,
+                        'LastModified': datetime.fromtimestamp(stat.st_mtime_ns / 1e9, timezone.utc)
+                    })
+        return {'Contents': sorted(contents, key=lambda item: item['Key']), 'KeyCount': len(contents)}
+
+    def delete_objects(self, Bucket, Delete):
+        for item in Delete['Objects']:
+            path = self.path(Bucket, item['Key'])
+            if os.path.isfile(path):
+                os.remove(path)
+        return {}
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn=None):
+        return 'file://' + self.path(Params['Bucket'], Params['Key'])
+
+
+class LocalAthena:
+    """Athena over DuckDB. Queries run synchronously in start_query_execution.
+
+    The table is a view over every raw/dataset_version=*/ object, with the
+    Glue column names and dataset_version as a column, as Athena sees it.
+    """
+
+    def __init__(self, s3, bucket, table_name, headers):
+        import duckdb
+        self.s3 = s3
+        self.bucket = bucket
+        self.table_name = table_name
+        self.headers = headers
+        self.connection = duckdb.connect()
+        self.executions = {}
+        self.lock = threading.Lock()
+
+    def _create_view(self):
+        # dataset_version comes from the key, as with the Glue partition
+        if not self.s3.list_objects_v2(Bucket=self.bucket, Prefix='raw/dataset_version=')['Contents']:
+            raise ValueError('No dataset has been uploaded')
+        pattern = self.s3.path(self.bucket, 'raw/dataset_version=*/*').replace("'", "''")
+        names = ', '.join(f"'{name}'" for name in self.headers)
+        self.connection.execute(
+            f"CREATE OR REPLACE VIEW {self.table_name} AS SELECT * FROM "
+            f"read_csv('{pattern}', header=true, all_varchar=true, names=[{names}], hive_partitioning=true)"
+        )
+
+    def start_query_execution(self, QueryString, QueryExecutionContext, ResultConfiguration):
+        execution_id = str(uuid.uuid4())
+        output_prefix = ResultConfiguration['OutputLocation'][len(f's3://{self.bucket}/'):]
+        output_key = f'{output_prefix}{execution_id}.csv'
+        output_path = self.s3.path(self.bucket, output_key)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+        submitted = datetime.now(timezone.utc)
+        start = time.perf_counter()
+        with self.lock:
+            self._create_view()
+            query = QueryString.strip().rstrip(';')
+            path = output_path.replace("'", "''")
+            self.connection.execute(f"COPY ({query}) TO '{path}' (HEADER, DELIMITER ',', FORCE_QUOTE *)")
+        elapsed_ms = int((time.perf_counter() - start) * 1000)
+
+        # Athena writes a .metadata object next to the results, after them
+        self.s3.put_object(Bucket=self.bucket, Key=output_key + '.metadata', Body=b'')
+        later = time.time() + 0.001
+        os.utime(self.s3.path(self.bucket, output_key + '.metadata'), (later, later))
+
+        self.executions[execution_id] = {
+            'output_key': output_key,
+            'Status': {
+                'State': 'SUCCEEDED',
+                'SubmissionDateTime': submitted,
+                'CompletionDateTime': datetime.now(timezone.utc)
+            },
+            'Statistics': {
+                'QueryQueueTimeInMillis': 0,
+                'EngineExecutionTimeInMillis': elapsed_ms,
+                'TotalExecutionTimeInMillis': elapsed_ms,
+                'DataScannedInBytes': sum(
+                    item['Size'] for item in self.s3.list_objects_v2(Bucket=self.bucket, Prefix='raw/')['Contents']
+                )
+            }
+        }
+        return {'QueryExecutionId': execution_id}
+
+    def get_query_execution(self, QueryExecutionId):
+        execution = self.executions[QueryExecutionId]
+        return {'QueryExecution': {
+            'QueryExecutionId': QueryExecutionId,
+            'Status': execution['Status'],
+            'Statistics': execution['Statistics'],
+            'ResultConfiguration': {'OutputLocation': f"s3://{self.bucket}/{execution['output_key']}"}
+        }}
+
+    def get_query_results(self, QueryExecutionId, MaxResults=1000):
+        body = self.s3.get_object(Bucket=self.bucket, Key=self.executions[QueryExecutionId]['output_key'])['Body']
+        rows = []
+        for row in csv.reader(io.TextIOWrapper(body, encoding='utf-8', newline='')):
+            rows.append({'Data': [{'VarCharValue': value} for value in row]})
+            if len(rows) >= MaxResults:
+                break
+        return {'ResultSet': {'Rows': rows}}
+
+    def stop_query_execution(self, QueryExecutionId):
+        return {}
+
+
+class FakeBedrock:
+    """Bedrock runtime returning canned answers after a configurable delay.
+
+    Short completions (the validation verdict) answer 'Valid'; anything else
+    gets insight JSON with one insight per cluster in the prompt.
+    """
+
+    def __init__(self, latency_seconds=0.0):
+        self.latency_seconds = latency_seconds
+        self.calls = []
+
+    def invoke_model(self, modelId, body):
+        request = json.loads(body)
+        prompt = request['messages'][0]['content'][0]['text']
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+        if request.get('max_tokens', 0) <= 10:
+            text = 'Valid'
+        else:
+            clusters = len(re.findall(r'^Cluster \d+:', prompt, flags=re.MULTILINE))
+            text = json.dumps({
+                'insights': [
+                    {
+                        'insight': f'Stand-in insight {n}',
+                        'recommendation': f'Stand-in recommendation {n}',
+                        'sample_row': f'Cluster {n}'
+                    }
+                    for n in range(1, min(clusters, 10) + 1)
+                ],
+                'summary': f'Stand-in summary of {clusters} representative rows.'
+            })
+
+        usage = {'input_tokens': len(prompt) // 4, 'output_tokens': len(text) // 4}
+        self.calls.append(dict(usage, model_id=modelId))
+        response = {'content': [{'type': 'text', 'text': text}], 'usage': usage}
+        return {'body': io.BytesIO(json.dumps(response).encode('utf-8'))}
+
+
+class FakeStepFunctions:
+    """Records executions; the orchestrator drives them and sets their status.
+
+    Also holds the task tokens of .waitForTaskToken states, which the
+    processing worker heartbeats and completes from its own thread.
+    """
+
+    class exceptions:
+        class ExecutionDoesNotExist(Exception):
+            pass
+
+        class TaskTimedOut(Exception):
+            pass
+
+    class TaskFailed(Exception):
+        def __init__(self, error, cause):
+            super().__init__(f"{error}: {cause}")
+            self.error = error
+
+    def __init__(self):
+        self.executions = {}
+        self.tasks = {}
+        self._tasks_changed = threading.Condition()
+
+    def start_execution(self, stateMachineArn, name, input):
+        arn = f"{stateMachineArn.replace('stateMachine', 'execution')}:{name}"
+        self.executions[arn] = {
+            'executionArn': arn,
+            'name': name,
+            'input': input,
+            'status': 'RUNNING',
+            'startDate': datetime.now(timezone.utc)
+        }
+        return {'executionArn': arn, 'startDate': self.executions[arn]['startDate']}
+
+    def describe_execution(self, executionArn):
+        if executionArn not in self.executions:
+            raise self.exceptions.ExecutionDoesNotExist(executionArn)
+        return dict(self.executions[executionArn])
+
+    def stop_execution(self, executionArn, **kwargs):
+        self.finish(executionArn, 'ABORTED')
+        return {}
+
+    def finish(self, executionArn, status, output=None):
+        self.executions[executionArn].update(status=status, output=json.dumps(output))
+
+    def create_task_token(self):
+        token = uuid.uuid4().hex
+        with self._tasks_changed:
+            self.tasks[token] = {'status': 'WAITING', 'heartbeat': time.monotonic()}
+        return token
+
+    def _update_task(self, token, **fields):
+        with self._tasks_changed:
+            task = self.tasks.get(token)
+            if task is None or task['status'] != 'WAITING':
+                raise self.exceptions.TaskTimedOut(f"Task token {token} is no longer waiting")
+            task.update(fields)
+            self._tasks_changed.notify_all()
+
+    def send_task_heartbeat(self, taskToken):
+        self._update_task(taskToken, heartbeat=time.monotonic())
+        return {}
+
+    def send_task_success(self, taskToken, output):
+        self._update_task(taskToken, status='SUCCEEDED', output=json.loads(output))
+        return {}
+
+    def send_task_failure(self, taskToken, error=None, cause=None):
+        self._update_task(taskToken, status='FAILED', error=error, cause=cause)
+        return {}
+
+    def wait_for_task(self, token, heartbeat_seconds, timeout_seconds):
+        """The task's output, as the waiting state would receive it.
+
+        Raises TaskTimedOut (States.Timeout) if the task misses a heartbeat
+        or runs out of time, and TaskFailed if it reports a failure.
+        """
+        deadline = time.monotonic() + timeout_seconds
+        with self._tasks_changed:
+            task = self.tasks[token]
+            while task['status'] == 'WAITING':
+                now = time.monotonic()
+                if now >= min(deadline, task['heartbeat'] + heartbeat_seconds):
+                    task['status'] = 'TIMED_OUT'
+                    raise self.exceptions.TaskTimedOut(f"Task token {token} timed out")
+                self._tasks_changed.wait(min(deadline, task['heartbeat'] + heartbeat_seconds) - now)
+            if task['status'] == 'FAILED':
+                raise self.TaskFailed(task['error'], task['cause'])
+            return task['output']
+
+
+class FakeSageMaker:
+    """Describes the processing jobs the orchestrator ran in-process."""
+
+    def __init__(self):
+        self.jobs = {}
+
+    def record_job(self, name, started, ended, instance_type='local', instance_count=1, status='Completed'):
+        # No provisioning locally: the job starts as soon as it is created
+        self.jobs[name] = {
+            'ProcessingJobName': name,
+            'ProcessingJobStatus': status,
+            'CreationTime': started,
+            'ProcessingStartTime': started,
+            'ProcessingEndTime': ended,
+            'ProcessingResources': {'ClusterConfig': {'InstanceType': instance_type, 'InstanceCount': instance_count}}
+        }
+
+    def describe_processing_job(self, ProcessingJobName):
+        if ProcessingJobName not in self.jobs:
+            raise ClientError(
+                {'Error': {'Code': 'ValidationException', 'Message': f'Could not find job {ProcessingJobName}'}},
+                'DescribeProcessingJob'
+            )
+        return dict(self.jobs[ProcessingJobName])
+
+    def list_processing_jobs(self, NameContains='', MaxResults=100):
+        summaries = [
+            {key: job[key] for key in ('ProcessingJobName', 'ProcessingJobStatus', 'CreationTime')}
+            for name, job in sorted(self.jobs.items()) if NameContains in name
+        ]
+        return {'ProcessingJobSummaries': summaries[:MaxResults]}
+
+
+class FakeDynamoDB:
+    """Item store understanding the condition and update expressions used by
+    start_query: attribute_not_exists, =, < joined by OR; SET and ADD."""
+
+    def __init__(self, key_attributes):
+        # Table name -> name of its partition key attribute
+        self.key_attributes = key_attributes
+        self.tables = {}
+        self.lock = threading.Lock()
+
+    def _key(self, Key):
+        return json.dumps(Key, sort_keys=True)
+
+    def _condition_holds(self, item, expression, values):
+        for clause in expression.split(' OR '):
+            clause = clause.strip()
+            match = re.fullmatch(r'attribute_not_exists\((\w+)\)', clause)
+            if match:
+                if item is None or match.group(1) not in item:
+                    return True
+                continue
+            name, operator, placeholder = clause.split()
+            if item is None or name not in item:
+                continue
+            actual, expected = item[name], values[placeholder]
+            if 'N' in expected:
+                actual, expected = float(actual['N']), float(expected['N'])
+            if (operator == '=' and actual == expected) or (operator == '<' and actual < expected):
+                return True
+        return False
+
+    def _check(self, item, ConditionExpression, ExpressionAttributeValues, operation):
+        if ConditionExpression and not self._condition_holds(item, ConditionExpression, ExpressionAttributeValues or {}):
+            raise ClientError(
+                {'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'The conditional request failed'}},
+                operation
+            )
+
+    def put_item(self, TableName, Item, ConditionExpression=None, ExpressionAttributeValues=None):
+        with self.lock:
+            table = self.tables.setdefault(TableName, {})
+            key_name = self.key_attributes[TableName]
+            key = self._key({key_name: Item[key_name]})
+            self._check(table.get(key), ConditionExpression, ExpressionAttributeValues, 'PutItem')
+            table[key] = dict(Item)
+        return {}
+
+    def get_item(self, TableName, Key, ConsistentRead=False):
+        item = self.tables.get(TableName, {}).get(self._key(Key))
+        return {'Item': dict(item)} if item else {}
+
+    def update_item(self, TableName, Key, UpdateExpression, ExpressionAttributeValues=None,
+                    ConditionExpression=None, **kwargs):
+        values = ExpressionAttributeValues or {}
+        with self.lock:
+            table = self.tables.setdefault(TableName, {})
+            key = self._key(Key)
+            self._check(table.get(key), ConditionExpression, values, 'UpdateItem')
+            item = table.setdefault(key, dict(Key))
+            action, name, placeholder = UpdateExpression.replace('=', ' ').split()
+            if action == 'ADD':
+                current = float(item.get(name, {'N': '0'})['N'])
+                item[name] = {'N': str(int(current + float(values[placeholder]['N'])))}
+            else:
+                item[name] = values[placeholder]
+        return {}
+
+    def delete_item(self, TableName, Key, ConditionExpression=None, ExpressionAttributeValues=None):
+        with self.lock:
+            table = self.tables.setdefault(TableName, {})
+            key = self._key(Key)
+            self._check(table.get(key), ConditionExpression, ExpressionAttributeValues, 'DeleteItem')
+            table.pop(key, None)
+        return {}
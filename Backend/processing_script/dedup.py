@@ -0,0 +1,142 @@
+import re
+import unicodedata
+import zlib
+
+import numpy as np
+
+# Collapses duplicate and near-duplicate comments before they are embedded.
+#
+# Each document is normalized first (case, punctuation, whitespace, and
+# answers like "N/A" or "none" dropped), so most duplicates are exact and
+# found with a dict. The rest are found with MinHash over character
+# shingles and LSH banding: a document whose estimated Jaccard similarity
+# to an earlier representative is at least NEAR_DUPLICATE_THRESHOLD joins
+# that representative's group, unless the two differ in their negations
+# ("would recommend" vs "would not recommend" share most shingles but mean
+# the opposite). Only representatives are embedded and clustered; rows take
+# their representative's cluster.
+
+NEAR_DUPLICATE_THRESHOLD = 0.8
+SHINGLE_CHARACTERS = 5
+# 32 bands of 4 rows: pairs from about 0.45 similarity become candidates,
+# which are then checked against the threshold
+NUM_PERMUTATIONS = 128
+BANDS = 32
+# Templated answers share bands with most other representatives; a full
+# bucket takes no more, which bounds the candidates of each document
+MAX_BUCKET_GROUPS = 16
+
+PLACEHOLDER_ANSWERS = {
+    'n a', 'na', 'none', 'nothing', 'no', 'nil', 'null', 'no comment', 'no comments', 'not applicable', 'nope'
+}
+
+# After normalization "don't" is "don t", so a lone "t" stands for n't
+NEGATION_TOKENS = {
+    'not', 'no', 'never', 'nor', 'none', 'nobody', 'nothing', 'nowhere', 'neither', 'cannot', 't',
+    'dont', 'doesnt', 'didnt', 'isnt', 'arent', 'wasnt', 'werent', 'cant', 'couldnt', 'wont', 'wouldnt',
+    'shouldnt', 'hasnt', 'havent', 'hadnt', 'aint'
+}
+
+_MERSENNE_PRIME = (1 << 31) - 1
+_random = np.random.RandomState(1)
+_A = _random.randint(1, _MERSENNE_PRIME, NUM_PERMUTATIONS).astype(np.uint64)
+_B = _random.randint(0, _MERSENNE_PRIME, NUM_PERMUTATIONS).astype(np.uint64)
+
+
+def normalize_answer(text):
+    text = unicodedata.normalize('NFKC', str(text)).lower()
+    text = ' '.join(re.sub(r'[^\w\s]', ' ', text).split())
+    return '' if text in PLACEHOLDER_ANSWERS else text
+
+
+def normalize_document(answers):
+    """One row's comment answers as a single normalized string."""
+    return ' '.join(answer for answer in map(normalize_answer, answers) if answer)
+
+
+def negations(text):
+    """The negation tokens of a normalized text, with their counts."""
+    return tuple(sorted(token for token in text.split() if token in NEGATION_TOKENS))
+
+
+def minhash(text):
+    if len(text) <= SHINGLE_CHARACTERS:
+        shingles = {text}
+    else:
+        shingles = {text[i:i + SHINGLE_CHARACTERS] for i in range(len(text) - SHINGLE_CHARACTERS + 1)}
+    hashes = np.array([zlib.crc32(shingle.encode('utf-8')) for shingle in shingles], dtype=np.uint64)
+    hashes %= _MERSENNE_PRIME
+    return ((_A[:, None] * hashes[None, :] + _B[:, None]) % _MERSENNE_PRIME).min(axis=1)
+
+
+class Deduplicator:
+    """Assigns documents to groups, in the order they are added.
+
+    Groups are numbered from 0; representatives[group] is the first document
+    added to the group, as given (not normalized).
+    """
+
+    def __init__(self, threshold=NEAR_DUPLICATE_THRESHOLD):
+        self.threshold = threshold
+        self.representatives = []
+        self._exact = {}
+        # Row g holds group g's signature (unused for the empty document)
+        self._signatures = np.zeros((1024, NUM_PERMUTATIONS), dtype=np.uint64)
+        self._negations = []
+        self._buckets = {}
+        self._rows_per_band = NUM_PERMUTATIONS // BANDS
+
+    def _bands(self, signature):
+        for band in range(BANDS):
+            rows = signature[band * self._rows_per_band:(band + 1) * self._rows_per_band]
+            yield band, rows.tobytes()
+
+    def _near_duplicate(self, signature, negated):
+        candidates = set()
+        for key in self._bands(signature):
+            candidates.update(self._buckets.get(key, ()))
+        if not candidates:
+            return None
+        candidates = np.array(sorted(candidates))
+        similarity = (self._signatures[candidates] == signature).mean(axis=1)
+        # The most similar representative that negates the same way
+        for best in np.argsort(-similarity, kind='stable'):
+            if similarity[best] < self.threshold:
+                break
+            if self._negations[candidates[best]] == negated:
+                return int(candidates[best])
+        return None
+
+    def add(self, document, normalized=None):
+        """The document's group."""
+        if normalized is None:
+            normalized = normalize_answer(document)
+        group = self._exact.get(normalized)
+        if group is not None:
+            return group
+
+        signature = minhash(normalized) if normalized else None
+        negated = negations(normalized)
+        if signature is not None and self.threshold < 1:
+            group = self._near_duplicate(signature, negated)
+        if group is None:
+            group = len(self.representatives)
+            self.representatives.append(document)
+            self._negations.append(negated)
+            if signature is not None:
+                if group == len(self._signatures):
+                    self._signatures = np.concatenate([self._signatures, np.zeros_like(self._signatures)])
+                self._signatures[group] = signature
+                for key in self._bands(signature):
+                    bucket = self._buckets.setdefault(key, [])
+                    if len(bucket) < MAX_BUCKET_GROUPS:
+                        bucket.append(group)
+        self._exact[normalized] = group
+        return group
+
+    def add_rows(self, documents, normalized_documents):
+        """Groups of many documents, as an array."""
+        return np.array(
+            [self.add(document, normalized) for document, normalized in zip(documents, normalized_documents)],
+            dtype=np.int64
+        )
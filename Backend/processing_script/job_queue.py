@@ -0,0 +1,129 @@
+import json
+import os
+import sqlite3
+import time
+import uuid
+from collections import namedtuple
+
+# Queue between the state machine and the processing workers.
+#
+# SQSJobQueue is what runs in AWS. SQLiteJobQueue is a stand-in with the same
+# semantics for local runs and tests: a received message is hidden for the
+# visibility timeout and comes back if it is not deleted in time, so a worker
+# that dies mid-job does not lose it.
+
+Message = namedtuple('Message', ['id', 'body', 'receipt'])
+
+DEFAULT_VISIBILITY_TIMEOUT_SECONDS = 300
+
+
+class SQSJobQueue:
+
+    def __init__(self, queue_url, client=None):
+        if client is None:
+            import boto3
+            client = boto3.client('sqs')
+        self.queue_url = queue_url
+        self.client = client
+
+    def send(self, body):
+        return self.client.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps(body))['MessageId']
+
+    def receive(self, wait_seconds=20, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT_SECONDS):
+        response = self.client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=1,
+            WaitTimeSeconds=int(min(wait_seconds, 20)),
+            VisibilityTimeout=visibility_timeout
+        )
+        for message in response.get('Messages', []):
+            return Message(message['MessageId'], json.loads(message['Body']), message['ReceiptHandle'])
+        return None
+
+    def extend(self, message, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT_SECONDS):
+        self.client.change_message_visibility(
+            QueueUrl=self.queue_url,
+            ReceiptHandle=message.receipt,
+            VisibilityTimeout=visibility_timeout
+        )
+
+    def delete(self, message):
+        self.client.delete_message(QueueUrl=self.queue_url, ReceiptHandle=message.receipt)
+
+
+class SQLiteJobQueue:
+
+    POLL_INTERVAL_SECONDS = 0.1
+
+    def __init__(self, path):
+        self.path = path
+        self._execute(
+            'CREATE TABLE IF NOT EXISTS messages '
+            '(id TEXT PRIMARY KEY, body TEXT, visible_at REAL, receipt TEXT, sent_at REAL)'
+        )
+
+    def _connect(self):
+        # A connection per call, so workers in other threads or processes can
+        # share the file
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def _execute(self, sql, parameters=()):
+        connection = self._connect()
+        try:
+            connection.execute(sql, parameters)
+        finally:
+            connection.close()
+
+    def send(self, body):
+        message_id = str(uuid.uuid4())
+        self._execute('INSERT INTO messages VALUES (?, ?, 0, NULL, ?)', (message_id, json.dumps(body), time.time()))
+        return message_id
+
+    def receive(self, wait_seconds=20, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT_SECONDS):
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            message = self._claim(visibility_timeout)
+            if message is not None or time.monotonic() >= deadline:
+                return message
+            time.sleep(self.POLL_INTERVAL_SECONDS)
+
+    def _claim(self, visibility_timeout):
+        connection = self._connect()
+        try:
+            # IMMEDIATE takes the write lock up front, so two workers cannot
+            # claim the same message
+            connection.execute('BEGIN IMMEDIATE')
+            now = time.time()
+            row = connection.execute(
+                'SELECT id, body FROM messages WHERE visible_at <= ? ORDER BY sent_at LIMIT 1', (now,)
+            ).fetchone()
+            if row is None:
+                connection.execute('COMMIT')
+                return None
+            receipt = str(uuid.uuid4())
+            connection.execute(
+                'UPDATE messages SET visible_at = ?, receipt = ? WHERE id = ?',
+                (now + visibility_timeout, receipt, row[0])
+            )
+            connection.execute('COMMIT')
+            return Message(row[0], json.loads(row[1]), receipt)
+        finally:
+            connection.close()
+
+    def extend(self, message, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT_SECONDS):
+        self._execute(
+            'UPDATE messages SET visible_at = ? WHERE id = ? AND receipt = ?',
+            (time.time() + visibility_timeout, message.id, message.receipt)
+        )
+
+    def delete(self, message):
+        self._execute('DELETE FROM messages WHERE id = ? AND receipt = ?', (message.id, message.receipt))
+
+
+def job_queue_from_url(url):
+    """SQLiteJobQueue for sqlite:///path/to/queue.db, SQSJobQueue otherwise."""
+    if url.startswith('sqlite:///'):
+        path = url[len('sqlite:///'):]
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        return SQLiteJobQueue(path)
+    return SQSJobQueue(url)
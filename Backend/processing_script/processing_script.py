@@ -1,30 +1,331 @@
 import argparse
+import csv
+import functools
+import gzip
+import hashlib
+import io
+import json
+import multiprocessing
 import os
+import queue
+import stat
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
 import pandas as pd
 import numpy as np
-from sklearn.preprocessing import StandardScaler
+from scipy import sparse
+from sklearn.preprocessing import StandardScaler, normalize
 from sklearn.cluster import DBSCAN
+from sklearn.decomposition import TruncatedSVD
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
 from sentence_transformers import SentenceTransformer
 import logging
+from dedup import Deduplicator, normalize_answer, normalize_document
 
-def main(input_data, output_data, object_name):
-    # parser = argparse.ArgumentParser()
-    # parser.add_argument('--input-data', type=str)
-    # parser.add_argument('--output-data', type=str)
-    # parser.add_argument('--object-name', type=str)
-    # args = parser.parse_args()
-    
-    # input_data_path = args.input_data
-    # output_data_path = args.output_data
-    # object_name = args.object_name
+MODES = ('all', 'embed', 'cluster')
+# 'question' clusters each comment column on its own, in a process per
+# column, instead of one document per row of all the answers together
+CLUSTER_BY = ('row', 'question')
+# Forked processes can hang in OpenMP once the parent has used it, as a
+# warm worker has; 'fork' suits a parent that never encodes or clusters
+QUESTION_START_METHOD = 'spawn'
+INPUT_SUFFIXES = ('.csv', '.csv.gz', '.csv.zst')
+RESOURCE_CONFIG = '/opt/ml/config/resourceconfig.json'
+MODEL_NAME = 'all-MiniLM-L6-v2'
+FEATURIZERS = ('transformer', 'lexical')
+# The lexical featurizer hashes word and bigram counts into LEXICAL_FEATURES
+# columns, which needs no vocabulary shared between chunks or shards, then
+# weights them by TF-IDF and reduces them to LEXICAL_DIMENSIONS with a
+# randomized SVD once every document is in
+LEXICAL_FEATURES = 2 ** 18
+LEXICAL_DIMENSIONS = 128
+# The SVD is fitted on a random sample of this many documents and applied
+# to all of them; fitting it on a million takes several times as long
+LEXICAL_FIT_DOCUMENTS = 100000
+LEXICAL_SEED = 0
+# Piped input is parsed and encoded in chunks of this many rows, with up to
+# STREAM_QUEUE_CHUNKS parsed ahead of the encoder
+STREAM_CHUNK_ROWS = 2000
+STREAM_QUEUE_CHUNKS = 4
+# With a checkpoint directory, sentence embeddings are encoded in batches of
+# at least this many documents, each saved with a marker naming what it
+# holds. SageMaker uploads the directory as it is written, and hands it
+# back to a retried job, which encodes only the batches not saved already.
+# Progress reports are also made per batch
+CHECKPOINT_DOCUMENTS = 20000
+# With a progress directory, each host keeps {mode}-{host}.json there up to
+# date for check_status: its stage, the rows encoded so far, their rate and
+# when it expects to finish encoding. SageMaker uploads it as it changes;
+# it is rewritten on every change of stage, and otherwise at most this often
+PROGRESS_INTERVAL_SECONDS = 10
+# Above --sample-size documents, clustering runs on a sample stratified by
+# these columns (where present) and assigns the rest to the nearest centroid
+STRATIFY_COLUMNS = ('hl1', 'region')
+SAMPLE_SEED = 0
+ASSIGN_BLOCK_ROWS = 50000
+# A sample's furthest member underestimates a cluster's extent; rows within
+# this many standard deviations of the members' mean distance also join it
+OUTLIER_STDS = 3
+# Per-question jobs write each question's clusters in the results and a
+# summary of them for generate_insights: the largest clusters with a
+# representative answer each, and some of the answers in no cluster
+SUMMARIES_FILE = 'cluster_summaries.json'
+SUMMARY_CLUSTERS = 50
+SUMMARY_UNIQUE_ANSWERS = 20
+# Written with the embed step's rows: the row's index into the host's
+# embeddings, which are one per deduplicated group
+DEDUP_GROUP_COLUMN = 'dedup_group'
+# The pipe carries no file names, so compression is told from the first bytes
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
 
-    # Input file path
-    input_file = os.path.join(input_data, object_name)
-    logging.info(f"Input file path: {input_file}")
-    
-    # Read CSV data
-    data = pd.read_csv(input_file)
+_model = None
+
+# Stage spans, written next to the results as trace_spans.jsonl for
+# generate_insights to add to the job's trace (the container has no exporter)
+SPANS_FILE = 'trace_spans.jsonl'
+
+
+class StageSpans:
+
+    def __init__(self, job_id):
+        self.trace_id = uuid.UUID(job_id).hex if job_id else None
+        self.spans = []
+
+    @contextmanager
+    def span(self, name, **attributes):
+        start = time.time_ns()
+        try:
+            yield attributes
+        finally:
+            end = time.time_ns()
+            logging.info(f"{name} took {(end - start) / 1e6:.0f} ms")
+            self.spans.append({
+                'trace_id': self.trace_id,
+                'span_id': uuid.uuid4().hex[:16],
+                'parent_span_id': None,
+                'name': name,
+                'service': 'processing_script',
+                'start_time_unix_nano': start,
+                'end_time_unix_nano': end,
+                'duration_ms': (end - start) / 1e6,
+                'status': 'OK',
+                'attributes': attributes
+            })
+
+    def write(self, output_data, file_name=SPANS_FILE):
+        if self.trace_id is None:
+            return
+        with open(os.path.join(output_data, file_name), 'w') as f:
+            for span in self.spans:
+                f.write(json.dumps(span) + '\n')
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobProgress:
+    """Reports the host's stage and encoding rate, see PROGRESS_INTERVAL_SECONDS.
+
+    Also where a cancelled job stops: with a cancelled event, every update
+    once it is set raises JobCancelled.
+    """
+
+    def __init__(self, directory=None, mode='all', host=None, cancelled=None):
+        self.cancelled = cancelled
+        self.path = directory and os.path.join(directory, f'{mode}-{host}.json')
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.mode = mode
+        self.host = host
+        self.stage = None
+        self.stage_started = None
+        self.rows_encoded = 0
+        self.rows_total = None
+        self.written = 0
+
+    def update(self, stage, rows_encoded=None, rows_total=None):
+        if self.cancelled is not None and self.cancelled.is_set():
+            raise JobCancelled(f"Cancelled while {self.stage or stage}")
+        if self.path is None:
+            return
+        now = time.time()
+        if rows_encoded is not None:
+            self.rows_encoded = rows_encoded
+        if rows_total is not None:
+            self.rows_total = rows_total
+        if stage != self.stage:
+            self.stage, self.stage_started = stage, now
+        elif now - self.written < PROGRESS_INTERVAL_SECONDS:
+            return
+        rate = None
+        if stage == 'encoding' and now > self.stage_started:
+            rate = self.rows_encoded / (now - self.stage_started)
+        eta = None
+        if rate and self.rows_total is not None:
+            eta = (self.rows_total - self.rows_encoded) / rate
+        with open(self.path, 'w') as f:
+            json.dump({
+                'mode': self.mode,
+                'host': self.host,
+                'stage': stage,
+                'rows_encoded': self.rows_encoded,
+                'rows_total': self.rows_total,
+                'rows_per_second': rate,
+                'eta_seconds': eta,
+                'updated_at': now
+            }, f)
+        self.written = now
+
+    def documents_encoded(self, done, total):
+        # A row is encoded with its group's document; counted pro rata
+        self.update('encoding', rows_encoded=(self.rows_total or 0) * done // total)
+
+
+def current_host():
+    # Written by SageMaker on every instance of a processing job
+    try:
+        with open(RESOURCE_CONFIG) as f:
+            return json.load(f)['current_host']
+    except (OSError, ValueError, KeyError):
+        return 'algo-1'
+
+
+def read_input(input_data, object_name, spans):
+    # One named file, or every shard this instance was given
+    if object_name and os.path.isfile(os.path.join(input_data, object_name)):
+        input_files = [os.path.join(input_data, object_name)]
+    else:
+        input_files = sorted(
+            os.path.join(input_data, name) for name in os.listdir(input_data)
+            if name.endswith(INPUT_SUFFIXES)
+        )
+    logging.info(f"Input files: {input_files}")
+
+    # Read CSV data; .gz and .zst inputs are decompressed while parsing
+    with spans.span('read_csv', files=len(input_files)) as attributes:
+        data = pd.concat(
+            [pd.read_csv(input_file, compression='infer') for input_file in input_files],
+            ignore_index=True
+        )
+        attributes['rows'] = len(data)
+    return data
+
+
+def input_pipes(input_data):
+    # In Pipe input mode SageMaker streams the channel's objects, back to
+    # back, into a named pipe instead of downloading them
+    candidates = [input_data, f'{input_data}_0']
+    if os.path.isdir(input_data):
+        candidates += [os.path.join(input_data, name) for name in sorted(os.listdir(input_data))]
+    return [path for path in candidates if os.path.exists(path) and stat.S_ISFIFO(os.stat(path).st_mode)]
+
+
+def open_stream(path):
+    raw = open(path, 'rb')
+    head = raw.peek(4)[:4]
+    # Concatenated gzip members and zstd frames decompress as one stream
+    if head.startswith(GZIP_MAGIC):
+        raw = gzip.GzipFile(fileobj=raw)
+    elif head.startswith(ZSTD_MAGIC):
+        import zstandard
+        raw = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+    return io.TextIOWrapper(raw, encoding='utf-8', newline='')
+
+
+def stream_chunks(paths, chunks, spans):
+    """Parse the piped CSV onto the chunks queue as DataFrames, then None."""
+    try:
+        with spans.span('read_csv', input_mode='Pipe', pipes=len(paths)) as attributes:
+            attributes['rows'] = 0
+            for path in paths:
+                with open_stream(path) as stream:
+                    reader = csv.reader(stream)
+                    header = next(reader, None)
+                    rows = []
+                    for row in reader:
+                        # Every shard object starts with the header again
+                        if row and row != header:
+                            rows.append(row)
+                        if len(rows) == STREAM_CHUNK_ROWS:
+                            chunks.put(pd.DataFrame(rows, columns=header))
+                            attributes['rows'] += len(rows)
+                            rows = []
+                    if rows:
+                        chunks.put(pd.DataFrame(rows, columns=header))
+                        attributes['rows'] += len(rows)
+        chunks.put(None)
+    except Exception as e:
+        chunks.put(e)
+
+
+def read_and_embed_stream(paths, spans, featurizer='transformer', checkpoints=None, progress=None):
+    # Parsing runs on its own thread, so the download overlaps the model load
+    # and the encoding of the chunks already read
+    chunks = queue.Queue(maxsize=STREAM_QUEUE_CHUNKS)
+    reader = threading.Thread(target=stream_chunks, args=(paths, chunks, spans), daemon=True)
+    reader.start()
 
+    if featurizer == 'lexical':
+        encode = hashed_counts
+    else:
+        with spans.span('load_model'):
+            model = load_model()
+        encode = functools.partial(model.encode, show_progress_bar=False)
+    # Checkpointed batches gather new groups over several chunks
+    batch = 1
+    if checkpoints is not None and featurizer != 'lexical':
+        encode = functools.partial(checkpoints.encode, encode=encode)
+        batch = CHECKPOINT_DOCUMENTS
+
+    # Deduplicated across chunks: each chunk encodes only the groups it starts
+    deduplicator = Deduplicator()
+    frames, groups, embeddings = [], [], []
+    encoded = 0
+    # The rows piped to this host are only counted at the end
+    progress = progress or JobProgress()
+    progress.update('encoding')
+    with spans.span('encode', input_mode='Pipe', featurizer=featurizer) as attributes:
+        while True:
+            chunk = chunks.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            if chunk is None:
+                break
+            groups.append(group_documents(chunk, comment_documents(chunk), deduplicator))
+            frames.append(chunk)
+            if len(deduplicator.representatives) - encoded >= batch:
+                embeddings.append(encode(deduplicator.representatives[encoded:]))
+                encoded = len(deduplicator.representatives)
+                progress.update('encoding', rows_encoded=sum(len(frame) for frame in frames))
+        if len(deduplicator.representatives) > encoded:
+            embeddings.append(encode(deduplicator.representatives[encoded:]))
+        attributes['rows'] = sum(len(frame) for frame in frames)
+        attributes['documents'] = len(deduplicator.representatives)
+        if batch > 1:
+            attributes['resumed_batches'] = checkpoints.resumed
+    reader.join()
+    if not frames:
+        raise ValueError(f"No rows in the piped input {paths}")
+    return pd.concat(frames, ignore_index=True), np.concatenate(groups), stack(embeddings)
+
+
+def stack(features):
+    return sparse.vstack(features, format='csr') if sparse.issparse(features[0]) else np.concatenate(features)
+
+
+def question_columns(data):
+    # Taken from the data: the Glue schema names them comment__reason_to_stay,
+    # comment__well-being_at_work, ... which the list in comment_documents
+    # never matched
+    return [column for column in data.columns if column.startswith('comment_')]
+
+
+def comment_documents(data):
     # List of comment columns
     # comment_columns = [
     #     'Comment: Reason to Stay',
@@ -36,15 +337,17 @@ def main(input_data, output_data, object_name):
     #     'Comment: What is important for us to know?'
     # ]
 
-    comment_columns = [
-        'comment_reason_to_stay',
-        'comment_reason_to_leave',
-        'comment_well_being_at_work',
-        'comment_well_being_outside_work',
-        'comment_burnout_reason',
-        'comment_burnout_improvement',
-        'comment_what_is_important_for_us_to_know'
-    ]
+    # comment_columns = [
+    #     'comment_reason_to_stay',
+    #     'comment_reason_to_leave',
+    #     'comment_well_being_at_work',
+    #     'comment_well_being_outside_work',
+    #     'comment_burnout_reason',
+    #     'comment_burnout_improvement',
+    #     'comment_what_is_important_for_us_to_know'
+    # ]
+
+    comment_columns = question_columns(data)
     
     # Fill NaN values and combine comments
     data[comment_columns] = data[comment_columns].fillna('')
@@ -53,22 +356,330 @@ def main(input_data, output_data, object_name):
     # Remove rows with empty combined comments
     # data = data[data['combined_comments'].str.strip() != '']
     data.reset_index(drop=True, inplace=True)
-    
+    return data[comment_columns].agg(' '.join, axis=1).tolist()
+
+
+def group_documents(data, documents, deduplicator):
+    # Normalized per answer, so an "N/A" in one column does not make two
+    # otherwise identical rows differ
+    comment_columns = question_columns(data)
+    normalized = [normalize_document(answers) for answers in data[comment_columns].itertuples(index=False)]
+    return deduplicator.add_rows(documents, normalized)
+
+
+def deduplicate(data, documents, spans):
+    """Each row's group, and the documents that represent the groups."""
+    deduplicator = Deduplicator()
+    with spans.span('dedup', rows=len(documents)) as attributes:
+        groups = group_documents(data, documents, deduplicator)
+        attributes['documents'] = len(deduplicator.representatives)
+    return groups, deduplicator.representatives
+
+
+def load_model():
+    # Kept for the life of the process, so a long-lived worker loads it once
+    global _model
+    if _model is None:
+        _model = SentenceTransformer(MODEL_NAME)
+    return _model
+
+
+class EmbeddingCheckpoints:
+    """Saved batches of sentence embeddings: written to output_dir, and
+    read back from input_dir, where an earlier attempt's were downloaded."""
+
+    def __init__(self, output_dir, input_dir=None):
+        self.output_dir = output_dir
+        self.input_dir = input_dir
+        self.batches = 0
+        self.resumed = 0
+
+    def scope(self, name):
+        return EmbeddingCheckpoints(os.path.join(self.output_dir, name),
+                                    self.input_dir and os.path.join(self.input_dir, name))
+
+    def saved(self, name, digest, documents):
+        # None unless the batch was finished, for these same documents
+        if not self.input_dir:
+            return None
+        try:
+            with open(os.path.join(self.input_dir, f'{name}.json')) as f:
+                marker = json.load(f)
+            if marker['digest'] != digest:
+                return None
+            embeddings = np.load(os.path.join(self.input_dir, f'{name}.npy'))
+        except (OSError, ValueError, KeyError):
+            return None
+        return embeddings if len(embeddings) == documents else None
+
+    def encode(self, documents, encode):
+        name = f'batch-{self.batches:05d}'
+        self.batches += 1
+        digest = hashlib.sha256('\x1e'.join(documents).encode('utf-8')).hexdigest()
+        embeddings = self.saved(name, digest, len(documents))
+        if embeddings is not None:
+            # Uploaded by the attempt that encoded it
+            self.resumed += 1
+            return embeddings
+        embeddings = encode(documents)
+        os.makedirs(self.output_dir, exist_ok=True)
+        np.save(os.path.join(self.output_dir, f'{name}.npy'), embeddings)
+        # The marker goes last, so a batch cut short is never resumed
+        with open(os.path.join(self.output_dir, f'{name}.json'), 'w') as f:
+            json.dump({'digest': digest, 'documents': len(documents)}, f)
+        return embeddings
+
+
+def embed(documents, spans, checkpoints=None, on_batch=None):
     # Load pre-trained model
-    model = SentenceTransformer('all-MiniLM-L6-v2')
+    with spans.span('load_model'):
+        model = load_model()
     
     # Compute embeddings
-    documents = data[comment_columns].agg(' '.join, axis=1).tolist()
-    embeddings = model.encode(documents, show_progress_bar=True)
-    
+    with spans.span('encode', documents=len(documents)) as attributes:
+        if (checkpoints is None and on_batch is None) or not documents:
+            return model.encode(documents, show_progress_bar=True)
+        encode = functools.partial(model.encode, show_progress_bar=True)
+        if checkpoints is not None:
+            encode = functools.partial(checkpoints.encode, encode=encode)
+        batches = []
+        for start in range(0, len(documents), CHECKPOINT_DOCUMENTS):
+            batches.append(encode(documents[start:start + CHECKPOINT_DOCUMENTS]))
+            if on_batch is not None:
+                on_batch(start + len(batches[-1]), len(documents))
+        if checkpoints is not None:
+            attributes['resumed_batches'] = checkpoints.resumed
+        return np.concatenate(batches)
+
+
+def hashed_counts(documents):
+    vectorizer = HashingVectorizer(n_features=LEXICAL_FEATURES, ngram_range=(1, 2), alternate_sign=False,
+                                   norm=None, dtype=np.float32)
+    return vectorizer.transform(documents)
+
+
+def featurize(documents, spans, featurizer='transformer', checkpoints=None, on_batch=None):
+    """Sentence embeddings, or sparse hashed counts for the lexical featurizer.
+
+    Only sentence embeddings are checkpointed; hashing is quicker than
+    reading the counts back.
+    """
+    if featurizer == 'lexical':
+        with spans.span('encode', documents=len(documents), featurizer=featurizer):
+            return hashed_counts(documents)
+    return embed(documents, spans, checkpoints, on_batch)
+
+
+def lexical_vectors(counts, spans):
+    """Dense, unit-length TF-IDF + SVD vectors of the hashed counts."""
+    with spans.span('reduce', documents=counts.shape[0]) as attributes:
+        tfidf = TfidfTransformer(sublinear_tf=True).fit_transform(counts)
+        fit = tfidf
+        if tfidf.shape[0] > LEXICAL_FIT_DOCUMENTS:
+            rng = np.random.RandomState(LEXICAL_SEED)
+            fit = tfidf[np.sort(rng.choice(tfidf.shape[0], LEXICAL_FIT_DOCUMENTS, replace=False))]
+        # Only the hashed columns that occur in the fitted documents, so the
+        # SVD's random projections are not LEXICAL_FEATURES wide; the rest
+        # would get no weight in the components anyway
+        columns = np.unique(fit.indices)
+        if len(columns) <= LEXICAL_DIMENSIONS:
+            # Already no wider than the SVD would make it
+            vectors = normalize(tfidf[:, columns]).toarray() if len(columns) else np.zeros((tfidf.shape[0], 1))
+        else:
+            dimensions = min(LEXICAL_DIMENSIONS, fit.shape[0])
+            svd = TruncatedSVD(dimensions, algorithm='randomized', random_state=LEXICAL_SEED).fit(fit[:, columns])
+            vectors = normalize(svd.transform(tfidf[:, columns]))
+            attributes['explained_variance'] = float(svd.explained_variance_ratio_.sum())
+        attributes['dimensions'] = vectors.shape[1]
+    return vectors
+
+
+def clustering_vectors(features, spans):
+    """The vectors to cluster, and whether to standardize them first."""
+    # SVD components come ordered by the variance they explain; scaling them
+    # to unit variance would weigh the noise like the topics
+    if sparse.issparse(features):
+        return lexical_vectors(features, spans), False
+    return features, True
+
+
+def cluster_features(data, groups, features, output_data, spans, sample_size=0):
+    vectors, standardize = clustering_vectors(features, spans)
+    cluster_and_write(data, groups, vectors, output_data, spans, sample_size, standardize)
+
+
+def read_embedded_shards(input_data, spans, per_question=False):
+    """The rows the embed step wrote, and each question's (groups, features).
+
+    The embed step wrote {host}.csv per instance, the rows with the group of
+    each, and {host}.npy, the embeddings of the groups ({host}.npz, the
+    hashed counts, for the lexical featurizer). Per-question jobs have a
+    group column and a {host}.{question}.npy per comment column instead;
+    the question is None for the rows' combined comments.
+    """
+    hosts = sorted(name[:-len('.csv')] for name in os.listdir(input_data) if name.endswith('.csv'))
+    frames, groups, features = [], {}, {}
+    with spans.span('merge', instances=len(hosts)) as attributes:
+        for host in hosts:
+            frame = pd.read_csv(os.path.join(input_data, f'{host}.csv'))
+            if not frames:
+                for question in question_columns(frame) if per_question else [None]:
+                    groups[question], features[question] = [], []
+            for question in groups:
+                host_groups = frame.pop(dedup_group_column(question)).to_numpy()
+                # Group numbers are per host; offset them past the earlier hosts'
+                offset = sum(f.shape[0] for f in features[question])
+                groups[question].append(np.where(host_groups >= 0, host_groups + offset, -1))
+                path = features_path(input_data, features_name(host, question))
+                if path:
+                    features[question].append(sparse.load_npz(path) if path.endswith('.npz') else np.load(path))
+            frames.append(frame)
+        data = pd.concat(frames, ignore_index=True)
+        attributes['rows'] = len(data)
+    return data, {
+        question: (np.concatenate(groups[question]), stack(features[question]) if features[question] else None)
+        for question in groups
+    }
+
+
+def dedup_group_column(question=None):
+    return DEDUP_GROUP_COLUMN if question is None else f'{DEDUP_GROUP_COLUMN}_{question}'
+
+
+def features_name(host, question=None):
+    return host if question is None else f'{host}.{question}'
+
+
+def features_path(directory, name):
+    for suffix in ('.npy', '.npz'):
+        if os.path.exists(os.path.join(directory, name + suffix)):
+            return os.path.join(directory, name + suffix)
+    return None
+
+
+def write_features(directory, name, features):
+    # The SVD is fitted over every shard's counts in the cluster step
+    if sparse.issparse(features):
+        sparse.save_npz(os.path.join(directory, f'{name}.npz'), features)
+    else:
+        np.save(os.path.join(directory, f'{name}.npy'), features)
+
+
+def group_strata(data, groups, columns=STRATIFY_COLUMNS):
+    """Each group's stratum, from the values of its first row."""
+    columns = [column for column in columns if column in data.columns]
+    first_rows = np.unique(groups, return_index=True)[1]
+    if not columns:
+        return np.zeros(len(first_rows), dtype=np.int64)
+    keys = data[columns].iloc[first_rows].astype(str).agg('|'.join, axis=1)
+    return pd.factorize(keys)[0]
+
+
+def stratified_sample(strata, weights, size, seed=SAMPLE_SEED):
+    """Indices of about size groups, allotted to the strata by their share of
+    the rows (at least one each) and drawn in proportion to group size."""
+    rng = np.random.RandomState(seed)
+    order = np.argsort(strata, kind='stable')
+    boundaries = np.flatnonzero(np.diff(strata[order])) + 1
+    total = weights.sum()
+    chosen = []
+    for members in np.split(order, boundaries):
+        share = max(1, int(round(size * weights[members].sum() / total)))
+        if share >= len(members):
+            chosen.append(members)
+        else:
+            p = weights[members] / weights[members].sum()
+            chosen.append(rng.choice(members, share, replace=False, p=p))
+    return np.sort(np.concatenate(chosen))
+
+
+def _unit_rows(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def nearest_centroid_labels(embeddings, scaler, members, member_labels, member_weights):
+    """The cluster of each embedding's nearest centroid by cosine distance,
+    or -1 if it is further from it than the cluster's members are."""
+    clustered = member_labels >= 0
+    clusters, index = np.unique(member_labels[clustered], return_inverse=True)
+    labels = np.full(len(embeddings), -1)
+    if len(clusters) == 0:
+        return labels
+
+    sums = np.zeros((len(clusters), members.shape[1]))
+    np.add.at(sums, index, members[clustered] * member_weights[clustered, None])
+    centroids = _unit_rows(sums)
+    distances = 1 - np.einsum('ij,ij->i', _unit_rows(members[clustered]), centroids[index])
+    counts = np.bincount(index)
+    mean = np.bincount(index, distances) / counts
+    std = np.sqrt(np.maximum(np.bincount(index, distances ** 2) / counts - mean ** 2, 0))
+    radii = mean + OUTLIER_STDS * std
+    np.maximum.at(radii, index, distances)
+
+    for start in range(0, len(embeddings), ASSIGN_BLOCK_ROWS):
+        block = _unit_rows(scaler.transform(embeddings[start:start + ASSIGN_BLOCK_ROWS]))
+        similarity = block @ centroids.T
+        nearest = similarity.argmax(axis=1)
+        distance = 1 - similarity[np.arange(len(block)), nearest]
+        labels[start:start + len(block)] = np.where(distance <= radii[nearest], clusters[nearest], -1)
+    return labels
+
+
+def cluster_labels(embeddings, weights, strata=None, sample_size=0, standardize=True):
+    """DBSCAN cluster of each embedding, -1 for noise, and the indices that
+    were clustered (None for all).
+
+    With sample_size, only a stratified sample of about that many is
+    clustered and the rest are assigned to the nearest cluster, so the cost
+    stays flat as the data grows. standardize scales each dimension to unit
+    variance first.
+    """
+    sampled = None
+    if sample_size and len(embeddings) > sample_size:
+        if strata is None:
+            strata = np.zeros(len(embeddings), dtype=np.int64)
+        sampled = stratified_sample(strata, weights, sample_size)
+    members = embeddings if sampled is None else embeddings[sampled]
+    member_weights = weights if sampled is None else weights[sampled]
+
     # Normalize embeddings
-    scaler = StandardScaler()
-    embeddings_scaled = scaler.fit_transform(embeddings)
-    
+    scaler = StandardScaler(with_mean=standardize, with_std=standardize)
+    embeddings_scaled = scaler.fit_transform(members, sample_weight=member_weights)
+
     # Perform DBSCAN clustering
     dbscan = DBSCAN(eps=0.5, min_samples=2, metric='cosine')
-    clusters = dbscan.fit_predict(embeddings_scaled)
-    
+    member_labels = dbscan.fit_predict(embeddings_scaled, sample_weight=member_weights)
+    if sampled is None:
+        return member_labels, None
+
+    rest = np.setdiff1d(np.arange(len(embeddings)), sampled)
+    labels = np.empty(len(embeddings), dtype=member_labels.dtype)
+    labels[sampled] = member_labels
+    labels[rest] = nearest_centroid_labels(embeddings[rest], scaler, embeddings_scaled, member_labels, member_weights)
+    return labels, sampled
+
+
+def row_clusters(data, groups, embeddings, spans, sample_size=0, standardize=True):
+    # One embedding per group, weighted by the group's rows, so a comment
+    # repeated by several rows still forms a cluster of its own
+    weights = np.bincount(groups, minlength=len(embeddings))
+    with spans.span('cluster', documents=len(embeddings)) as attributes:
+        strata = group_strata(data, groups) if sample_size and len(embeddings) > sample_size else None
+        labels, sampled = cluster_labels(embeddings, weights, strata, sample_size, standardize)
+        clusters = labels[groups]
+        attributes['clusters'] = len(set(clusters) - {-1})
+        attributes['noise'] = int((clusters == -1).sum())
+        if sampled is not None:
+            attributes['sampled'] = len(sampled)
+            attributes['strata'] = int(strata.max()) + 1
+    return clusters
+
+
+def cluster_and_write(data, groups, embeddings, output_data, spans, sample_size=0, standardize=True):
+    clusters = row_clusters(data, groups, embeddings, spans, sample_size, standardize)
+
     # Add cluster labels to data
     data['cluster'] = clusters
     
@@ -79,14 +690,280 @@ def main(input_data, output_data, object_name):
     output_csv = os.path.join(output_data, 'clustered_results.csv')
     
     # Save the data with cluster labels
-    data.to_csv(output_csv, index=False)
+    with spans.span('write_csv'):
+        data.to_csv(output_csv, index=False)
+
+
+def read_stream(paths, spans):
+    chunks = queue.Queue(maxsize=STREAM_QUEUE_CHUNKS)
+    reader = threading.Thread(target=stream_chunks, args=(paths, chunks, spans), daemon=True)
+    reader.start()
+    frames = []
+    while True:
+        chunk = chunks.get()
+        if isinstance(chunk, Exception):
+            raise chunk
+        if chunk is None:
+            break
+        frames.append(chunk)
+    reader.join()
+    if not frames:
+        raise ValueError(f"No rows in the piped input {paths}")
+    return pd.concat(frames, ignore_index=True)
+
+
+def featurize_question(data, question, spans, featurizer='transformer', checkpoints=None):
+    """The group of each row's answer to the question (-1 if it gave none),
+    and the groups' features (None if no row did)."""
+    answers = data[question].fillna('').astype(str).tolist()
+    normalized = [normalize_answer(answer) for answer in answers]
+    answered = np.flatnonzero([bool(answer) for answer in normalized])
+    groups = np.full(len(answers), -1, dtype=np.int64)
+    deduplicator = Deduplicator()
+    with spans.span('dedup', rows=len(answered)) as attributes:
+        groups[answered] = deduplicator.add_rows([answers[i] for i in answered], [normalized[i] for i in answered])
+        attributes['documents'] = len(deduplicator.representatives)
+    if not deduplicator.representatives:
+        return groups, None
+    return groups, featurize(deduplicator.representatives, spans, featurizer, checkpoints)
+
+
+def question_clusters(data, groups, features, spans, sample_size=0):
+    # -1 (noise) or the cluster of the rows that answered; NA for the rest
+    clusters = pd.array([pd.NA] * len(groups), dtype='Int64')
+    answered = np.flatnonzero(groups >= 0)
+    if len(answered):
+        vectors, standardize = clustering_vectors(features, spans)
+        clusters[answered] = row_clusters(data.iloc[answered], groups[answered], vectors, spans, sample_size,
+                                          standardize)
+    return clusters
+
+
+def run_question(question, data, mode, output_data, host, featurizer, sample_size, job_id, checkpoints,
+                 groups=None, features=None):
+    spans = StageSpans(job_id)
+    if mode != 'cluster':
+        groups, features = featurize_question(data, question, spans, featurizer, checkpoints)
+    clusters = None
+    if mode == 'embed':
+        if features is not None:
+            write_features(output_data, features_name(host, question), features)
+    else:
+        clusters = question_clusters(data, groups, features, spans, sample_size)
+    for span in spans.spans:
+        span['attributes']['question'] = question
+    return groups, clusters, spans.spans
+
+
+def limit_threads(threads):
+    # Otherwise every process encodes with as many threads as there are cores
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(threads)
+
+
+def run_questions(data, questions, mode, output_data, spans, host=None, featurizer='transformer', sample_size=0,
+                  features=None, job_id=None, checkpoints=None, on_question=None):
+    """{question: (groups, clusters)}, each question run in its own process.
+
+    on_question(done, total) is called as each question finishes.
+    """
+    processes = min(len(questions), os.cpu_count() or 1)
+    strata_columns = [column for column in STRATIFY_COLUMNS if column in data.columns]
+    tasks = [
+        (question, data[[question] + strata_columns], mode, output_data, host, featurizer, sample_size, job_id,
+         checkpoints and checkpoints.scope(question), *(features[question] if features else ()))
+        for question in questions
+    ]
+    with spans.span('questions', questions=len(questions), processes=processes):
+        if processes > 1:
+            pool = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context(QUESTION_START_METHOD),
+                                       initializer=limit_threads,
+                                       initargs=(max(1, (os.cpu_count() or 1) // processes),))
+            with pool:
+                futures = [pool.submit(run_question, *task) for task in tasks]
+                for done, _ in enumerate(as_completed(futures), 1):
+                    if on_question is not None:
+                        on_question(done, len(tasks))
+                runs = [future.result() for future in futures]
+        else:
+            runs = []
+            for task in tasks:
+                runs.append(run_question(*task))
+                if on_question is not None:
+                    on_question(len(runs), len(tasks))
+    results = {}
+    for question, (groups, clusters, question_spans) in zip(questions, runs):
+        spans.spans.extend(question_spans)
+        results[question] = (groups, clusters)
+    return results
+
+
+def question_summaries(data, results):
+    summaries = []
+    for question, (groups, clusters) in results.items():
+        answers = data[question].fillna('').astype(str)
+        labels = clusters.to_numpy(dtype=np.int64, na_value=-2)
+        clustered = np.flatnonzero(labels >= 0)
+        cluster_ids, first_rows, sizes = np.unique(labels[clustered], return_index=True, return_counts=True)
+        largest = np.argsort(-sizes, kind='stable')[:SUMMARY_CLUSTERS]
+        unique_rows = np.flatnonzero(labels == -1)
+        summaries.append({
+            'question': question,
+            'answered': int((groups >= 0).sum()),
+            'clusters': [
+                {
+                    'cluster': int(cluster_ids[i]),
+                    'rows': int(sizes[i]),
+                    'representative': answers.iloc[clustered[first_rows[i]]]
+                }
+                for i in largest
+            ],
+            'cluster_count': len(cluster_ids),
+            'unique_rows': len(unique_rows),
+            'unique_answers': answers.iloc[unique_rows[:SUMMARY_UNIQUE_ANSWERS]].tolist()
+        })
+    return {'questions': summaries}
+
+
+def process_questions(input_data, output_data, object_name, job_id, mode, host, sample_size, featurizer, spans,
+                      checkpoints=None, progress=None):
+    """main for cluster_by 'question': the same steps, per comment column."""
+    features = None
+    if mode == 'cluster':
+        data, features = read_embedded_shards(input_data, spans, per_question=True)
+    else:
+        pipes = input_pipes(input_data)
+        data = read_stream(pipes, spans) if pipes else read_input(input_data, object_name, spans)
+    if mode == 'embed':
+        host = host or current_host()
+    questions = question_columns(data)
+    if not questions:
+        raise ValueError("No comment columns to cluster")
+    # Each question's process encodes and clusters it; rows are counted
+    # encoded pro rata as the questions finish
+    progress = progress or JobProgress()
+    stage = 'clustering' if mode == 'cluster' else 'encoding'
+    progress.update(stage, rows_encoded=0, rows_total=len(data))
+    results = run_questions(data, questions, mode, output_data, spans, host, featurizer, sample_size, features,
+                            job_id, checkpoints,
+                            lambda done, total: progress.update(stage, rows_encoded=len(data) * done // total))
+
+    if mode == 'embed':
+        with spans.span('write_embeddings'):
+            groups = {dedup_group_column(question): results[question][0] for question in questions}
+            data.assign(**groups).to_csv(os.path.join(output_data, f'{host}.csv'), index=False)
+        spans.write(output_data, f'trace_spans-{host}.jsonl')
+        progress.update('done')
+        return
+
+    for question in questions:
+        clusters = results[question][1]
+        data[f'cluster_{question}'] = clusters
+        data[f'is_unique_{question}'] = (clusters == -1).fillna(False).astype(bool)
+    with spans.span('write_csv'):
+        data.to_csv(os.path.join(output_data, 'clustered_results.csv'), index=False)
+        with open(os.path.join(output_data, SUMMARIES_FILE), 'w') as f:
+            json.dump(question_summaries(data, results), f)
+    spans.write(output_data)
+    progress.update('done')
+
+
+def main(input_data, output_data, object_name=None, job_id=None, mode='all', host=None, sample_size=0,
+         featurizer='transformer', cluster_by='row', checkpoint_output=None, checkpoint_input=None,
+         progress_output=None, cancelled=None):
+    """Embed and cluster the filtered rows.
+
+    The input is files in input_data, or a named pipe in Pipe input mode.
+    mode 'all' does both on one instance. Sharded jobs run 'embed' on every
+    instance of one job, each writing its shards' rows and embeddings, then
+    'cluster' on a single instance over everything the embed job wrote.
+    Duplicate comments are embedded and clustered once (see dedup.py).
+    sample_size caps how many are clustered (0 for no cap). featurizer
+    'lexical' replaces the sentence embeddings with TF-IDF + SVD vectors;
+    the 'cluster' step tells it from the files the embed step wrote.
+    cluster_by 'question' clusters each comment column separately (see
+    process_questions). With checkpoint_output, sentence embeddings are
+    saved there in batches as they are encoded, and batches an earlier
+    attempt saved in checkpoint_input are not encoded again (see
+    EmbeddingCheckpoints). With progress_output, the host reports how far it
+    has got there (see JobProgress). Once the cancelled event is set, the job
+    raises JobCancelled at its next batch or stage.
+    """
+    spans = StageSpans(job_id)
+    checkpoints = None
+    if checkpoint_output and mode != 'cluster':
+        host = host or current_host()
+        checkpoints = EmbeddingCheckpoints(os.path.join(checkpoint_output, host),
+                                           checkpoint_input and os.path.join(checkpoint_input, host))
+    if progress_output:
+        host = host or current_host()
+    progress = JobProgress(progress_output, mode, host, cancelled)
+    progress.update('loading')
+    # parser = argparse.ArgumentParser()
+    # parser.add_argument('--input-data', type=str)
+    # parser.add_argument('--output-data', type=str)
+    # parser.add_argument('--object-name', type=str)
+    # args = parser.parse_args()
+    
+    # input_data_path = args.input_data
+    # output_data_path = args.output_data
+    # object_name = args.object_name
+
+    if cluster_by == 'question':
+        process_questions(input_data, output_data, object_name, job_id, mode, host, sample_size, featurizer, spans,
+                          checkpoints, progress)
+        return
+
+    if mode == 'cluster':
+        data, shards = read_embedded_shards(input_data, spans)
+        groups, features = shards[None]
+        progress.update('clustering')
+        cluster_features(data, groups, features, output_data, spans, sample_size)
+        spans.write(output_data)
+        progress.update('done')
+        return
+
+    pipes = input_pipes(input_data)
+    if pipes:
+        data, groups, features = read_and_embed_stream(pipes, spans, featurizer, checkpoints, progress)
+    else:
+        data = read_input(input_data, object_name, spans)
+        groups, documents = deduplicate(data, comment_documents(data), spans)
+        progress.update('encoding', rows_encoded=0, rows_total=len(data))
+        features = featurize(documents, spans, featurizer, checkpoints, progress.documents_encoded)
+
+    if mode == 'embed':
+        host = host or current_host()
+        with spans.span('write_embeddings'):
+            data.assign(**{DEDUP_GROUP_COLUMN: groups}).to_csv(os.path.join(output_data, f'{host}.csv'), index=False)
+            write_features(output_data, features_name(host), features)
+        spans.write(output_data, f'trace_spans-{host}.jsonl')
+        progress.update('done', rows_encoded=len(data), rows_total=len(data))
+        return
+
+    progress.update('clustering', rows_encoded=len(data), rows_total=len(data))
+    cluster_features(data, groups, features, output_data, spans, sample_size)
+    spans.write(output_data)
+    progress.update('done')
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process employee survey data.")
     parser.add_argument('--input-data', type=str, required=True, help="Path to input data directory.")
     parser.add_argument('--output-data', type=str, required=True, help="Path to output data directory.")
-    parser.add_argument('--object-name', type=str, required=True, help="Name of the input file to process.")
-    # parser.add_argument('--job-id', type=str, required=True, help="Job ID for naming output files.")
+    parser.add_argument('--object-name', type=str, help="Name of the input file to process (default: every CSV in --input-data).")
+    parser.add_argument('--job-id', type=str, help="Job ID, for the job's trace.")
+    parser.add_argument('--mode', choices=MODES, default='all', help="Step of a sharded job, or all of it.")
+    parser.add_argument('--sample-size', type=int, default=0, help="Most documents to cluster; the rest are assigned to the nearest cluster (default: no limit).")
+    parser.add_argument('--featurizer', choices=FEATURIZERS, default='transformer', help="Sentence embeddings, or TF-IDF + SVD for quick exploratory jobs.")
+    parser.add_argument('--cluster-by', choices=CLUSTER_BY, default='row', help="Cluster each row's comments together, or each comment column on its own.")
+    parser.add_argument('--checkpoint-output', type=str, help="Directory to save encoded batches in as they finish.")
+    parser.add_argument('--checkpoint-input', type=str, help="Batches saved by an earlier attempt at the job, to resume from.")
+    parser.add_argument('--progress-output', type=str, help="Directory to report the job's stage and encoding rate in.")
     args = parser.parse_args()
 
-    main(args.input_data, args.output_data, args.object_name)
\ No newline at end of file
+    main(args.input_data, args.output_data, args.object_name, args.job_id, args.mode, sample_size=args.sample_size,
+         featurizer=args.featurizer, cluster_by=args.cluster_by, checkpoint_output=args.checkpoint_output,
+         checkpoint_input=args.checkpoint_input, progress_output=args.progress_output)
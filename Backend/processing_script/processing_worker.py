@@ -0,0 +1,181 @@
+"""Long-lived embed-and-cluster worker.
+
+Runs processing_script in a loop with the embedding model loaded once, taking
+jobs from the queue the state machine's SubmitToWorkerPool state writes to.
+Each message carries a task token; the worker heartbeats it while the job
+runs and reports success or failure with it, which resumes the execution.
+
+    PROCESSING_QUEUE_URL=https://sqs.us-west-2.amazonaws.com/... python processing_worker.py
+    PROCESSING_QUEUE_URL=sqlite:///queue.db python processing_worker.py
+
+If no worker heartbeats a task in time, the state machine falls back to a
+SageMaker processing job; a worker that picks up such a message late finds
+its token expired and drops it.
+
+A job cancelled while it runs (cancel_query writes a marker next to its
+output, and stops the execution so the token expires) is stopped at its next
+batch or stage, between heartbeats.
+"""
+import json
+import logging
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+from datetime import datetime, timezone
+
+import processing_script
+from job_queue import job_queue_from_url
+
+HEARTBEAT_INTERVAL_SECONDS = int(os.environ.get('WORKER_HEARTBEAT_SECONDS', '20'))
+VISIBILITY_TIMEOUT_SECONDS = 120
+# Recorded next to the results; generate_insights turns it into spans
+TIMINGS_FILE = 'worker.json'
+# Written to the job's output prefix by cancel_query
+CANCEL_MARKER = 'cancelled'
+
+
+class ProcessingWorker:
+
+    def __init__(self, queue, s3, stepfunctions, name=None, heartbeat_seconds=HEARTBEAT_INTERVAL_SECONDS):
+        self.queue = queue
+        self.s3 = s3
+        self.stepfunctions = stepfunctions
+        self.name = name or socket.gethostname()
+        self.heartbeat_seconds = heartbeat_seconds
+        self.stopping = threading.Event()
+
+    def warm_up(self):
+        # The first job should not pay the model load
+        processing_script.load_model()
+
+    def run_forever(self, wait_seconds=20):
+        while not self.stopping.is_set():
+            self.run_once(wait_seconds)
+
+    def run_once(self, wait_seconds=20):
+        """Process one message, if one arrives within wait_seconds."""
+        message = self.queue.receive(wait_seconds, VISIBILITY_TIMEOUT_SECONDS)
+        if message is None:
+            return False
+        try:
+            self.process(message)
+        finally:
+            self.queue.delete(message)
+        return True
+
+    def process(self, message):
+        job = message.body
+        token = job['task_token']
+        started_at = datetime.now(timezone.utc)
+        try:
+            self.stepfunctions.send_task_heartbeat(taskToken=token)
+        except Exception as e:
+            # The execution stopped waiting: it fell back to SageMaker,
+            # failed or was cancelled
+            logging.warning(f"Dropping job {job['job_id']}: {e}")
+            return
+
+        done = threading.Event()
+        cancelled = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(message, job, done, cancelled), daemon=True)
+        heartbeat.start()
+        try:
+            if self._is_cancelled(job):
+                cancelled.set()
+            self._run_job(job, started_at, cancelled)
+        except processing_script.JobCancelled as e:
+            logging.warning(f"Job {job['job_id']} was cancelled: {e}")
+            done.set()
+            try:
+                # Normally the execution is already stopped and the token with it
+                self.stepfunctions.send_task_failure(taskToken=token, error='JobCancelled', cause=str(e))
+            except Exception:
+                pass
+            return
+        except Exception as e:
+            logging.exception(f"Job {job['job_id']} failed")
+            done.set()
+            self.stepfunctions.send_task_failure(taskToken=token, error='ProcessingWorkerError', cause=str(e)[:32768])
+            return
+        finally:
+            done.set()
+            heartbeat.join()
+        self.stepfunctions.send_task_success(taskToken=token, output=json.dumps({
+            'job_id': job['job_id'],
+            'worker': self.name,
+            'output_prefix': job['output_prefix']
+        }))
+
+    def _heartbeat(self, message, job, done, cancelled):
+        while not done.wait(self.heartbeat_seconds):
+            try:
+                self.stepfunctions.send_task_heartbeat(taskToken=job['task_token'])
+                self.queue.extend(message, VISIBILITY_TIMEOUT_SECONDS)
+            except self.stepfunctions.exceptions.TaskTimedOut:
+                # Nothing waits for the result any more
+                cancelled.set()
+            except Exception as e:
+                logging.warning(f"Heartbeat failed: {e}")
+            if self._is_cancelled(job):
+                cancelled.set()
+
+    def _is_cancelled(self, job):
+        try:
+            self.s3.head_object(Bucket=job['bucket'], Key=f"{job['output_prefix']}{CANCEL_MARKER}")
+        except Exception:
+            return False
+        return True
+
+    def _run_job(self, job, started_at, cancelled=None):
+        bucket = job['bucket']
+        work_dir = tempfile.mkdtemp(prefix=f"job-{job['job_id']}-")
+        try:
+            input_dir = os.path.join(work_dir, 'input')
+            output_dir = os.path.join(work_dir, 'output')
+            os.makedirs(input_dir)
+            os.makedirs(output_dir)
+
+            listing = self.s3.list_objects_v2(Bucket=bucket, Prefix=job['input_prefix'])
+            for item in listing.get('Contents', []):
+                with open(os.path.join(input_dir, item['Key'].rsplit('/', 1)[1]), 'wb') as f:
+                    shutil.copyfileobj(self.s3.get_object(Bucket=bucket, Key=item['Key'])['Body'], f)
+
+            processing_script.main(input_dir, output_dir, job_id=job['job_id'], mode='all',
+                                   sample_size=job.get('cluster_sample_size', 0),
+                                   featurizer=job.get('featurizer', 'transformer'),
+                                   cluster_by=job.get('cluster_by', 'row'), cancelled=cancelled)
+
+            with open(os.path.join(output_dir, TIMINGS_FILE), 'w') as f:
+                json.dump({
+                    'worker': self.name,
+                    'submitted_at': job.get('submitted_at'),
+                    'started_at': started_at.isoformat(),
+                    'ended_at': datetime.now(timezone.utc).isoformat()
+                }, f)
+            for name in sorted(os.listdir(output_dir)):
+                with open(os.path.join(output_dir, name), 'rb') as f:
+                    self.s3.put_object(Bucket=bucket, Key=f"{job['output_prefix']}{name}", Body=f)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    import boto3
+    logging.basicConfig(level=logging.INFO)
+    worker = ProcessingWorker(
+        job_queue_from_url(os.environ['PROCESSING_QUEUE_URL']),
+        boto3.client('s3'),
+        boto3.client('stepfunctions')
+    )
+    # ECS sends SIGTERM on scale-in and deploys; finish the current job
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stopping.set())
+    worker.warm_up()
+    logging.info(f"Worker {worker.name} ready")
+    worker.run_forever()
+
+
+if __name__ == '__main__':
+    main()
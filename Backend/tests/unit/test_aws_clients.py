@@ -0,0 +1,35 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "lambda_layers", "common", "python"))
+
+import aws_clients
+
+
+def test_clients_are_created_once_per_service_and_region():
+    created = []
+    aws_clients.set_client_factory(lambda service, region: created.append((service, region)) or object())
+    try:
+        s3 = aws_clients.get_client("s3")
+        assert aws_clients.get_client("s3") is s3
+        assert aws_clients.get_client("s3", region_name="us-east-1") is not s3
+        assert created == [("s3", None), ("s3", "us-east-1")]
+    finally:
+        aws_clients.set_client_factory(None)
+
+
+def test_concurrent_first_use_creates_one_client():
+    created = []
+    aws_clients.set_client_factory(lambda service, region: created.append(service) or object())
+    try:
+        clients = []
+        threads = [threading.Thread(target=lambda: clients.append(aws_clients.get_client("athena"))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert created == ["athena"]
+        assert len({id(client) for client in clients}) == 1
+    finally:
+        aws_clients.set_client_factory(None)
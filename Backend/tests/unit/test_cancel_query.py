@@ -0,0 +1,146 @@
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("boto3")
+from botocore.exceptions import ClientError
+
+HERE = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(HERE, "..", "..", "lambda_layers", "common", "python"))
+sys.path.insert(0, os.path.join(HERE, "..", "..", "lambda_functions", "cancel_query"))
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-west-2")
+os.environ.setdefault("STEP_FUNCTION_ARN", "arn:aws:states:us-west-2:123456789012:stateMachine:test")
+os.environ.setdefault("INFLIGHT_JOBS_TABLE", "inflight")
+os.environ.setdefault("BUCKET_NAME", "test-bucket")
+os.environ["JOB_REGISTRY_BACKEND"] = "memory"
+
+import cancel_query
+
+
+class FakeStepFunctions:
+    class exceptions:
+        class ExecutionDoesNotExist(Exception):
+            pass
+
+    def __init__(self):
+        self.stopped = []
+
+    def stop_execution(self, executionArn, error, cause):
+        self.stopped.append(executionArn)
+
+
+class FakeAthena:
+    def __init__(self, states):
+        self.states = states
+        self.stopped = []
+
+    def get_query_execution(self, QueryExecutionId):
+        return {"QueryExecution": {"Status": {"State": self.states[QueryExecutionId]}}}
+
+    def stop_query_execution(self, QueryExecutionId):
+        self.stopped.append(QueryExecutionId)
+
+
+class FakeSageMaker:
+    def __init__(self, in_progress):
+        self.in_progress = in_progress
+        self.stopped = []
+
+    def list_processing_jobs(self, NameContains, StatusEquals, MaxResults):
+        names = [name for name in self.in_progress if NameContains in name]
+        return {"ProcessingJobSummaries": [{"ProcessingJobName": name} for name in names]}
+
+    def stop_processing_job(self, ProcessingJobName):
+        self.stopped.append(ProcessingJobName)
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[(Bucket, Key)] = Body
+
+
+class FakeDynamoDB:
+    def __init__(self, subscribers):
+        self.subscribers = subscribers
+
+    def update_item(self, TableName, Key, UpdateExpression, ConditionExpression, ExpressionAttributeValues):
+        if self.subscribers <= 1:
+            raise ClientError({"Error": {"Code": "ConditionalCheckFailedException", "Message": ""}}, "UpdateItem")
+        self.subscribers -= 1
+
+
+@pytest.fixture
+def clients(monkeypatch):
+    fakes = {
+        "stepfunctions": FakeStepFunctions(),
+        "athena": FakeAthena({"query-1": "RUNNING", "query-2": "SUCCEEDED"}),
+        "sagemaker": FakeSageMaker(["processing-job-job-embed-0", "processing-job-job-1", "processing-job-other-0"]),
+        "dynamodb": FakeDynamoDB(subscribers=1),
+        "s3": FakeS3(),
+    }
+    for name, fake in fakes.items():
+        monkeypatch.setattr(cancel_query, name, fake)
+    cancel_query.registry.jobs.clear()
+    return fakes
+
+
+def cancel(job_id):
+    result = cancel_query.lambda_handler({"body": json.dumps({"job_id": job_id})}, None)
+    return result["statusCode"], json.loads(result["body"])
+
+
+def test_cancel_stops_everything_the_job_runs(clients):
+    registry = cancel_query.registry
+    registry.update_stage("job", "SUBMITTED", execution_arn="arn:execution:job", request_key="key")
+    registry.update_stage("job", "FILTERING", athena_query_execution_id="query-1")
+    registry.update_stage("job", "CLUSTERING")
+
+    status_code, body = cancel("job")
+    assert status_code == 200
+    assert body["status"] == "CANCELLED"
+    assert clients["stepfunctions"].stopped == ["arn:execution:job"]
+    assert clients["athena"].stopped == ["query-1"]
+    assert clients["sagemaker"].stopped == ["processing-job-job-embed-0", "processing-job-job-1"]
+    # For a worker from the pool running the job
+    assert ("test-bucket", "processed/job/cancelled") in clients["s3"].objects
+
+    registry.record_result("job", "SUCCEEDED", output={"summary": "late"})
+    assert registry.get("job")["status"] == "CANCELLED"
+    assert cancel("job")[0] == 409
+
+
+def test_finished_athena_query_is_left_alone(clients):
+    cancel_query.registry.update_stage("job", "CLUSTERING", athena_query_execution_id="query-2")
+    status_code, body = cancel("job")
+    assert status_code == 200
+    assert body["stopped"]["athena_queries"] == []
+
+
+def test_shared_job_keeps_running_for_the_other_requests(clients):
+    clients["dynamodb"].subscribers = 2
+    cancel_query.registry.update_stage("job", "CLUSTERING", request_key="key")
+
+    status_code, body = cancel("job")
+    assert status_code == 200
+    assert body["shared"] is True
+    assert cancel_query.registry.get("job")["status"] == "RUNNING"
+    assert clients["stepfunctions"].stopped == []
+    assert clients["s3"].objects == {}
+
+    # The last request to leave cancels it
+    assert cancel("job")[1]["status"] == "CANCELLED"
+    assert clients["stepfunctions"].stopped
+
+
+def test_unknown_and_finished_jobs_are_rejected(clients):
+    assert cancel("missing")[0] == 404
+    cancel_query.registry.record_result("done", "SUCCEEDED", output={"summary": "ok"})
+    assert cancel("done")[0] == 409
+    result = cancel_query.lambda_handler({"body": "{}"}, None)
+    assert result["statusCode"] == 400
@@ -0,0 +1,189 @@
+import base64
+import gzip
+import io
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("boto3")
+
+HERE = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(HERE, "..", "..", "lambda_layers", "common", "python"))
+sys.path.insert(0, os.path.join(HERE, "..", "..", "lambda_functions", "check_status"))
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-west-2")
+os.environ.setdefault("STEP_FUNCTION_ARN", "arn:aws:states:us-west-2:123456789012:stateMachine:test")
+os.environ.setdefault("BUCKET_NAME", "test-bucket")
+os.environ["JOB_REGISTRY_BACKEND"] = "memory"
+
+import check_status
+
+
+class FailingStepFunctions:
+    # Any Step Functions call means the registry was bypassed
+    def describe_execution(self, **kwargs):
+        raise AssertionError("describe_execution should not be called")
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+        self.listings = 0
+
+    def get_object(self, Bucket, Key):
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def list_objects_v2(self, Bucket, Prefix=""):
+        self.listings += 1
+        keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix))
+        return {"Contents": [{"Key": key} for key in keys]} if keys else {"KeyCount": 0}
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn):
+        return f"https://{Params['Bucket']}.s3.amazonaws.com/{Params['Key']}?signed"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    fake = FakeS3()
+    monkeypatch.setattr(check_status, "s3", fake)
+    return fake
+
+
+@pytest.fixture
+def registry(monkeypatch, s3):
+    registry = check_status.registry
+    registry.jobs.clear()
+    monkeypatch.setattr(check_status, "stepfunctions", FailingStepFunctions())
+    monkeypatch.setattr(check_status, "LONG_POLL_INTERVAL_SECONDS", 0.01)
+    return registry
+
+
+def call(params):
+    result = check_status.lambda_handler({"queryStringParameters": params}, None)
+    return result["statusCode"], json.loads(result["body"])
+
+
+def test_finished_job_is_served_from_the_registry(registry):
+    registry.record_result("done", "SUCCEEDED", output={"summary": "ok", "insights": []})
+    status_code, body = call({"jobId": "done"})
+    assert status_code == 200
+    assert body["status"] == "SUCCEEDED"
+    assert body["output"]["summary"] == "ok"
+
+
+def test_running_job_reports_its_stage(registry):
+    registry.update_stage("running", "FILTERING")
+    status_code, body = call({"jobId": "running"})
+    assert status_code == 200
+    assert body["stage"] == "FILTERING"
+    assert body["state"] == "RUNNING:FILTERING"
+
+
+def test_batch_returns_every_job(registry):
+    registry.update_stage("a", "CLUSTERING")
+    registry.record_result("b", "FAILED", error="InvalidQuery", cause="Invalid query.")
+    status_code, body = call({"jobIds": "a,b"})
+    assert status_code == 200
+    assert [job["job_id"] for job in body["jobs"]] == ["a", "b"]
+    assert body["jobs"][0]["state"] == "RUNNING:CLUSTERING"
+    assert body["jobs"][1]["error"] == "InvalidQuery"
+
+
+def test_long_poll_returns_when_the_state_differs_from_since(registry):
+    registry.update_stage("job", "GENERATING_INSIGHTS")
+    status_code, body = call({"jobId": "job", "waitSeconds": "5", "since": "RUNNING:CLUSTERING"})
+    assert status_code == 200
+    assert body["state"] == "RUNNING:GENERATING_INSIGHTS"
+
+
+def test_long_poll_times_out_without_a_change(registry):
+    registry.update_stage("job", "CLUSTERING")
+    status_code, body = call({"jobId": "job", "waitSeconds": "0.05"})
+    assert status_code == 200
+    assert body["state"] == "RUNNING:CLUSTERING"
+
+
+def test_long_poll_reads_progress_once(registry, s3):
+    registry.update_stage("job", "CLUSTERING")
+    status_code, body = call({"jobId": "job", "waitSeconds": "0.1"})
+    assert body["progress"] == {"stage": "provisioning"}
+    assert s3.listings == 1
+
+
+def report_progress(s3, job_id, mode, host, stage, rows_encoded=0, rows_total=None, rows_per_second=None):
+    s3.objects[("test-bucket", f"processed/{job_id}/progress/{mode}-{host}.json")] = json.dumps({
+        "mode": mode, "host": host, "stage": stage, "rows_encoded": rows_encoded, "rows_total": rows_total,
+        "rows_per_second": rows_per_second, "eta_seconds": None, "updated_at": 1700000000.0
+    }).encode("utf-8")
+
+
+def test_clustering_job_reports_its_hosts_progress(registry, s3):
+    registry.update_stage("job", "CLUSTERING", row_count=10000)
+    _, body = call({"jobId": "job"})
+    assert body["progress"] == {"stage": "provisioning"}
+
+    report_progress(s3, "job", "embed", "algo-1", "encoding", 3000, rows_per_second=100.0)
+    report_progress(s3, "job", "embed", "algo-2", "clustering", 5000, 5000)
+    _, body = call({"jobId": "job"})
+    assert body["state"] == "RUNNING:CLUSTERING"
+    progress = body["progress"]
+    assert (progress["stage"], progress["hosts"], progress["rows_encoded"], progress["rows_total"]) == (
+        "encoding", 2, 8000, 10000
+    )
+    assert progress["rows_per_second"] == 100.0
+    assert progress["eta_seconds"] == 20.0
+
+
+def test_merge_job_progress_follows_the_embed_job(registry, s3):
+    registry.update_stage("job", "CLUSTERING", row_count=10000)
+    report_progress(s3, "job", "embed", "algo-1", "done", 5000, 5000)
+    report_progress(s3, "job", "embed", "algo-2", "done", 5000, 5000)
+    _, body = call({"jobId": "job"})
+    assert body["progress"] == {"stage": "provisioning"}
+
+    report_progress(s3, "job", "cluster", "algo-1", "clustering")
+    _, body = call({"jobId": "job"})
+    assert body["progress"]["stage"] == "clustering"
+    assert body["progress"]["rows_encoded"] == 10000
+    assert "eta_seconds" not in body["progress"]
+
+
+def store(s3, registry, job_id, insights):
+    payload = json.dumps(insights).encode("utf-8")
+    key = f"results/{job_id}/insights.json.gz"
+    s3.objects[("test-bucket", key)] = gzip.compress(payload)
+    registry.record_result(job_id, "SUCCEEDED", result_location={
+        "bucket": "test-bucket", "key": key, "size": len(payload)
+    })
+
+
+def test_stored_result_is_inlined_or_linked(registry, s3):
+    insights = {"summary": "ok", "insights": [{"insight": "x"}]}
+    store(s3, registry, "stored", insights)
+
+    _, body = call({"jobId": "stored"})
+    assert body["output"] == insights
+
+    _, body = call({"jobId": "stored", "format": "url"})
+    assert "output" not in body
+    assert body["output_url"].endswith("results/stored/insights.json.gz?signed")
+
+    _, body = call({"jobIds": "stored"})
+    assert "output_url" in body["jobs"][0]
+
+
+def test_gzip_format_wraps_the_stored_result(registry, s3):
+    insights = {"summary": "ok", "insights": []}
+    store(s3, registry, "stored", insights)
+
+    result = check_status.lambda_handler({"queryStringParameters": {"jobId": "stored", "format": "gzip"}}, None)
+    assert result["isBase64Encoded"] is True
+    body = json.loads(gzip.decompress(base64.b64decode(result["body"])))
+    assert body == {"status": "SUCCEEDED", "output": insights}
+
+
+def test_missing_job_id_is_rejected(registry):
+    status_code, body = call({})
+    assert status_code == 400
@@ -0,0 +1,120 @@
+import json
+import os
+import sys
+import threading
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+pytest.importorskip("sklearn")
+pytest.importorskip("sentence_transformers")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "processing_script"))
+
+import processing_script
+from processing_script import EmbeddingCheckpoints, StageSpans
+
+DOCUMENTS = [
+    "Pay is too low", "Long night shifts", "Great team", "Flexible schedule", "Not enough parking",
+    "Manager never listens", "Career growth is slow", "Too much paperwork", "Good benefits", "Understaffed every weekend",
+]
+
+
+class CountingModel:
+    """Stands in for the sentence transformer; fails after `fail_after` calls."""
+
+    def __init__(self, fail_after=None):
+        self.encoded = []
+        self.fail_after = fail_after
+
+    def encode(self, documents, show_progress_bar=False):
+        if self.fail_after is not None and len(self.encoded) == self.fail_after:
+            raise RuntimeError("instance lost")
+        self.encoded.append(list(documents))
+        return np.array([[len(document), sum(map(ord, document))] for document in documents], dtype=np.float32)
+
+
+@pytest.fixture(autouse=True)
+def small_batches(monkeypatch):
+    monkeypatch.setattr(processing_script, "CHECKPOINT_DOCUMENTS", 4)
+
+
+def embed(monkeypatch, model, checkpoints, documents=DOCUMENTS, on_batch=None):
+    monkeypatch.setattr(processing_script, "_model", model)
+    return processing_script.embed(documents, StageSpans(None), checkpoints, on_batch)
+
+
+def test_a_retry_encodes_only_the_batches_not_saved(tmp_path, monkeypatch):
+    with pytest.raises(RuntimeError):
+        embed(monkeypatch, CountingModel(fail_after=2), EmbeddingCheckpoints(str(tmp_path / "first")))
+    assert sorted(os.listdir(tmp_path / "first")) == [
+        "batch-00000.json", "batch-00000.npy", "batch-00001.json", "batch-00001.npy"
+    ]
+
+    retry = CountingModel()
+    embeddings = embed(monkeypatch, retry, EmbeddingCheckpoints(str(tmp_path / "second"), str(tmp_path / "first")))
+    assert retry.encoded == [DOCUMENTS[8:]]
+    assert np.array_equal(embeddings, embed(monkeypatch, CountingModel(), None))
+
+
+def test_batches_of_other_documents_or_cut_short_are_encoded_again(tmp_path, monkeypatch):
+    embed(monkeypatch, CountingModel(), EmbeddingCheckpoints(str(tmp_path / "first")))
+    with open(tmp_path / "first" / "batch-00002.npy", "r+b") as f:
+        f.truncate(20)
+
+    retry = CountingModel()
+    changed = DOCUMENTS[:4] + ["a different comment"] + DOCUMENTS[5:]
+    embed(monkeypatch, retry, EmbeddingCheckpoints(str(tmp_path / "second"), str(tmp_path / "first")), changed)
+    assert retry.encoded == [changed[4:8], changed[8:]]
+
+
+def test_main_resumes_from_the_hosts_checkpoints(tmp_path, monkeypatch):
+    rows = pd.DataFrame({"hl1": "Nursing", "comment__reason_to_leave": DOCUMENTS * 2})
+    input_dir, checkpoints = tmp_path / "input", tmp_path / "checkpoints"
+    input_dir.mkdir()
+    rows.to_csv(input_dir / "part-0.csv", index=False)
+
+    def run(model, output):
+        monkeypatch.setattr(processing_script, "_model", model)
+        output.mkdir()
+        processing_script.main(str(input_dir), str(output), mode="embed", host="algo-2",
+                               checkpoint_output=str(checkpoints), checkpoint_input=str(checkpoints))
+        return np.load(output / "algo-2.npy")
+
+    first = run(CountingModel(), tmp_path / "first")
+    assert os.path.exists(checkpoints / "algo-2" / "batch-00002.json")
+    retry = CountingModel()
+    assert np.array_equal(run(retry, tmp_path / "second"), first)
+    assert retry.encoded == []
+
+
+def test_progress_is_reported_per_batch(tmp_path, monkeypatch):
+    monkeypatch.setattr(processing_script, "PROGRESS_INTERVAL_SECONDS", 0)
+    progress = processing_script.JobProgress(str(tmp_path), "embed", "algo-1")
+    progress.update("encoding", rows_encoded=0, rows_total=20)
+    reports = []
+
+    def on_batch(done, total):
+        progress.documents_encoded(done, total)
+        with open(tmp_path / "embed-algo-1.json") as f:
+            reports.append(json.load(f))
+
+    embed(monkeypatch, CountingModel(), None, DOCUMENTS, on_batch)
+    assert [report["rows_encoded"] for report in reports] == [8, 16, 20]
+    assert all(report["stage"] == "encoding" and report["rows_total"] == 20 for report in reports)
+    assert reports[-1]["eta_seconds"] in (None, 0)
+
+
+def test_a_cancelled_job_stops_at_the_next_batch(monkeypatch):
+    cancelled = threading.Event()
+    progress = processing_script.JobProgress(cancelled=cancelled)
+    model = CountingModel()
+
+    def on_batch(done, total):
+        progress.documents_encoded(done, total)
+        cancelled.set()
+
+    with pytest.raises(processing_script.JobCancelled):
+        embed(monkeypatch, model, None, DOCUMENTS, on_batch)
+    assert model.encoded == [DOCUMENTS[:4], DOCUMENTS[4:8]]
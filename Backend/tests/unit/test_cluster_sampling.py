@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("pandas")
+pytest.importorskip("sklearn")
+pytest.importorskip("sentence_transformers")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "processing_script"))
+
+from processing_script import cluster_labels, stratified_sample
+
+
+def test_sample_covers_every_stratum_in_proportion():
+    strata = np.array([0] * 900 + [1] * 90 + [2] * 10)
+    weights = np.ones(len(strata), dtype=np.int64)
+    sampled = stratified_sample(strata, weights, 100)
+    assert np.bincount(strata[sampled]).tolist() == [90, 9, 1]
+    assert len(set(sampled)) == len(sampled)
+
+
+def test_unsampled_points_join_the_nearest_cluster_or_are_noise():
+    rng = np.random.RandomState(0)
+    centers = rng.randn(3, 16)
+    points = np.vstack([center + rng.randn(300, 16) * 0.1 for center in centers])
+    outlier = -centers.sum(axis=0, keepdims=True)
+    embeddings = np.vstack([points, outlier])
+    weights = np.ones(len(embeddings), dtype=np.int64)
+
+    labels, sampled = cluster_labels(embeddings, weights, sample_size=100)
+    assert len(sampled) == 100
+    # The same three clusters, up to numbering, with few rows left as noise
+    found = set()
+    for cluster in range(3):
+        members = labels[cluster * 300:(cluster + 1) * 300]
+        assert (members == -1).mean() < 0.05
+        assert len(set(members) - {-1}) == 1
+        found |= set(members) - {-1}
+    assert len(found) == 3
+    assert labels[-1] == -1
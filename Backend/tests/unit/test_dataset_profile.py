@@ -0,0 +1,88 @@
+import gzip
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "lambda_functions", "profile_dataset"))
+
+from dataset_profile import filter_value_index, iter_decompressed, iter_lines, profile_csv
+
+HEADERS = ["ID", "Market", "Region", "Comment: Reason to Stay", "Comment: Burnout Reason"]
+
+CSV = (
+    "ID,Market,Region,Comment: Reason to Stay,Comment: Burnout Reason\r\n"
+    "1,West,Pacific,\"Great team, good pay\",\r\n"
+    "2,West,Mountain,,\"Long shifts\nno breaks\"\r\n"
+    "3,East,Atlantic,Flexible hours,Staffing\r\n"
+).encode("utf-8")
+
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def test_profile_is_independent_of_chunk_boundaries():
+    profiles = [profile_csv(iter_lines(chunked(CSV, size)), HEADERS) for size in (1, 7, 64, len(CSV))]
+    assert all(profile == profiles[0] for profile in profiles)
+
+    profile = profiles[0]
+    assert profile["valid"]
+    assert profile["row_count"] == 3
+    assert profile["malformed_rows"] == 0
+    assert profile["filter_values"]["market"]["values"] == ["East", "West"]
+    assert profile["filter_values"]["region"]["values"] == ["Atlantic", "Mountain", "Pacific"]
+    assert "id" not in profile["filter_values"]
+    rates = profile["comment_null_rates"]
+    assert rates["comment__reason_to_stay"] == 1 / 3
+    assert rates["comment__burnout_reason"] == 1 / 3
+
+
+def test_header_mismatch_is_reported():
+    data = b"ID,Market\n1,West\n"
+    profile = profile_csv(iter_lines([data]), HEADERS)
+    assert not profile["valid"]
+    assert "Header does not match" in profile["errors"][0]
+
+
+def test_malformed_rows_and_high_cardinality_columns():
+    rows = ["ID,Market,Region,Comment: Reason to Stay,Comment: Burnout Reason"]
+    rows += [f"{i},M{i},R,a,b" for i in range(20)]
+    rows.append("21,West")
+    profile = profile_csv(iter_lines(["\n".join(rows).encode("utf-8")]), HEADERS, max_distinct_values=10)
+    assert profile["malformed_rows"] == 1
+    assert not profile["valid"]
+    assert profile["filter_values"]["market"] == {"truncated": True, "values": [], "row_counts": {}}
+    assert profile["filter_values"]["region"]["values"] == ["R"]
+
+
+def test_empty_file():
+    profile = profile_csv(iter_lines([b""]), HEADERS)
+    assert not profile["valid"]
+    assert profile["row_count"] == 0
+
+
+def test_gzip_upload_profiles_like_plain_csv():
+    # Two members back to back, as written by pigz or by concatenating files
+    compressed = gzip.compress(CSV[:50]) + gzip.compress(CSV[50:])
+    expected = profile_csv(iter_lines([CSV]), HEADERS)
+    for size in (1, 13, len(compressed)):
+        chunks = iter_decompressed(chunked(compressed, size), "gzip")
+        assert profile_csv(iter_lines(chunks), HEADERS) == expected
+
+
+def test_truncated_gzip_is_rejected():
+    compressed = gzip.compress(CSV)
+    with pytest.raises(ValueError):
+        b"".join(iter_decompressed([compressed[:-10]], "gzip"))
+
+
+def test_filter_value_index_has_row_counts():
+    profile = profile_csv(iter_lines([CSV + b"4,West,Pacific,ok\r\n"]), HEADERS)
+    index = filter_value_index(profile, "v1")
+    assert index["dataset_version"] == "v1"
+    assert index["row_count"] == 3
+    assert index["columns"]["market"] == {
+        "truncated": False,
+        "values": [{"value": "East", "rows": 1}, {"value": "West", "rows": 2}],
+    }
@@ -0,0 +1,90 @@
+import io
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "lambda_layers", "common", "python"))
+
+from datasets import (
+    ACTIVE_POINTER_KEY,
+    activate_version,
+    compression_for_key,
+    dataset_file_name,
+    dataset_object_key,
+    filter_index_key,
+    load_filter_index,
+    new_dataset_version,
+    read_active_version,
+    validate_dataset_version,
+    version_from_key,
+)
+
+
+class FakeS3:
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self):
+        self.objects = {}
+        self.gets = 0
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[(Bucket, Key)] = Body
+
+    def get_object(self, Bucket, Key):
+        self.gets += 1
+        if (Bucket, Key) not in self.objects:
+            raise self.exceptions.NoSuchKey()
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
+
+
+def test_new_versions_are_unique_and_valid():
+    a, b = new_dataset_version(), new_dataset_version()
+    assert a != b
+    assert validate_dataset_version(a) == a
+    assert dataset_object_key(a, "survey.csv") == f"raw/dataset_version={a}/survey.csv"
+    assert version_from_key(dataset_object_key(a, "survey.csv.gz")) == a
+    with pytest.raises(ValueError):
+        version_from_key("raw/survey.csv")
+
+
+@pytest.mark.parametrize("version", [None, "", "latest", "v1'; DROP TABLE x; --", "../raw"])
+def test_malformed_versions_are_rejected(version):
+    with pytest.raises(ValueError):
+        dataset_object_key(version, "survey.csv")
+
+
+def test_compressed_uploads_keep_their_extension():
+    assert dataset_file_name("survey.csv") == "survey.csv"
+    assert dataset_file_name("survey.csv", "gzip") == "survey.csv.gz"
+    assert compression_for_key("raw/dataset_version=v/survey.csv.zst") == "zstd"
+    assert compression_for_key("raw/dataset_version=v/survey.csv") is None
+    with pytest.raises(ValueError):
+        dataset_file_name("survey.csv", "bzip2")
+
+
+def test_activation_replaces_the_pointer():
+    s3 = FakeS3()
+    assert read_active_version(s3, "bucket") is None
+
+    first, second = new_dataset_version(), new_dataset_version()
+    activate_version(s3, "bucket", first)
+    activate_version(s3, "bucket", second)
+
+    pointer = read_active_version(s3, "bucket")
+    assert pointer["dataset_version"] == second
+    assert pointer["manifest_key"] == f"datasets/{second}/manifest.json"
+    assert json.loads(s3.objects[("bucket", ACTIVE_POINTER_KEY)])["dataset_version"] == second
+
+
+def test_filter_index_is_read_once_per_version():
+    s3 = FakeS3()
+    version = new_dataset_version()
+    s3.put_object("bucket", filter_index_key(version), json.dumps({"columns": {}}).encode())
+
+    assert load_filter_index(s3, "bucket", version) == {"columns": {}}
+    assert load_filter_index(s3, "bucket", version) == {"columns": {}}
+    assert s3.gets == 1
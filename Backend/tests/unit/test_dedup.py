@@ -0,0 +1,59 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("numpy")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "processing_script"))
+
+from dedup import Deduplicator, normalize_document
+
+
+def test_normalization_drops_placeholders_case_and_punctuation():
+    assert normalize_document(["N/A", "  Great TEAM!! ", "none", ""]) == "great team"
+    assert normalize_document(["-", "No comment."]) == ""
+
+
+def test_exact_and_near_duplicates_share_a_group():
+    deduplicator = Deduplicator()
+    documents = [
+        "The night shift is always understaffed and exhausting",
+        "the night shift is always understaffed & exhausting!",
+        "Pay is too low",
+        "PAY IS TOO LOW.",
+        "N/A",
+        "",
+    ]
+    groups = deduplicator.add_rows(documents, [normalize_document([d]) for d in documents])
+    assert groups.tolist() == [0, 0, 1, 1, 2, 2]
+    assert deduplicator.representatives == [documents[0], documents[2], documents[4]]
+
+
+def test_different_answers_stay_apart():
+    deduplicator = Deduplicator()
+    documents = ["pay is too low", "pay is fair for the work", "long shifts and no breaks"]
+    groups = deduplicator.add_rows(documents, [normalize_document([d]) for d in documents])
+    assert groups.tolist() == [0, 1, 2]
+
+
+def test_answers_that_differ_by_a_negation_stay_apart():
+    deduplicator = Deduplicator()
+    documents = [
+        "The pay is fair for the work we do here",
+        "The pay is not fair for the work we do here",
+        "I would recommend this hospital to a friend",
+        "I would not recommend this hospital to a friend",
+        "I wouldn't recommend this hospital to a friend",
+        "I would never recommend this hospital to a friend!",
+        "The pay is fair for the work we do here.",
+    ]
+    groups = deduplicator.add_rows(documents, [normalize_document([d]) for d in documents])
+    assert groups.tolist() == [0, 1, 2, 3, 4, 5, 0]
+
+
+def test_groups_continue_across_calls():
+    deduplicator = Deduplicator()
+    deduplicator.add_rows(["flexible schedule"], ["flexible schedule"])
+    groups = deduplicator.add_rows(["career growth", "Flexible schedule!"], ["career growth", "flexible schedule"])
+    assert groups.tolist() == [1, 0]
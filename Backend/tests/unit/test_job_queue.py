@@ -0,0 +1,44 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "processing_script"))
+
+from job_queue import SQLiteJobQueue, job_queue_from_url
+
+
+def test_messages_are_received_in_order_and_deleted(tmp_path):
+    queue = SQLiteJobQueue(str(tmp_path / "queue.db"))
+    queue.send({"job_id": "a"})
+    queue.send({"job_id": "b"})
+
+    first = queue.receive(wait_seconds=0)
+    second = queue.receive(wait_seconds=0)
+    assert [first.body, second.body] == [{"job_id": "a"}, {"job_id": "b"}]
+    assert queue.receive(wait_seconds=0) is None
+
+    queue.delete(first)
+    queue.delete(second)
+    assert queue.receive(wait_seconds=0, visibility_timeout=0) is None
+
+
+def test_unfinished_message_reappears_after_the_visibility_timeout(tmp_path):
+    queue = SQLiteJobQueue(str(tmp_path / "queue.db"))
+    queue.send({"job_id": "a"})
+
+    abandoned = queue.receive(wait_seconds=0, visibility_timeout=0)
+    retried = queue.receive(wait_seconds=0)
+    assert retried.body == {"job_id": "a"}
+    assert retried.receipt != abandoned.receipt
+
+    # The first receiver's receipt no longer deletes or extends the message
+    queue.delete(abandoned)
+    queue.extend(abandoned, 0)
+    assert queue.receive(wait_seconds=0) is None
+    queue.delete(retried)
+    assert queue.receive(wait_seconds=0, visibility_timeout=0) is None
+
+
+def test_sqlite_url_creates_the_queue_directory(tmp_path):
+    queue = job_queue_from_url(f"sqlite:///{tmp_path}/jobs/queue.db")
+    assert isinstance(queue, SQLiteJobQueue)
+    assert os.path.isfile(tmp_path / "jobs" / "queue.db")
@@ -0,0 +1,55 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "lambda_layers", "common", "python"))
+
+from job_registry import InMemoryJobRegistry
+
+
+def test_stage_transitions_and_result():
+    registry = InMemoryJobRegistry()
+    assert registry.get("job-1") is None
+
+    registry.update_stage("job-1", "SUBMITTED", execution_arn="arn:execution")
+    registry.update_stage("job-1", "FILTERING")
+    job = registry.get("job-1")
+    assert job["status"] == "RUNNING"
+    assert job["stage"] == "FILTERING"
+    assert job["execution_arn"] == "arn:execution"
+
+    registry.record_result("job-1", "SUCCEEDED", output={"insights": [], "summary": "ok"})
+    job = registry.get("job-1")
+    assert job["status"] == "SUCCEEDED"
+    assert job["output"] == {"insights": [], "summary": "ok"}
+
+
+def test_late_stage_updates_do_not_reopen_finished_jobs():
+    registry = InMemoryJobRegistry()
+    registry.record_result("job-2", "FAILED", error="InvalidQuery", cause="Invalid query.")
+    registry.update_stage("job-2", "CLUSTERING")
+
+    job = registry.get("job-2")
+    assert job["status"] == "FAILED"
+    assert job["error"] == "InvalidQuery"
+    assert "stage" not in job
+
+
+def test_returned_jobs_are_copies():
+    registry = InMemoryJobRegistry()
+    registry.record_result("job-3", "SUCCEEDED", output={"summary": "a"})
+    registry.get("job-3")["output"]["summary"] = "changed"
+    assert registry.get("job-3")["output"]["summary"] == "a"
+
+
+def test_cancelled_jobs_keep_their_status():
+    registry = InMemoryJobRegistry()
+    registry.update_stage("job-4", "CLUSTERING")
+    assert registry.cancel("job-4", "Cancelled by the user")
+    registry.update_stage("job-4", "GENERATING_INSIGHTS")
+    registry.record_result("job-4", "SUCCEEDED", output={"summary": "late"})
+
+    job = registry.get("job-4")
+    assert job["status"] == "CANCELLED"
+    assert job["stage"] == "CLUSTERING"
+    assert "output" not in job
+    assert not registry.cancel("job-4", "again")
@@ -0,0 +1,78 @@
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+pytest.importorskip("sklearn")
+pytest.importorskip("sentence_transformers")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "processing_script"))
+
+import processing_script
+from processing_script import StageSpans, cluster_labels, hashed_counts, lexical_vectors
+
+TOPICS = [
+    ["night shift", "understaffed", "exhausting", "overtime", "short staffed"],
+    ["pay", "salary", "raise", "underpaid", "wages"],
+    ["manager", "supportive", "listens", "team lead", "recognition"],
+]
+
+
+def topic_documents(rng, count):
+    """count documents for each topic, each a different mix of its words."""
+    documents = []
+    for words in TOPICS:
+        for _ in range(count):
+            picks = rng.choice(len(words), 3, replace=False)
+            documents.append(" ".join(words[i] for i in picks))
+    return documents
+
+
+def test_vectors_are_dense_unit_length_and_deterministic():
+    documents = topic_documents(np.random.RandomState(0), 50)
+    vectors = lexical_vectors(hashed_counts(documents), StageSpans(None))
+    assert vectors.shape[0] == 150
+    assert 1 < vectors.shape[1] <= processing_script.LEXICAL_DIMENSIONS
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1)
+    assert np.allclose(vectors, lexical_vectors(hashed_counts(documents), StageSpans(None)))
+
+
+def test_small_vocabulary_is_not_reduced():
+    # pay, is, low, pay is, is low, long, shifts, long shifts
+    vectors = lexical_vectors(hashed_counts(["pay is low", "long shifts", ""]), StageSpans(None))
+    assert vectors.shape == (3, 8)
+    assert np.allclose(vectors[0] @ vectors[1], 0)
+
+
+def test_topics_form_separate_clusters():
+    documents = topic_documents(np.random.RandomState(0), 100)
+    vectors = lexical_vectors(hashed_counts(documents), StageSpans(None))
+    labels, _ = cluster_labels(vectors, np.ones(len(vectors), dtype=np.int64), standardize=False)
+    found = set()
+    for topic in range(len(TOPICS)):
+        members = labels[topic * 100:(topic + 1) * 100]
+        assert (members == -1).mean() < 0.05
+        assert len(set(members) - {-1}) == 1
+        found |= set(members) - {-1}
+    assert len(found) == len(TOPICS)
+
+
+def test_sharded_job_reduces_every_shard_together(tmp_path):
+    documents = topic_documents(np.random.RandomState(0), 40)
+    rows = pd.DataFrame({"hl1": "Nursing", "comment__reason_to_leave": documents})
+    embeddings = tmp_path / "embeddings"
+    embeddings.mkdir()
+    for host, shard in (("algo-1", rows[::2]), ("algo-2", rows[1::2])):
+        shard_dir = tmp_path / host
+        shard_dir.mkdir()
+        shard.to_csv(shard_dir / "part-0.csv", index=False)
+        processing_script.main(str(shard_dir), str(embeddings), mode="embed", host=host, featurizer="lexical")
+        assert (embeddings / f"{host}.npz").exists()
+
+    processing_script.main(str(embeddings), str(tmp_path), mode="cluster")
+    results = pd.read_csv(tmp_path / "clustered_results.csv")
+    assert len(results) == len(rows)
+    assert {"cluster", "is_unique"} <= set(results.columns)
+    assert results.groupby("comment__reason_to_leave")["cluster"].nunique().max() == 1
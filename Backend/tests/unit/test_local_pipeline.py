@@ -0,0 +1,51 @@
+import io
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("botocore")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from botocore.exceptions import ClientError
+
+from local_pipeline.stand_ins import FakeDynamoDB, LocalS3
+
+
+def test_local_s3_round_trip_and_ranges(tmp_path):
+    s3 = LocalS3(str(tmp_path))
+    s3.put_object(Bucket="b", Key="raw/dataset_version=v1/survey.csv", Body=b"0123456789")
+    assert s3.get_object(Bucket="b", Key="raw/dataset_version=v1/survey.csv", Range="bytes=2-4")["Body"].read() == b"234"
+    assert s3.head_object(Bucket="b", Key="raw/dataset_version=v1/survey.csv")["ContentLength"] == 10
+    assert [item["Key"] for item in s3.list_objects_v2(Bucket="b", Prefix="raw/")["Contents"]] == [
+        "raw/dataset_version=v1/survey.csv"
+    ]
+    with pytest.raises(s3.exceptions.NoSuchKey):
+        s3.get_object(Bucket="b", Key="missing")
+
+
+def test_fake_dynamodb_conditions_match_start_query():
+    dynamodb = FakeDynamoDB({"jobs": "request_key"})
+    key = {"request_key": {"S": "k"}}
+    item = dict(key, job_id={"S": "a"}, expires_at={"N": "100"})
+    condition = "attribute_not_exists(request_key) OR expires_at < :now"
+
+    dynamodb.put_item(TableName="jobs", Item=item, ConditionExpression=condition,
+                      ExpressionAttributeValues={":now": {"N": "50"}})
+    with pytest.raises(ClientError):
+        dynamodb.put_item(TableName="jobs", Item=dict(item, job_id={"S": "b"}), ConditionExpression=condition,
+                          ExpressionAttributeValues={":now": {"N": "50"}})
+
+    dynamodb.update_item(TableName="jobs", Key=key, UpdateExpression="ADD subscribers :one",
+                         ExpressionAttributeValues={":one": {"N": "1"}})
+    dynamodb.update_item(TableName="jobs", Key=key, UpdateExpression="ADD subscribers :one",
+                         ExpressionAttributeValues={":one": {"N": "1"}})
+    assert dynamodb.get_item(TableName="jobs", Key=key)["Item"]["subscribers"] == {"N": "2"}
+
+    with pytest.raises(ClientError):
+        dynamodb.delete_item(TableName="jobs", Key=key, ConditionExpression="job_id = :job_id",
+                             ExpressionAttributeValues={":job_id": {"S": "b"}})
+    dynamodb.delete_item(TableName="jobs", Key=key, ConditionExpression="job_id = :job_id",
+                         ExpressionAttributeValues={":job_id": {"S": "a"}})
+    assert dynamodb.get_item(TableName="jobs", Key=key) == {}
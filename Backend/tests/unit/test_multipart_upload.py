@@ -0,0 +1,78 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "lambda_layers", "common", "python"))
+
+from multipart_upload import MAX_PARTS, MIB, MIN_PART_SIZE, find_upload_key, missing_parts, part_number_gaps, plan_parts
+
+
+def assert_valid(plan):
+    parts = plan["parts"]
+    assert len(parts) == plan["partCount"] <= MAX_PARTS
+    assert sum(part["size"] for part in parts) == plan["fileSize"]
+    assert all(part["size"] >= MIN_PART_SIZE for part in parts[:-1])
+    assert [part["partNumber"] for part in parts] == list(range(1, len(parts) + 1))
+
+
+def test_small_file_is_a_single_part():
+    plan = plan_parts(1000)
+    assert_valid(plan)
+    assert plan["partCount"] == 1
+
+
+def test_medium_file_is_split_for_parallelism():
+    plan = plan_parts(100 * MIB)
+    assert_valid(plan)
+    assert plan["partCount"] >= 7
+
+
+def test_huge_file_stays_within_part_limit():
+    plan = plan_parts(500 * 1024 * MIB)
+    assert_valid(plan)
+    assert plan["partSize"] % MIB == 0
+
+
+def test_invalid_sizes_are_rejected():
+    with pytest.raises(ValueError):
+        plan_parts(0)
+    with pytest.raises(ValueError):
+        plan_parts("10")
+
+
+def test_missing_parts_skips_complete_parts():
+    plan = plan_parts(40 * MIB)
+    uploaded = {
+        1: {"ETag": "a", "Size": plan["parts"][0]["size"]},
+        2: {"ETag": "b", "Size": 1},
+    }
+    missing = [part["partNumber"] for part in missing_parts(plan, uploaded)]
+    assert missing == list(range(2, plan["partCount"] + 1))
+
+
+def test_part_number_gaps():
+    assert part_number_gaps([1, 2, 4]) == [3]
+    assert part_number_gaps([2, 3]) == [1]
+    assert part_number_gaps([1, 2, 3]) == []
+
+
+class FakeS3:
+    def __init__(self, pages):
+        self.pages = pages
+
+    def get_paginator(self, operation):
+        assert operation == "list_multipart_uploads"
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        return [{"Uploads": [upload for upload in page if upload["Key"].startswith(Prefix)]} for page in self.pages]
+
+
+def test_upload_key_is_found_from_the_upload_id():
+    s3 = FakeS3([
+        [{"UploadId": "a", "Key": "raw/dataset_version=v1/survey.csv"}],
+        [{"UploadId": "b", "Key": "raw/dataset_version=v2/survey.csv.gz"}],
+    ])
+    assert find_upload_key(s3, "bucket", "b", "raw/") == "raw/dataset_version=v2/survey.csv.gz"
+    assert find_upload_key(s3, "bucket", "c", "raw/") is None
@@ -0,0 +1,66 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "lambda_functions", "process_query"))
+
+from processing_plan import CLUSTER_SAMPLE_SIZE, MAX_INSTANCES, MAX_VOLUME_GB, MIN_VOLUME_GB, plan_processing
+
+
+def test_small_jobs_run_on_one_small_instance():
+    plan = plan_processing(row_count=50, input_bytes=40_000, shard_count=1)
+    assert plan == {
+        "backend": "sagemaker",
+        "sharded": False,
+        "shards": 1,
+        "instance_type": "ml.m5.large",
+        "instance_count": 1,
+        "input_mode": "File",
+        "volume_size_gb": MIN_VOLUME_GB + 1,
+        "cluster_sample_size": CLUSTER_SAMPLE_SIZE,
+        "featurizer": "transformer",
+        "cluster_by": "row",
+    }
+
+
+def test_single_instance_grows_with_rows():
+    assert plan_processing(12_000, 10_000_000, 1)["instance_type"] == "ml.c5.xlarge"
+    assert plan_processing(24_000, 20_000_000, 1)["instance_type"] == "ml.c5.2xlarge"
+
+
+def test_large_jobs_scale_out_one_instance_per_shard():
+    plan = plan_processing(row_count=100_000, input_bytes=400 * 1024 ** 2, shard_count=4)
+    assert plan["sharded"]
+    assert plan["instance_count"] == 4
+    assert plan["instance_type"] == "ml.c5.2xlarge"
+    assert plan["merge_instance_type"] == "ml.m5.2xlarge"
+
+
+def test_instance_count_is_capped_and_volumes_bounded():
+    plan = plan_processing(row_count=1_000_000, input_bytes=200 * 1024 ** 3, shard_count=40, input_mode="Pipe")
+    assert plan["instance_count"] == MAX_INSTANCES
+    assert plan["merge_instance_type"] == "ml.r5.4xlarge"
+    # Each of the 10 instances takes 4 of the 40 shards: 20 GiB of input,
+    # streamed rather than stored
+    assert plan["volume_size_gb"] == MIN_VOLUME_GB + 60
+    assert plan["merge_volume_size_gb"] == MAX_VOLUME_GB
+
+
+def test_only_unsharded_jobs_go_to_the_worker_pool():
+    assert plan_processing(500, 400_000, 1, backend="worker")["backend"] == "worker"
+    assert plan_processing(100_000, 400 * 1024 ** 2, 4, backend="worker")["backend"] == "sagemaker"
+
+
+def test_file_input_is_stored_on_the_volume():
+    piped = plan_processing(20_000, 10 * 1024 ** 3, 1, input_mode="Pipe")
+    downloaded = plan_processing(20_000, 10 * 1024 ** 3, 1, input_mode="File")
+    assert downloaded["input_mode"] == "File"
+    assert downloaded["volume_size_gb"] - piped["volume_size_gb"] == 10
+
+
+def test_featurizer_is_carried_in_the_plan():
+    assert plan_processing(500, 400_000, 1, featurizer="lexical")["featurizer"] == "lexical"
+    assert plan_processing(100_000, 400 * 1024 ** 2, 4, featurizer="lexical")["featurizer"] == "lexical"
+    with pytest.raises(ValueError):
+        plan_processing(500, 400_000, 1, featurizer="bag-of-words")
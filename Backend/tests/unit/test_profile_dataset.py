@@ -0,0 +1,77 @@
+import io
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("boto3")
+from botocore.exceptions import ClientError
+
+HERE = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(HERE, "..", "..", "lambda_layers", "common", "python"))
+sys.path.insert(0, os.path.join(HERE, "..", "..", "lambda_functions", "profile_dataset"))
+
+HEADERS = ["ID", "Market", "Comment: Reason to Stay"]
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-west-2")
+os.environ.setdefault("BUCKET_NAME", "test-bucket")
+os.environ.setdefault("EXPECTED_HEADERS", json.dumps(HEADERS))
+
+import profile_dataset
+from datasets import ACTIVE_POINTER_KEY
+
+
+class FakeS3:
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[(Bucket, Key)] = Body
+
+    def get_object(self, Bucket, Key, Range=None):
+        if (Bucket, Key) not in self.objects:
+            raise self.exceptions.NoSuchKey()
+        data = self.objects[(Bucket, Key)]
+        if Range:
+            start, end = (int(n) for n in Range[len("bytes="):].split("-"))
+            data = data[start:end + 1]
+        return {"Body": io.BytesIO(data)}
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, "HeadObject")
+        return {"ContentLength": len(self.objects[(Bucket, Key)]), "ETag": '"etag"'}
+
+    def copy(self, CopySource, Bucket, Key):
+        self.objects[(Bucket, Key)] = self.objects[(CopySource["Bucket"], CopySource["Key"])]
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    fake = FakeS3()
+    monkeypatch.setattr(profile_dataset, "s3_client", fake)
+    return fake
+
+
+def test_legacy_upload_is_registered_and_activated(s3):
+    s3.objects[("test-bucket", "raw/survey.csv")] = b"ID,Market,Comment: Reason to Stay\n1,West,Great team\n"
+
+    result = profile_dataset.lambda_handler({"bootstrap": True}, None)
+    assert result["bootstrapped"] and result["valid"]
+    version = result["dataset_version"]
+    assert ("test-bucket", f"raw/dataset_version={version}/survey.csv") in s3.objects
+    pointer = json.loads(s3.objects[("test-bucket", ACTIVE_POINTER_KEY)])
+    assert pointer["dataset_version"] == version
+
+    # A second deploy leaves the active version alone
+    assert profile_dataset.lambda_handler({"bootstrap": True}, None)["bootstrapped"] is False
+
+
+def test_nothing_to_bootstrap_without_a_legacy_upload(s3):
+    assert profile_dataset.lambda_handler({"bootstrap": True}, None)["bootstrapped"] is False
+    assert ("test-bucket", ACTIVE_POINTER_KEY) not in s3.objects
@@ -0,0 +1,55 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "lambda_functions", "validate_query"))
+
+from query_classifier import classify_query, parse_verdict
+
+
+def test_survey_questions_are_valid_locally():
+    for query in [
+        "What are the top insights from the survey?",
+        "Can you provide overall feedback?",
+        "What are the most common negative comments?",
+        "Why are nurses in the West region burning out?",
+        "What is the overall employee sentiment?",
+    ]:
+        assert classify_query(query) == "Valid", query
+
+
+def test_off_topic_questions_are_invalid_locally():
+    for query in [
+        "What is the weather today?",
+        "Tell me a joke",
+        "What was last quarter's revenue?",
+    ]:
+        assert classify_query(query) == "Invalid", query
+
+
+def test_empty_or_missing_queries_are_invalid():
+    assert classify_query(None) == "Invalid"
+    assert classify_query("") == "Invalid"
+    assert classify_query("  ?? ") == "Invalid"
+
+
+def test_ambiguous_queries_are_escalated():
+    assert classify_query("How does the weather affect employee morale?") is None
+    assert classify_query("Anything interesting?") is None
+
+
+def test_everyday_words_do_not_approve_a_query():
+    for query in [
+        "How much should I pay for a used car?",
+        "Where should I stay in Paris?",
+        "How do I fix issues with my team's laptop?",
+    ]:
+        assert classify_query(query) is None, query
+
+
+def test_parse_verdict():
+    assert parse_verdict("Invalid") == "Invalid"
+    assert parse_verdict(" invalid.") == "Invalid"
+    assert parse_verdict("Valid") == "Valid"
+    assert parse_verdict("Valid.") == "Valid"
+    assert parse_verdict("") == "Invalid"
+    assert parse_verdict("I cannot tell") == "Invalid"
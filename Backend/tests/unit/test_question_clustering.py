@@ -0,0 +1,88 @@
+import json
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+pytest.importorskip("sklearn")
+pytest.importorskip("sentence_transformers")
+
+SCRIPT_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "processing_script")
+sys.path.insert(0, SCRIPT_DIR)
+
+import processing_script
+
+LEAVE = ["Pay is too low", "pay is too low!", "Long night shifts", "long night shifts.", "PAY IS TOO LOW"]
+STAY = ["Great team", "great team!", "Flexible schedule", "", "N/A"]
+
+
+def survey_rows(repeat):
+    return pd.DataFrame({
+        "hl1": ["Nursing", "Pharmacy"] * (len(LEAVE) * repeat // 2) + ["Nursing"] * (len(LEAVE) * repeat % 2),
+        "comment__reason_to_leave": LEAVE * repeat,
+        "comment__reason_to_stay": STAY * repeat,
+    })
+
+
+def run_all(tmp_path, rows, name="all"):
+    input_dir, output_dir = tmp_path / f"{name}-in", tmp_path / f"{name}-out"
+    input_dir.mkdir()
+    output_dir.mkdir()
+    rows.to_csv(input_dir / "part-0.csv", index=False)
+    processing_script.main(str(input_dir), str(output_dir), featurizer="lexical", cluster_by="question")
+    with open(output_dir / processing_script.SUMMARIES_FILE) as f:
+        return pd.read_csv(output_dir / "clustered_results.csv"), json.load(f)
+
+
+def test_each_question_is_clustered_without_its_empty_answers(tmp_path):
+    results, summaries = run_all(tmp_path, survey_rows(4))
+    assert "cluster" not in results.columns
+    stay = results["cluster_comment__reason_to_stay"]
+    assert stay[results["comment__reason_to_stay"].isna()].isna().all()
+    assert not results["is_unique_comment__reason_to_stay"][stay.isna()].any()
+    assert stay.notna().sum() == 12
+
+    assert [summary["question"] for summary in summaries["questions"]] == [
+        "comment__reason_to_leave", "comment__reason_to_stay"
+    ]
+    stay_summary = summaries["questions"][1]
+    assert stay_summary["answered"] == 12
+    # Largest first, each with its first answer
+    assert [(cluster["representative"], cluster["rows"]) for cluster in stay_summary["clusters"]] == [
+        ("Great team", 8), ("Flexible schedule", 4)
+    ]
+    leave = results["cluster_comment__reason_to_leave"]
+    assert leave.notna().all()
+    assert leave.nunique() == 2
+
+
+def test_questions_run_in_separate_processes(tmp_path, monkeypatch):
+    inline, _ = run_all(tmp_path, survey_rows(4), "inline")
+    monkeypatch.setattr(processing_script.os, "cpu_count", lambda: 2)
+    # Spawned processes import the script by name, ahead of Backend's own copy
+    monkeypatch.syspath_prepend(SCRIPT_DIR)
+    pooled, _ = run_all(tmp_path, survey_rows(4), "pooled")
+    pd.testing.assert_frame_equal(inline, pooled)
+
+
+def test_sharded_job_matches_a_single_instance(tmp_path):
+    rows = survey_rows(4)
+    single, _ = run_all(tmp_path, rows)
+    embeddings = tmp_path / "embeddings"
+    embeddings.mkdir()
+    for host, shard in (("algo-1", rows.iloc[:10]), ("algo-2", rows.iloc[10:])):
+        shard_dir = tmp_path / host
+        shard_dir.mkdir()
+        shard.to_csv(shard_dir / "part-0.csv", index=False)
+        processing_script.main(str(shard_dir), str(embeddings), mode="embed", host=host, featurizer="lexical",
+                               cluster_by="question")
+    processing_script.main(str(embeddings), str(tmp_path), mode="cluster", cluster_by="question")
+    sharded = pd.read_csv(tmp_path / "clustered_results.csv")
+
+    for question in ("comment__reason_to_leave", "comment__reason_to_stay"):
+        column = f"cluster_{question}"
+        pairs = set(zip(single[column].fillna(-2), sharded[column].fillna(-2)))
+        # The same partition of the rows, up to the numbering of the clusters
+        assert len(pairs) == single[column].fillna(-2).nunique() == sharded[column].fillna(-2).nunique()
@@ -0,0 +1,64 @@
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "lambda_functions", "generate_insights"))
+
+from representatives import EmptyCSVError, format_question_summaries, select_representatives
+
+CSV = (
+    "id,comment_reason_to_stay,combined_comments,cluster,is_unique\n"
+    "1,pay,pay,0,False\n"
+    "2,team,team,1,False\n"
+    "3,pay again,pay again,0,False\n"
+    "4,\"odd, one\",odd,-1,True\n"
+    "5,team too,team too,1.0,True\n"
+)
+
+
+def test_unique_rows_then_first_row_of_each_cluster():
+    header, row_count, rows = select_representatives(io.StringIO(CSV))
+    assert row_count == 5
+    assert "combined_comments" in header
+    assert [row["id"] for row in rows] == ["4", "5", "1", "2"]
+    assert all("combined_comments" not in row for row in rows)
+
+
+def test_row_that_is_unique_and_first_in_cluster_appears_once():
+    data = "id,cluster,is_unique\n1,0,True\n2,0,False\n"
+    _, _, rows = select_representatives(io.StringIO(data))
+    assert [row["id"] for row in rows] == ["1"]
+
+
+def test_empty_file():
+    with pytest.raises(EmptyCSVError):
+        select_representatives(io.StringIO(""))
+
+
+def test_question_summaries_are_formatted_per_question():
+    summaries = {"questions": [
+        {
+            "question": "comment__reason_to_leave",
+            "answered": 5,
+            "clusters": [{"cluster": 0, "rows": 3, "representative": "pay is low"}],
+            "cluster_count": 2,
+            "unique_rows": 1,
+            "unique_answers": ["odd one"],
+        },
+        {
+            "question": "comment__burnout_reason",
+            "answered": 0,
+            "clusters": [],
+            "cluster_count": 0,
+            "unique_rows": 0,
+            "unique_answers": [],
+        },
+    ]}
+    text = format_question_summaries(summaries)
+    assert text.startswith("Question: Reason to leave (5 answers)\nCluster 1 (3 rows):\n- pay is low\n")
+    assert "(1 smaller clusters not shown)" in text
+    assert "- odd one" in text
+    assert "Burnout" not in text
+    assert format_question_summaries({"questions": summaries["questions"][1:]}) == ""
@@ -0,0 +1,46 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "lambda_functions", "start_query"))
+
+from request_coalescing import canonical_request_key
+
+
+def test_equivalent_requests_share_a_key():
+    a = canonical_request_key(
+        "What are the top insights?",
+        [{"market": ["West", "East"]}, {"region": "Pacific"}],
+    )
+    b = canonical_request_key(
+        "  what are the   TOP insights ",
+        [{"region": ["Pacific"]}, {"market": ["East", "West", "East"]}],
+    )
+    assert a == b
+
+
+def test_different_requests_get_different_keys():
+    base = canonical_request_key("What are the top insights?", [{"market": "West"}])
+    assert base != canonical_request_key("What are the top insights?", [{"market": "East"}])
+    assert base != canonical_request_key("What is the overall sentiment?", [{"market": "West"}])
+    assert base != canonical_request_key("What are the top insights?", None)
+
+
+def test_missing_filters_and_empty_filters_match():
+    assert canonical_request_key("q", None) == canonical_request_key("q", [])
+
+
+def test_dataset_version_is_part_of_the_key():
+    a = canonical_request_key("q", [{"market": "West"}], "v20240101T000000Z-0000000a")
+    b = canonical_request_key("q", [{"market": "West"}], "v20240201T000000Z-0000000b")
+    assert a != b
+    assert a == canonical_request_key("q", [{"market": "West"}], "v20240101T000000Z-0000000a")
+
+
+def test_featurizer_is_part_of_the_key():
+    lexical = canonical_request_key("q", None, "v1", "lexical")
+    assert lexical != canonical_request_key("q", None, "v1", "transformer")
+    assert canonical_request_key("q", None, "v1") == canonical_request_key("q", None, "v1", "transformer")
+
+
+def test_clustering_unit_is_part_of_the_key():
+    assert canonical_request_key("q", None, "v1", cluster_by="question") != canonical_request_key("q", None, "v1")
@@ -0,0 +1,96 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "lambda_layers", "common", "python"))
+
+import tracing
+
+JOB_ID = "3103eade-0430-4f25-b99c-c9794590e7dc"
+
+
+def read_spans(path):
+    with open(path) as f:
+        return {span["name"]: span for span in map(json.loads, f)}
+
+
+def test_handler_spans_join_the_job_trace_through_the_traceparent(tmp_path, monkeypatch):
+    monkeypatch.setenv("TRACE_EXPORTER", "file")
+    monkeypatch.setenv("TRACE_FILE", str(tmp_path / "spans.jsonl"))
+    upstream = tracing.Tracer("start_query")
+    downstream = tracing.Tracer("process_query")
+
+    @upstream.handler("start_query")
+    def start(event, context):
+        # The job id is only known part-way through the handler
+        with upstream.span("reserve_job"):
+            pass
+        upstream.current_span().set_job_id(JOB_ID)
+        return upstream.current_span().traceparent()
+
+    @downstream.handler("process_query")
+    def process(event, context):
+        with downstream.span("athena.query", data_scanned_bytes=10):
+            return "done"
+
+    traceparent = start({}, None)
+    assert process({"job_id": JOB_ID, "traceparent": traceparent}, None) == "done"
+
+    spans = read_spans(tmp_path / "spans.jsonl")
+    trace_id = tracing.trace_id_for(JOB_ID)
+    assert {span["trace_id"] for span in spans.values()} == {trace_id}
+    assert spans["reserve_job"]["parent_span_id"] == spans["start_query"]["span_id"]
+    assert spans["process_query"]["parent_span_id"] == spans["start_query"]["span_id"]
+    assert spans["athena.query"]["parent_span_id"] == spans["process_query"]["span_id"]
+    assert spans["athena.query"]["attributes"] == {"data_scanned_bytes": 10}
+
+
+def test_errors_are_recorded_and_reraised(tmp_path, monkeypatch):
+    monkeypatch.setenv("TRACE_EXPORTER", "file")
+    monkeypatch.setenv("TRACE_FILE", str(tmp_path / "spans.jsonl"))
+    tracer = tracing.Tracer("generate_insights")
+
+    @tracer.handler("generate_insights")
+    def handler(event, context):
+        raise ValueError("no rows")
+
+    with pytest.raises(ValueError):
+        handler({"job_id": JOB_ID}, None)
+
+    span = read_spans(tmp_path / "spans.jsonl")["generate_insights"]
+    assert span["status"] == "ERROR"
+    assert span["attributes"]["error"] == "ValueError: no rows"
+
+
+def test_recorded_spans_and_otlp_conversion():
+    tracer = tracing.Tracer("process_query")
+    parent = tracing.format_traceparent(tracing.trace_id_for(JOB_ID), "00f067aa0ba902b7")
+    span = tracer.record("athena.queue", 1000, 5000, parent=parent, queue_ms=0)
+    assert span.parent_span_id == "00f067aa0ba902b7"
+
+    request = tracing.to_otlp([span.to_dict()])
+    exported = request["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+    assert request["resourceSpans"][0]["resource"]["attributes"][0]["value"] == {"stringValue": "process_query"}
+    assert exported["traceId"] == tracing.trace_id_for(JOB_ID)
+    assert exported["startTimeUnixNano"] == "1000"
+    assert exported["attributes"] == [{"key": "queue_ms", "value": {"intValue": "0"}}]
+
+
+def test_malformed_traceparent_starts_a_new_trace():
+    assert tracing.parse_traceparent("not-a-traceparent") is None
+    tracer = tracing.Tracer("validate_query")
+    with tracer.span("validate_query", parent="00-zz-yy-01") as span:
+        assert span.parent_span_id is None
+        assert len(span.trace_id) == 32
+
+
+def test_export_failures_do_not_raise(monkeypatch, capsys):
+    monkeypatch.setenv("TRACE_EXPORTER", "otlp")
+    monkeypatch.setenv("OTEL_EXPORTER_OTLP_ENDPOINT", "http://127.0.0.1:9")
+    tracer = tracing.Tracer("check_status")
+    with tracer.span("check_status"):
+        pass
+    tracer.flush()
+    assert "Could not export 1 trace spans" in capsys.readouterr().out